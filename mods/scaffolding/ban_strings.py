@@ -0,0 +1,45 @@
+from typing import Any
+from quote_mod_sdk.mod import ActionBuilder
+from quote_mod_sdk import mod, Prefilled, ForwardPass, ModEvent
+
+from max.driver import Tensor
+
+from mods.utils import BannedStrings, BatchedActionBuilder, BatchedForwardPass, batched_forward_pass
+
+# Any token whose decoded text contains one of these strings is masked. Add as many as needed:
+# they are resolved to a single int32 index array once per tokenizer, so the per-pass cost stays flat.
+BANNED = BannedStrings([
+    "—",
+    "–",
+    "delve",
+    "tapestry",
+    "As an AI",
+])
+
+@mod
+def ban_strings(event: ModEvent, action: ActionBuilder, tokenizer: Any):
+    """
+    This mod bans a list of characters and phrases by masking every vocabulary token that contains them.
+
+    Only tokens that contain a whole banned string are masked. A phrase that the model spells across several
+    tokens needs a backtrack rule (see mods.utils.TriggerSet) instead.
+
+    The vocabulary is decoded and indexed at the first Prefilled, so no decode step pays for it.
+    """
+    if isinstance(event, Prefilled):
+        BANNED.warm(tokenizer)
+        return action.noop()
+    if isinstance(event, ForwardPass):
+        logits = event.logits.to_numpy()
+        BANNED.apply(logits, tokenizer)
+        return action.adjust_logits(Tensor.from_numpy(logits))
+    return action.noop()
+
+@batched_forward_pass(ban_strings)
+def ban_strings_batched(event: BatchedForwardPass, action: BatchedActionBuilder, tokenizer: Any):
+    """
+    Masks the banned columns of the whole [batch, vocab] matrix in one assignment.
+    """
+    logits = event.to_numpy()
+    BANNED.apply(logits, tokenizer)
+    return action.adjust_logits(Tensor.from_numpy(logits))
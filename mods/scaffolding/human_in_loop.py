@@ -1,24 +1,46 @@
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Optional
 from quote_mod_sdk.mod import ActionBuilder
 from quote_mod_sdk import mod, Prefilled, ForwardPass, Added, ModEvent
 from quote_mod_sdk.self_prompt import SelfPrompt
 from quote_mod_sdk.strategies.strategy_constructor import UntilStrat, UntilEndType
 
+from mods.utils import BatchedActionBuilder, BatchedForwardPass, ConfidenceTracker, RequestStore, batched_forward_pass, constant_ids, intern, logsumexp_f32, logsumexp_rows
+
 import numpy as np
 import math
 
 
+# Confidence is checked once this many tokens have been generated
+MIN_TOKENS = 100
+THRESHOLD = 0.5
+# Geometric mean over the whole sequence by default; set WINDOW (tokens) or EMA (weight of the newest token)
+# to react to a recent drop instead
+WINDOW: Optional[int] = None
+EMA: Optional[float] = None
+
+# Encoded once per tokenizer (and cached on disk), not on every event
+WAIT = intern(" - Wait, I am uncertain about something.")
+QUESTION_OPEN = intern("<question_to_user>")
+QUESTION_CLOSE = intern("</question_to_user>")
+
 clarify_prompt = SelfPrompt(
-    prompt={"text", " I need more information from the user. I should only ask about that. I should wrap my question in XML (starting with <question_to_user>) so the client-side chat can process it so I should say (I must close the question tag with </question_to_user> when done):"},
-    strategy=UntilStrat("<question_to_user>", UntilEndType.TAG, "</question_to_user>"),
+    prompt={"text": " I need more information from the user. I should only ask about that. I should wrap my question in XML (starting with <question_to_user>) so the client-side chat can process it so I should say (I must close the question tag with </question_to_user> when done):"},
+    strategy=UntilStrat(QUESTION_OPEN, UntilEndType.TAG, QUESTION_CLOSE),
 )
 
 class State:
-    curr_logits: np.darray | None = None
-    sequence_probabilities: list[float] = []
-    clarify: SelfPrompt | None = None
+    def __init__(self):
+        self.curr_logits: np.ndarray | None = None
+        self.curr_lse: float | None = None
+        self.confidence = ConfidenceTracker(window=WINDOW, ema=EMA)
+        self.clarify: SelfPrompt | None = None
 
-state: Dict[str, State] = {}
+    def nbytes(self) -> int:
+        held = self.curr_logits.nbytes if self.curr_logits is not None else 0
+        return held + self.confidence.nbytes()
+
+# Bounded so finished requests cannot pile up full-vocab logits rows
+state: RequestStore[State] = RequestStore(State, name="human_in_loop", max_bytes=256 << 20)
 
 @mod
 def human_in_loop(event: ModEvent, action: ActionBuilder, tokenizer: Any):
@@ -26,18 +48,19 @@ def human_in_loop(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     This mod calculates a measure of confidence over a sequence of tokens. If that measure of confidence
     drops too low, that kicks off a SelfPrompt that asks the user a clarify question.
     """
-    if state.get(event.request_id):
-        req_state = state[event.request_id]
-    else:
-        state[event.request_id] = State()
-        req_state = state[event.request_id]
+    # Our state for this request was evicted; fresh state would not match its sequence
+    if state.evicted(event.request_id):
+        return action.noop()
+    req_state = state.get(event.request_id)
 
     # if we have a self prompt defined, step it forward until answered
     if req_state.clarify:
         answer_tokens = req_state.clarify.answer_tokens(event.request_id)
         if answer_tokens:
-            # strip out the tags
-            answer_tokens = answer_tokens[len("<question_to_user>"):-1*len("</question_to_user>")]
+            # strip out the tags, measured in tokens rather than characters
+            open_len = len(constant_ids(tokenizer, QUESTION_OPEN))
+            close_len = len(constant_ids(tokenizer, QUESTION_CLOSE))
+            answer_tokens = answer_tokens[open_len:len(answer_tokens) - close_len]
             return action.force_output(answer_tokens)
         elif isinstance(event, Prefilled):
             return req_state.clarify.handle_prefilled(event)
@@ -51,71 +74,51 @@ def human_in_loop(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     if isinstance(event, ForwardPass):
         logits = event.logits.to_numpy()
         req_state.curr_logits = logits
+        req_state.curr_lse = logsumexp_f32(logits)
     if isinstance(event, Added):
-        if event.forced:
-            req_state.sequence_probabilities.append(1.0)
-        elif len(event.added_tokens) > 1:
-            for i in event.added_tokens:
-                req_state.sequence_probabilities.append(1.0)
+        tracker = req_state.confidence
+        if event.forced or len(event.added_tokens) > 1:
+            tracker.push_certain(len(event.added_tokens))
         else:
-            assert req_state.curr_logits, "No logits"
-            req_state.sequence_probabilities.append(selected_token_prob(req_state.curr_logits, event.added_tokens[0]))
+            assert req_state.curr_logits is not None, "No logits"
+            tracker.push(selected_token_logprob(req_state.curr_logits, event.added_tokens[0], req_state.curr_lse))
 
-        if len(req_state.sequence) > 100:
-            # any time after 100 tokens, calculate the sequence confidence by checking the geometric mean
-            conf = sequence_confidence(req_state.sequence)
-            if conf and conf < 0.5:
+        if len(tracker) > MIN_TOKENS:
+            # any time after MIN_TOKENS tokens, check the running geometric mean of token probabilities
+            conf = tracker.confidence()
+            if conf is not None and conf < THRESHOLD:
                 req_state.clarify = clarify_prompt
-                action.force_tokens(tokenizer.encode(" - Wait, I am uncertain about something."))
+                return action.force_tokens(constant_ids(tokenizer, WAIT))
     return action.noop()
 
-def sequence_confidence(token_probs: Iterable[float]) -> Optional[float]:
+@batched_forward_pass(human_in_loop)
+def human_in_loop_batched(event: BatchedForwardPass, action: BatchedActionBuilder, tokenizer: Any):
     """
-    Geometric mean over provided token probabilities.
-    Returns None if the iterator is empty.
+    Batched ForwardPass handler: one host copy and one log-sum-exp over the [batch, vocab] matrix per step.
+    Requests in the middle of a self prompt are deferred to the per-request mod.
     """
-    vals = [float(x) for x in token_probs if x is not None]
-    if not vals:
-        return None
-    logs = [math.log(max(min(v, 1.0), 1e-32)) for v in vals]
-    return float(math.exp(sum(logs) / len(logs)))
+    logits = event.to_numpy()
+    lse = logsumexp_rows(logits)
+    defer = []
+    for i, request_id in enumerate(event.request_ids):
+        if state.evicted(request_id):
+            continue
+        req_state = state.get(request_id)
+        if req_state.clarify:
+            defer.append(request_id)
+            continue
+        # A copy of the row: a view would keep the whole [batch, vocab] host copy alive per request
+        req_state.curr_logits = logits[i].copy()
+        req_state.curr_lse = float(lse[i])
+    return action.defer(defer)
 
 
-def logsumexp(x: np.ndarray) -> float:
+def selected_token_logprob(logits_row: np.ndarray, token_id: int, lse: float) -> float:
     """
-    Stable log-sum-exp for 1D arrays.
+    log p(token_id) from a raw logits row and its log-sum-exp. Raises ValueError on an out-of-range token.
     """
-    arr = np.asarray(x, dtype=np.float64)
-    if arr.ndim != 1:
-        arr = arr.reshape(-1)
-    if arr.size == 0:
-        return float("-inf")
-    m = float(np.max(arr))
-    # Avoid overflow in exp; if m is -inf handle gracefully
-    if not math.isfinite(m):
-        return m
-    s = float(np.sum(np.exp(arr - m)))
-    return float(m + math.log(s))
-
-
-def selected_token_prob(logits_row: np.ndarray, token_id: int) -> float:
-    """
-    Compute p(token_id) from the raw model logits row via softmax.
-
-    Returns a Python float in [0,1]. Raises ValueError on invalid input.
-    """
-    row = np.asarray(logits_row, dtype=np.float64)
-    if row.ndim != 1:
-        row = row.reshape(-1)
-    if token_id < 0 or token_id >= row.size:
-        raise ValueError(f"token_id {token_id} out of bounds for logits row of size {row.size}")
-    lse = logsumexp(row)
+    if token_id < 0 or token_id >= logits_row.shape[-1]:
+        raise ValueError(f"token_id {token_id} out of bounds for logits row of size {logits_row.shape[-1]}")
     if not math.isfinite(lse):  # all -inf case
-        return 0.0
-    val = float(math.exp(float(row[int(token_id)]) - lse))
-    # Numerical guard
-    if val < 0.0:
-        return 0.0
-    if val > 1.0:
-        return 1.0
-    return val
+        return float("-inf")
+    return float(logits_row[..., int(token_id)]) - lse
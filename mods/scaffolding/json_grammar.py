@@ -0,0 +1,95 @@
+from typing import Any
+from quote_mod_sdk.mod import ActionBuilder
+from quote_mod_sdk import mod, Prefilled, ForwardPass, Added, ModEvent
+
+from max.driver import Tensor
+
+from mods.utils import BatchedActionBuilder, BatchedForwardPass, ByTokenizer, INITIAL, JSONGrammar, JSONState, RequestStore, batched_forward_pass, on_backtrack
+
+import numpy as np
+
+# Restrict the document root, JSON-Schema style ("object", "array", ...). None allows any JSON value.
+ROOT_TYPES = ("object", "array")
+
+# One compiled grammar per tokenizer; masks are cached inside it across requests
+grammars: ByTokenizer[JSONGrammar] = ByTokenizer()
+
+def grammar_for(tokenizer: Any, vocab_size: int | None = None) -> JSONGrammar:
+    # Built at Prefilled from len(tokenizer); rebuilt once if the logits turn out to be a different width
+    grammar = grammars.get(tokenizer)
+    if grammar is None or (vocab_size is not None and grammar.vocab_size != vocab_size):
+        grammar = grammars.set(tokenizer, JSONGrammar.from_tokenizer(tokenizer, vocab_size or len(tokenizer), root_types=ROOT_TYPES))
+    return grammar
+
+class GrammarState:
+    def __init__(self):
+        # Parser checkpoint after each generated token ([0] before any); None once a forced token left the grammar
+        self.parsers: list[JSONState | None] = [INITIAL]
+
+    @property
+    def parser(self) -> JSONState | None:
+        return self.parsers[-1]
+
+state: RequestStore[GrammarState] = RequestStore(GrammarState, name="json_grammar")
+
+def json_grammar_backtracked(ev: ModEvent, n: int):
+    # Inside a composition another mod removed the last n tokens; the replacement follows as a forced Added
+    req_state = state.peek(ev.request_id)
+    if req_state is not None and n:
+        del req_state.parsers[max(1, len(req_state.parsers) - n):]
+
+@mod
+@on_backtrack(json_grammar_backtracked)
+def json_grammar(event: ModEvent, action: ActionBuilder, tokenizer: Any):
+    """
+    This mod constrains the whole response to valid JSON. Instead of validating and backtracking like
+    valid_json.py, it masks every token that cannot continue valid JSON before sampling.
+
+    The grammar is compiled against the vocabulary once per tokenizer, at the first Prefilled. After that each
+    step is one cached mask lookup plus one np.where. The parser state is kept per token, so a backtrack by
+    another mod in the same composition restores it without re-parsing.
+    """
+    if isinstance(event, Prefilled):
+        grammar_for(tokenizer)
+        return action.noop()
+    if state.evicted(event.request_id):
+        return action.noop()
+    req_state = state.get(event.request_id)
+
+    if isinstance(event, ForwardPass):
+        if req_state.parser is None:
+            # A forced token left the grammar; stop constraining this request
+            return action.noop()
+        logits = event.logits.to_numpy()
+        mask = grammar_for(tokenizer, logits.shape[-1]).mask(req_state.parser)
+        return action.adjust_logits(Tensor.from_numpy(np.where(mask, logits, -1e9).astype(logits.dtype, copy=False)))
+    if isinstance(event, Added):
+        grammar = grammar_for(tokenizer)
+        parsers = req_state.parsers
+        for tok in event.added_tokens:
+            parser = parsers[-1]
+            parsers.append(grammar.advance(parser, int(tok)) if parser is not None else None)
+    return action.noop()
+
+@batched_forward_pass(json_grammar)
+def json_grammar_batched(event: BatchedForwardPass, action: BatchedActionBuilder, tokenizer: Any):
+    """
+    Stacks the cached mask of every constrained request and applies them with one np.where.
+    """
+    logits = event.to_numpy()
+    grammar = grammar_for(tokenizer, logits.shape[-1])
+    rows, masks = [], []
+    for i, request_id in enumerate(event.request_ids):
+        if state.evicted(request_id):
+            continue
+        parser = state.get(request_id).parser
+        if parser is not None:
+            rows.append(i)
+            masks.append(grammar.mask(parser))
+    if not rows:
+        return action.noop()
+    if len(rows) == len(event.request_ids):
+        logits = np.where(np.stack(masks), logits, -1e9).astype(logits.dtype, copy=False)
+    else:
+        logits[rows] = np.where(np.stack(masks), logits[rows], -1e9)
+    return action.adjust_logits(Tensor.from_numpy(logits))
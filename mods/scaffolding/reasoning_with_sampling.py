@@ -1,5 +1,9 @@
 from quote_mod_sdk.mod import ActionBuilder
 from quote_mod_sdk import mod, ForwardPass, Added
+
+from max.driver import Tensor
+
+from mods.utils import BatchedActionBuilder, BatchedForwardPass, BranchesSampled, RequestStore, SequenceScored, batched_forward_pass, fork_branches, score_sequence
 from enum import Enum, auto
 from typing import Any
 
@@ -7,149 +11,360 @@ import math
 import random
 import numpy as np
 
-def log_softmax(logits: np.ndarray) -> np.ndarray:
-    x = logits.astype(np.float64, copy=False)
-    m = x.max()
-    shifted = x - m
-    lse = m + np.log(np.exp(shifted).sum())
-    return x - lse
+def logsumexp_pair(logits: np.ndarray, tau) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Log-sum-exp of logits at temperature 1 and at tau over the last axis, sharing the max and shift.
+    Works on one row or a [rows, vocab] matrix (tau may then be one value per row); sums are accumulated in float64.
+    """
+    tau = np.asarray(tau, dtype=logits.dtype)
+    m = logits.max(axis=-1, keepdims=True)
+    shifted = logits - m
+    lse1 = np.log(np.exp(shifted).sum(axis=-1, dtype=np.float64)) + m[..., 0]
+    shifted /= tau[..., None]
+    lse_tau = np.log(np.exp(shifted).sum(axis=-1, dtype=np.float64)) + m[..., 0] / tau
+    return lse1, lse_tau
 
 class Phase(Enum):
-    OLD = auto()    # initial collection of the block (base logits, old tokens)
+    OLD = auto()    # initial collection of the block (statistics, old tokens)
     NEW = auto()    # propose a new suffix from pivot m with sharpened sampler
-    REV = auto()    # reverse-walk: score old suffix under NEW prefix at tau
-    DECIDE = auto()
+    FORK = auto()   # `tries` proposals from pivot m decoding as sibling branches
     DONE = auto()
 
 class ReasoningWithSamplingState:
-    def __init__(self, alpha: float = 4.0, block_size: int = 192, nmcmc: int = 6):
+    """
+    Per-request MCMC state.
+
+    With compact=True (the default) only sufficient statistics are kept per position: the log-sum-exp at
+    temperature 1 and at tau, and the chosen token's logit, in preallocated float64 arrays. Every log
+    probability the acceptance ratio needs is logit - lse (or logit / tau - lse_tau), so the ratio is a few
+    scalar sums. compact=False also keeps every full-vocab logits row, for inspection.
+
+    The reverse proposal q(old suffix | prefix) is scored under the same contexts the old block was generated
+    in, so it comes straight from the old block's statistics and needs no reverse walk. Positions the mod never
+    saw a forward pass for (forced tokens) are scored with one teacher-forced score_sequence request when the
+    host supports it, and otherwise count as deterministic.
+
+    With tries > 1 on a host that supports fork_branches, each iteration is a multiple-try Metropolis step:
+    the host samples `tries` proposals from the pivot as sibling sequences in the batch, one is selected in
+    proportion to its importance weight p^alpha / q, and accepted with the multiple-try ratio. The request's
+    own sequence keeps the original block until the last iteration, which applies the result in one backtrack.
+    """
+
+    def __init__(self, alpha: float = 4.0, block_size: int = 192, nmcmc: int = 6, compact: bool = True, tries: int = 4):
         self.block_size: int = block_size
         self.alpha: float = alpha
         self.tau: float = 1.0 / alpha
         self.nmcmc: int = nmcmc
+        self.compact: bool = compact
+        self.tries: int = tries
         self.phase: Phase = Phase.OLD
 
-        self.base_logits_old: list = []      # list[Tensor], length B
         self.old_tokens: list[int] = []      # list[int], length B
+        self.old_lse1 = np.zeros(block_size, dtype=np.float64)      # logsumexp(logits) per position
+        self.old_lse_tau = np.zeros(block_size, dtype=np.float64)   # logsumexp(logits / tau) per position
+        self.old_logit = np.zeros(block_size, dtype=np.float64)     # logits[chosen token] per position
+        self.base_logits_old: list = []      # full rows, only when compact=False
 
         self.iter_idx: int = 0               # 0..nmcmc-1
         self.pivot_m: int = 0                # random pivot in [0, B-1]
         self.suf_len: int = 0                # suffix length = B - m
+        self.accepted: int = 0
 
-        self.base_logits_new: list = []      # base logits along NEW prefix (len = suf_len)
         self.new_tokens: list[int] = []      # proposed tokens for suffix (len = suf_len)
-        self.logp_new_suf: float = 0.0       # Σ log p_base(new_t | new_prefix), t∈suffix
-        self.logq_fwd: float = 0.0           # Σ log q(new_t | old_prefix+new_so_far), t∈suffix
+        self.new_lse1 = np.zeros(block_size, dtype=np.float64)
+        self.new_lse_tau = np.zeros(block_size, dtype=np.float64)
+        self.new_logit = np.zeros(block_size, dtype=np.float64)
+        self.base_logits_new: list = []      # full rows, only when compact=False
 
-        self.logq_rev: float = 0.0           # Σ log q(old_t | new_prefix+old_so_far), t∈suffix
-        self.base_logits_rev_last = None     # last base logits observed in REV step
-        self._rev_pos: int = 0               # 0..suf_len-1 (position inside suffix)
+        # Statistics of the current forward pass, consumed by the following Added event
+        self._cur_row: np.ndarray | None = None
+        self._cur_lse1: float = 0.0
+        self._cur_lse_tau: float = 0.0
 
-        self._logp_old_suf: float = 0.0
+        self._echo: int = 0                  # forced tokens still to arrive from our own backtrack replacement
+        self._overshoot: int = 0             # tokens added past the end of the block/suffix, removed on the next backtrack
+        self._pending_scores: int = 0        # score_sequence requests not answered yet
+        self._host_block: list[int] | None = None  # the block as it stands on the host, while forking
 
-    def start_first_iteration(self):
-        self.iter_idx = 0
-        self._start_iteration()
+    def nbytes(self) -> int:
+        arrays = [self.old_lse1, self.old_lse_tau, self.old_logit, self.new_lse1, self.new_lse_tau, self.new_logit]
+        arrays += self.base_logits_old + self.base_logits_new
+        if self._cur_row is not None:
+            arrays.append(self._cur_row)
+        return sum(a.nbytes for a in arrays)
+
+    def observe(self, row: np.ndarray, lse1: float, lse_tau: float):
+        """
+        Record the statistics of a base-model logits row (before any temperature is applied).
+        """
+        self._cur_row = row
+        self._cur_lse1 = float(lse1)
+        self._cur_lse_tau = float(lse_tau)
+        if not self.compact:
+            if self.phase == Phase.OLD:
+                self.base_logits_old.append(row)
+            elif self.phase == Phase.NEW:
+                self.base_logits_new.append(row)
+
+    def _arrays(self, phase: Phase):
+        if phase == Phase.OLD:
+            return self.old_tokens, self.old_logit, self.old_lse1, self.old_lse_tau, self.block_size
+        return self.new_tokens, self.new_logit, self.new_lse1, self.new_lse_tau, self.suf_len
+
+    def add_tokens(self, tokens: list[int], actions):
+        """
+        Record added tokens for the current phase. Returns a score_sequence action for positions
+        without statistics, or None.
+        """
+        toks, logit, lse1, lse_tau, limit = self._arrays(self.phase)
+        missing_from = None
+        extra = 0
+        for k, tok in enumerate(tokens):
+            pos = len(toks)
+            if pos >= limit:
+                extra += 1
+                continue
+            toks.append(int(tok))
+            if k == 0 and self._cur_row is not None:
+                logit[pos] = float(self._cur_row[int(tok)])
+                lse1[pos] = self._cur_lse1
+                lse_tau[pos] = self._cur_lse_tau
+            else:
+                logit[pos] = lse1[pos] = lse_tau[pos] = np.nan
+                if missing_from is None:
+                    missing_from = pos
+        self._cur_row = None
+        self._overshoot += extra
+        if missing_from is None:
+            return None
+        n_missing = len(toks) - missing_from
+        scoring = score_sequence(actions, toks[missing_from:], rewind=n_missing + extra, tau=self.tau, tag=(self.phase, missing_from))
+        if scoring is not None:
+            self._pending_scores += 1
+        return scoring
+
+    def on_scored(self, event: SequenceScored):
+        phase, start = event.tag
+        _, logit, lse1, lse_tau, _ = self._arrays(phase)
+        end = start + len(event.token_ids)
+        logit[start:end] = event.chosen_logits
+        lse1[start:end] = event.lse
+        lse_tau[start:end] = event.lse_tau
+        self._pending_scores -= 1
+
+    def advance(self, actions):
+        """
+        Move to the next phase once the block or the proposal is complete and all scores are in.
+        """
+        if self._pending_scores:
+            return actions.noop()
+        if self.phase == Phase.OLD and len(self.old_tokens) == self.block_size:
+            self.iter_idx = 0
+            if self.tries > 1:
+                self._host_block = list(self.old_tokens)
+                fork = self._fork(actions)
+                if fork is not None:
+                    return fork
+                self._host_block = None
+            self._start_iteration()
+            return self._backtrack(actions, self.suf_len, [])
+        if self.phase == Phase.NEW and len(self.new_tokens) == self.suf_len:
+            return self.decide_and_continue(actions)
+        return actions.noop()
 
     def _start_iteration(self):
         self.pivot_m = random.randint(0, self.block_size - 1)  # uniform pivot
         self.suf_len = self.block_size - self.pivot_m
         self.base_logits_new.clear()
         self.new_tokens.clear()
-        self.logp_new_suf = 0.0
-        self.logq_fwd = 0.0
-        self.logq_rev = 0.0
-        self.base_logits_rev_last = None
-        self._rev_pos = 0
-        self._logp_old_suf = 0.0
+        self._cur_row = None
         self.phase = Phase.NEW
 
-    def _finish_iteration_and_maybe_continue(self, actions):
-        self.iter_idx += 1
-        if self.iter_idx < self.nmcmc:
-            self._start_iteration()
-            return actions.backtrack(self.suf_len)
-        else:
-            self.phase = Phase.DONE
-            return actions.noop()
+    def _backtrack(self, actions, n: int, replacement: list[int]):
+        n += self._overshoot
+        self._overshoot = 0
+        if replacement:
+            self._echo += len(replacement)
+            return actions.backtrack(n, list(replacement))
+        if n:
+            return actions.backtrack(n)
+        return actions.noop()
 
-    def decide_and_apply(self, actions):
-        m = self.pivot_m
-        self._logp_old_suf = 0.0
-        for t in range(m, self.block_size):
-            tok = self.old_tokens[t]
-            self._logp_old_suf += log_softmax(self.base_logits_old[t])[tok]
+    def log_weight(self, logit: np.ndarray, lse1: np.ndarray, lse_tau: np.ndarray) -> float:
+        """
+        Log importance weight of a suffix, alpha * log p - log q, from its per-position statistics.
+        """
+        logp = np.nansum(logit - lse1)                 # Σ log p(t | prefix)
+        logq = np.nansum(logit / self.tau - lse_tau)   # Σ log q(t | prefix)
+        return float(self.alpha * logp - logq)
 
-        logA = self.alpha * (self.logp_new_suf - self._logp_old_suf) + (self.logq_rev - self.logq_fwd)
-        self.phase = Phase.DECIDE
-        if np.random.binomial(1, min(1.0, math.exp(min(0.0, logA)))):
+    def log_acceptance(self) -> float:
+        m, n = self.pivot_m, self.suf_len
+        w_new = self.log_weight(self.new_logit[:n], self.new_lse1[:n], self.new_lse_tau[:n])
+        w_old = self.log_weight(self.old_logit[m:], self.old_lse1[m:], self.old_lse_tau[m:])
+        return w_new - w_old
+
+    def _fork(self, actions):
+        """
+        Start a multiple-try iteration: `tries` proposals from a new pivot, sampled by the host as branches of
+        the block currently held in old_tokens. Returns None if the host cannot fork.
+        """
+        self.pivot_m = random.randint(0, len(self.old_tokens) - 1)
+        self.suf_len = len(self.old_tokens) - self.pivot_m
+        fork = fork_branches(
+            actions,
+            self.tries,
+            self.suf_len,
+            rewind=len(self._host_block) + self._overshoot,
+            prefix=self.old_tokens[: self.pivot_m],
+            tau=self.tau,
+            tag=self.iter_idx,
+        )
+        if fork is not None:
+            self.phase = Phase.FORK
+        return fork
+
+    def on_branches(self, event: BranchesSampled, actions):
+        """
+        Multiple-try Metropolis step over the sampled branches, then the next fork or, after the last
+        iteration, one backtrack that puts the resulting block on the host.
+
+        The proposals do not depend on the current suffix, so the reference set is the other proposals plus
+        the current suffix: select branch j with probability w_j / Σw and accept it with probability
+        min(1, Σw / (Σw - w_j + w_old)). With one branch this is the single-proposal ratio.
+        """
+        m, n = self.pivot_m, self.suf_len
+        w_old = self.log_weight(self.old_logit[m:m + n], self.old_lse1[m:m + n], self.old_lse_tau[m:m + n])
+        w = np.asarray([self.log_weight(b.chosen_logits, b.lse, b.lse_tau) for b in event.branches])
+        probs = np.exp(w - w.max())
+        probs /= probs.sum()
+        j = int(np.random.choice(len(w), p=probs))
+        log_ratio = np.logaddexp.reduce(w) - np.logaddexp.reduce(np.append(np.delete(w, j), w_old))
+        accept = bool(np.random.binomial(1, min(1.0, math.exp(min(0.0, log_ratio)))))
+        # A branch shorter than the suffix stopped at EOS, which completes the block
+        ended = False
+        if accept:
+            chosen = event.branches[j]
+            k = len(chosen.token_ids)
+            self.accepted += 1
+            self.old_tokens[m:] = list(chosen.token_ids)
+            self.old_logit[m:m + k] = chosen.chosen_logits
+            self.old_lse1[m:m + k] = chosen.lse
+            self.old_lse_tau[m:m + k] = chosen.lse_tau
+            # Branch rows never reach the mod; keep full rows only for positions it saw
+            del self.base_logits_old[m:]
+            ended = k < n
+
+        self.iter_idx += 1
+        if self.iter_idx < self.nmcmc and not ended:
+            return self._fork(actions)
+        self.phase = Phase.DONE
+        host, block = self._host_block, self.old_tokens
+        self._host_block = None
+        d = 0
+        while d < min(len(host), len(block)) and host[d] == block[d]:
+            d += 1
+        return self._backtrack(actions, len(host) - d, block[d:])
+
+    def decide_and_continue(self, actions):
+        """
+        Metropolis-Hastings step, then a single backtrack that both applies the decision and
+        rewinds to the next iteration's pivot.
+        """
+        m, n = self.pivot_m, self.suf_len
+        accept = bool(np.random.binomial(1, min(1.0, math.exp(min(0.0, self.log_acceptance())))))
+        if accept:
+            self.accepted += 1
             self.old_tokens[m:] = list(self.new_tokens)
-            self.base_logits_old[m:] = list(self.base_logits_new)
-            return actions.backtrack(self.suf_len, self.new_tokens)
-        else:
-            return actions.noop()
+            self.old_lse1[m:] = self.new_lse1[:n]
+            self.old_lse_tau[m:] = self.new_lse_tau[:n]
+            self.old_logit[m:] = self.new_logit[:n]
+            if not self.compact:
+                self.base_logits_old[m:] = list(self.base_logits_new)
+
+        # The sequence currently ends with the NEW suffix
+        self.iter_idx += 1
+        if self.iter_idx >= self.nmcmc:
+            self.phase = Phase.DONE
+            if accept:
+                return self._backtrack(actions, 0, [])
+            return self._backtrack(actions, n, self.old_tokens[m:])
+
+        self._start_iteration()
+        m2 = self.pivot_m
+        if accept or m2 <= m:
+            return self._backtrack(actions, self.block_size - m2, [])
+        # Rejected and the new pivot lies inside the old suffix: restore old[m:m2]
+        return self._backtrack(actions, n, self.old_tokens[m:m2])
 
-RWS: dict[str, ReasoningWithSamplingState] = {}
+# Compact states hold a few KB each; the budget matters for compact=False, which keeps full-vocab rows
+RWS: RequestStore[ReasoningWithSamplingState] = RequestStore(ReasoningWithSamplingState, name="reasoning_with_sampling", max_bytes=4 << 30)
 
 @mod
 def reasoning_with_sampling(event, actions: ActionBuilder, tokenizer: Any):
     """
     This mod implements the algorithm from "Reasoning with Sampling: Your Base Model is Smarter Than You Think". Effectively,
     it generates a sequence, backtracks, generates a new sequence with a different temperature, then decides which to keep.
+    Hosts that can fork a request propose several new sequences at once as sibling branches in the batch.
     """
+    if RWS.evicted(event.request_id):
+        # The MCMC state was evicted; without it the request just continues unsteered
+        return actions.noop()
     state = RWS.get(event.request_id)
-    if state is None:
-        RWS[event.request_id] = ReasoningWithSamplingState()
-        state = RWS[event.request_id]
 
     if isinstance(event, ForwardPass):
-        logits = event.logits
-        if state.phase == Phase.OLD:
-            state.base_logits_old.append(logits.to_numpy())
-        if state.phase == Phase.NEW:
-            state.base_logits_new.append(logits.to_numpy())
-            return actions.adjusted_logits(logits / state.tau)
-        if state.phase == Phase.REV:
-            state.base_logits_rev_last = logits.to_numpy()
+        if state.phase in (Phase.OLD, Phase.NEW):
+            logits = event.logits.to_numpy()
+            lse1, lse_tau = logsumexp_pair(logits, state.tau)
+            state.observe(logits, lse1, lse_tau)
+            if state.phase == Phase.NEW:
+                return actions.adjust_logits(Tensor.from_numpy(logits / state.tau))
         return actions.noop()
 
     if isinstance(event, Added):
-        if len(event.tokens) > 1 and event.forced and state.phase != Phase.DECIDE:
-            return actions.noop()
-        if state.phase == Phase.OLD:
-            tok = event.added_tokens[0]
-            state.old_tokens.append(tok)
-            if len(state.old_tokens) == state.block_size:
-                state.start_first_iteration()
-                return actions.backtrack(state.suf_len)
-            return actions.noop()
-
-        if state.phase == Phase.NEW:
-            tok = event.added_tokens[0]
-            state.new_tokens.append(tok)
-            i = len(state.new_tokens) - 1
-            state.logp_new_suf += log_softmax(state.base_logits_new[i])[tok]
-            state.logq_fwd += log_softmax(state.base_logits_new[i] / state.tau)[tok]
-            if len(state.new_tokens) == state.suf_len:
-                state.phase = Phase.REV
-                state._rev_pos = 0
-                return actions.backtrack(state.suf_len)
-            return actions.noop()
-
-        if state.phase == Phase.REV:
-            i = state._rev_pos
-            if i < state.suf_len:
-                old_tok = state.old_tokens[state.pivot_m + i]
-                logits_here = state.base_logits_rev_last
-                state.logq_rev += log_softmax(logits_here / state.tau)[old_tok]
-                state._rev_pos += 1
-                if state._rev_pos == state.suf_len:
-                    state.phase = Phase.DECIDE
-                    return state.decide_and_apply(actions)
-                else:
-                    return actions.force_tokens([old_tok])
+        tokens = list(event.added_tokens)
+        if state._echo:
+            # Replacement tokens from our own backtrack are already recorded
+            k = min(state._echo, len(tokens))
+            state._echo -= k
+            tokens = tokens[k:]
+            state._cur_row = None
+        if not tokens or state.phase == Phase.DONE:
             return actions.noop()
+        scoring = state.add_tokens(tokens, actions)
+        if scoring is not None:
+            return scoring
+        return state.advance(actions)
 
-        if state.phase == Phase.DECIDE:
-            return state._finish_iteration_and_maybe_continue(actions)
+    if isinstance(event, SequenceScored):
+        state.on_scored(event)
+        return state.advance(actions)
+    if isinstance(event, BranchesSampled):
+        return state.on_branches(event, actions)
     return actions.noop()
+
+@batched_forward_pass(reasoning_with_sampling)
+def reasoning_with_sampling_batched(event: BatchedForwardPass, actions: BatchedActionBuilder, tokenizer: Any):
+    """
+    Batched ForwardPass handler: the statistics of every active row come from one vectorized
+    log-sum-exp over the batch, and every request in the NEW phase is sharpened with one row-wise division.
+    """
+    logits = event.to_numpy()
+    states = [None if RWS.evicted(request_id) else RWS.get(request_id) for request_id in event.request_ids]
+    rows = [i for i, st in enumerate(states) if st is not None and st.phase in (Phase.OLD, Phase.NEW)]
+    if not rows:
+        return actions.noop()
+    taus = np.asarray([states[i].tau for i in rows], dtype=logits.dtype)
+    # A copy of the active rows: base logits stay unscaled while the batch matrix is sharpened in place
+    base = logits[rows]
+    lse1, lse_tau = logsumexp_pair(base, taus)
+    new_rows, new_taus = [], []
+    for j, i in enumerate(rows):
+        states[i].observe(base[j], lse1[j], lse_tau[j])
+        if states[i].phase == Phase.NEW:
+            new_rows.append(i)
+            new_taus.append(states[i].tau)
+    if not new_rows:
+        return actions.noop()
+    logits[new_rows] /= np.asarray(new_taus, dtype=logits.dtype)[:, None]
+    return actions.adjust_logits(Tensor.from_numpy(logits))
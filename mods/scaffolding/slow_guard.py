@@ -0,0 +1,89 @@
+import atexit
+from typing import Any
+from quote_mod_sdk.mod import ActionBuilder
+from quote_mod_sdk import mod, ForwardPass, Added, ModEvent
+
+from max.driver import Tensor
+
+from mods.utils import AsyncGuard, IncrementalDetokenizer, RequestStore
+
+SENTENCE_END = (".", "!", "?", "\n")
+FLAGGED = ("as an ai language model", "i cannot help with that")
+
+def classify(sentence: str) -> bool:
+    """
+    Stand-in for a slow external check (a moderation endpoint, a reward model): True if the sentence may stay.
+    It runs on the guard's worker pool, so it can block on I/O without holding up decoding.
+    """
+    text = sentence.lower()
+    return not any(phrase in text for phrase in FLAGGED)
+
+# Checks that miss the deadline pass; use on_timeout=FAIL to fail closed
+guard = AsyncGuard(max_workers=4, deadline=2.0)
+# Longest the decode loop waits on EOS for checks still running; later ones count as missing the deadline
+EOS_WAIT = 0.05
+# Cancel queued checks instead of running them at interpreter exit
+atexit.register(guard.shutdown)
+
+class GuardState:
+    def __init__(self, tokenizer: Any):
+        self.detok = IncrementalDetokenizer(tokenizer)
+        self.sentence_start = 0              # token index the current sentence starts at
+        self.reject_id: int | None = None
+
+state: RequestStore[GuardState] = RequestStore(GuardState, name="slow_guard")
+
+def _backtrack(req_state: GuardState, n: int, action: ActionBuilder):
+    detok = req_state.detok
+    keep = len(detok) - n
+    # Avoid resampling the same first token of the rejected sentence
+    req_state.reject_id = detok.token_ids[keep] if keep < len(detok) else None
+    detok.truncate(keep)
+    req_state.sentence_start = min(req_state.sentence_start, keep)
+    return action.backtrack(n)
+
+@mod
+def slow_guard(event: ModEvent, action: ActionBuilder, tokenizer: Any):
+    """
+    This mod sends every finished sentence to a slow check and keeps generating while it runs. If the check
+    fails, the sentence and everything generated after it is backtracked and regenerated.
+
+    Decoding never waits for a passing check. On EOS the last sentence is submitted too, and outstanding
+    checks get at most EOS_WAIT seconds; if none fails, the request's guard and mod state are released.
+    """
+    if state.evicted(event.request_id):
+        return action.noop()
+    req_state = state.get(event.request_id, tokenizer)
+    detok = req_state.detok
+
+    if isinstance(event, ForwardPass):
+        n = guard.poll(event.request_id, len(detok))
+        if n:
+            return _backtrack(req_state, n, action)
+        if req_state.reject_id is not None:
+            logits = event.logits.to_numpy()
+            logits[req_state.reject_id] = -1e9
+            req_state.reject_id = None
+            return action.adjust_logits(Tensor.from_numpy(logits))
+    if isinstance(event, Added):
+        new_text = detok.extend(event.added_tokens)
+        eos = getattr(tokenizer, "eos_token_id", None)
+        if eos is not None and eos in event.added_tokens:
+            start = req_state.sentence_start
+            if len(detok) > start:
+                guard.submit(event.request_id, start, len(detok), classify, detok.text_from(detok.char_offsets[start]))
+                req_state.sentence_start = len(detok)
+            n = guard.finish(event.request_id, len(detok), timeout=EOS_WAIT)
+            if not n:
+                state.release(event.request_id)
+                return action.noop()
+            return _backtrack(req_state, n, action)
+        n = guard.poll(event.request_id, len(detok))
+        if n:
+            return _backtrack(req_state, n, action)
+        if any(ch in new_text for ch in SENTENCE_END) and len(detok) > req_state.sentence_start:
+            start = req_state.sentence_start
+            sentence = detok.text_from(detok.char_offsets[start])
+            guard.submit(event.request_id, start, len(detok), classify, sentence)
+            req_state.sentence_start = len(detok)
+    return action.noop()
@@ -2,6 +2,10 @@ from typing import Any
 from quote_mod_sdk.mod import ActionBuilder
 from quote_mod_sdk import mod, Prefilled, ModEvent
 
+from mods.utils import PrefillRewriter
+
+# Compiled against the tokenizer on first use; add more phrase -> replacement pairs here
+rewriter = PrefillRewriter({"Say hi.": "Say bye."})
 
 @mod
 def adjust_prefill(event: ModEvent, action: ActionBuilder, tokenizer: Any):
@@ -11,9 +15,10 @@ def adjust_prefill(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     Simple usage of adjust_prefill action
     """
     if isinstance(event, Prefilled):
-        # On a prefill event, grab the prompt from the context info and decode it
-        prompt_text = tokenizer.decode(event.context_info.tokens[:event.context_info._prompt_len])
-        new_text = prompt_text.replace("Say hi.", "Say bye.")
-        prefill_ids = tokenizer.encode(new_text, add_special_tokens=False)
-        return action.adjust_prefill(prefill_ids)
+        # Rewrite at the token level: only the tokens around each match are decoded and re-encoded,
+        # and every other token ID is kept, so the host's prefix cache still hits
+        prompt_ids = event.context_info.tokens[:event.context_info._prompt_len]
+        prefill_ids = rewriter.rewrite(prompt_ids, tokenizer)
+        if prefill_ids is not None:
+            return action.adjust_prefill(prefill_ids)
     return action.noop()
@@ -4,6 +4,11 @@ from quote_mod_sdk import mod, ForwardPass, ModEvent
 
 from max.driver import Tensor
 
+from mods.utils import BannedStrings, BatchedActionBuilder, BatchedForwardPass, batched_forward_pass
+
+# Resolved once per tokenizer to every token whose text contains an em dash, not just the em dash token itself
+em_dash = BannedStrings(["—"])
+
 @mod
 def adjust_logits(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     """
@@ -14,7 +19,15 @@ def adjust_logits(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     if isinstance(event, ForwardPass):
         # Convert logits from a tensor to numpy array - In the future this wont be necessary
         logits = event.logits.to_numpy()
-        em_dash_id = tokenizer.encode("—", add_special_tokens=False)
-        logits[em_dash_id] = -1e9
+        em_dash.apply(logits, tokenizer)
         return action.adjust_logits(Tensor.from_numpy(logits))
     return action.noop()
+
+@batched_forward_pass(adjust_logits)
+def adjust_logits_batched(event: BatchedForwardPass, action: BatchedActionBuilder, tokenizer: Any):
+    """
+    Same mask for the whole [batch, vocab] matrix in one assignment.
+    """
+    logits = event.to_numpy()
+    em_dash.apply(logits, tokenizer)
+    return action.adjust_logits(Tensor.from_numpy(logits))
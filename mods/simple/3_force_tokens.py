@@ -1,9 +1,17 @@
-from typing import Any, Dict
+from typing import Any
 from quote_mod_sdk.mod import ActionBuilder
 from quote_mod_sdk import mod, Added, ModEvent
 
+from mods.utils import FORCE, RequestStore, TriggerMatcher, TriggerRule, TriggerSet
+
+# Compiled once; add more rules here without adding per-token cost
+triggers = TriggerSet([
+    TriggerRule("hello", kind=FORCE, replacement="hello and goodbye."),
+])
+
 class ModState:
-    accum_text: Dict[str, str] = {}
+    # One matcher (streaming detokenizer + automaton state) per request, freed on completion or after a TTL
+    matchers: RequestStore[TriggerMatcher] = RequestStore(triggers.matcher, name="force_tokens")
 
 state = ModState()
 
@@ -14,15 +22,13 @@ def force_tokens(event: ModEvent, action: ActionBuilder, tokenizer: Any):
 
     Simple usage of the force_tokens action
     """
-    if isinstance(event, Added):
-        # For each request from a batch, accumulate the generated text so far
-        if state.get(event.request_id):
-            state.accum_text[event.request_id] += tokenizer.decode(event.added_tokens)
-        else:
-            state.accum_text[event.request_id] = ""
-            state.accum_text[event.request_id] += tokenizer.decode(event.added_tokens)
+    if isinstance(event, Added) and not state.matchers.evicted(event.request_id):
+        # For each request from a batch, feed the new tokens to its matcher
+        matcher = state.matchers.get(event.request_id, tokenizer)
 
         # If the model is going to say "hello", instead generate "hello and goodbye."
-        if state.accum_text[event.request_id].endswith("hello"):
-            return action.force_tokens(tokenizer.encode("hello and goodbye.", add_special_tokens=False))
+        # Forced tokens are not checked, so the replacement cannot trigger itself.
+        match = matcher.extend(event.added_tokens, report=not event.forced)
+        if match:
+            return matcher.apply(match, action)
     return action.noop()
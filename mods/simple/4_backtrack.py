@@ -1,27 +1,39 @@
-from typing import Any, Dict, List
+from typing import Any
 from quote_mod_sdk.mod import ActionBuilder
-from quote_mod_sdk import mod, ForwardPass, Added, ModEvent
+from quote_mod_sdk import mod, Added, ModEvent
+
+from mods.utils import BACKTRACK, RequestStore, TriggerMatcher, TriggerRule, TriggerSet, on_dropped
+
+# Compiled once; add more rules here without adding per-token cost
+triggers = TriggerSet([
+    TriggerRule(" I can't help with that", kind=BACKTRACK, replacement="I can help you with that: "),
+])
 
 class ModState:
-    accum_text: Dict[str, str] = {}
+    matchers: RequestStore[TriggerMatcher] = RequestStore(triggers.matcher, name="backtrack")
 
 state = ModState()
 
+def backtrack_dropped(ev: ModEvent, kind: str, args: tuple):
+    # Inside a composition another mod's action won, so the host still has the phrase: restore the matcher
+    matcher = state.matchers.peek(ev.request_id)
+    if matcher is not None and kind == "backtrack":
+        matcher.undo_rollback()
+
 @mod
+@on_dropped(backtrack_dropped)
 def backtrack(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     """
     This mod watches for the phrase "I can't help with that" and replaces it with "I can help you with that: "
 
     Simple usage of the backtrack action
     """
-    if isinstance(event, Added):
-        if state.get(event.request_id):
-            state.accum_text[event.request_id] += tokenizer.decode(event.added_tokens)
-        else:
-            state.accum_text[event.request_id] = ""
-            state.accum_text[event.request_id] += tokenizer.decode(event.added_tokens)
-
-        if state.accum_text[event.request_id].endswith(" I can't help with that"):
-            # backtrack takes the number of tokens to backtrack on and optionally a replacement set of tokens.
-            return action.backtrack(len(tokenizer.encode(" I can't help with that")), tokenizer.encode("I can help you with that: "))
+    if isinstance(event, Added) and not state.matchers.evicted(event.request_id):
+        matcher = state.matchers.get(event.request_id, tokenizer)
+
+        match = matcher.extend(event.added_tokens, report=not event.forced)
+        if match:
+            # The match knows how many generated tokens cover the phrase, so no re-encode is needed.
+            # apply() rolls the matcher back and returns backtrack(n_tokens, replacement_ids).
+            return matcher.apply(match, action)
     return action.noop()
@@ -2,6 +2,17 @@ from typing import Any
 from quote_mod_sdk.mod import ActionBuilder
 from quote_mod_sdk import mod, Prefilled, ModEvent, get_conversation
 
+from mods.utils import ToolRouter, ToolTrigger
+
+# All triggers are compiled once into one router; add more ToolTriggers here without slowing the check down
+router = ToolRouter([
+    ToolTrigger(
+        "call_search",
+        {"id": "{call_id}", "type": "function", "function": {"name": "call_search"}},
+        exact="<tool_call>call_search()</tool_call>",
+    ),
+])
+
 @mod
 def tool_calls(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     """
@@ -9,14 +20,8 @@ def tool_calls(event: ModEvent, action: ActionBuilder, tokenizer: Any):
     """
     if isinstance(event, Prefilled):
         convo = get_conversation()
-        content = convo[len(convo) - 1]["content"].lower()
-        if convo[len(convo) - 1]["role"] == "user":
-            triggered = content == "<tool_call>call_search()</tool_call>"
-            if triggered:
-                payload = {
-                    "id": f"call_{event.request_id.split('-')[0]}",
-                    "type": "function",
-                    "function": {"name": "call_search" },
-                }
-                return action.tool_calls(payload)
+        if convo and convo[-1]["role"] == "user":
+            route = router.route(convo[-1]["content"], tokenizer)
+            if route is not None:
+                return action.tool_calls(route.payload(event.request_id))
     return action.noop()
@@ -0,0 +1,68 @@
+"""
+Shared helpers for the example mods. Import from here, e.g. `from mods.utils import IncrementalDetokenizer`.
+
+Exports are imported on first use, so importing the package (e.g. for the mod registry) does not pull in
+numpy or every helper module.
+"""
+import importlib
+from typing import TYPE_CHECKING, Any, Dict, List
+
+_EXPORTS: Dict[str, List[str]] = {
+    "async_guard": ["AsyncGuard"],
+    "batching": ["BatchedAction", "BatchedActionBuilder", "BatchedForwardPass", "batched_forward_pass", "logsumexp_rows"],
+    "branching": ["BranchesSampled", "ForkBranches", "fork_branches"],
+    "composition": ["ComposedMod", "RecordingActionBuilder", "compose", "handled_events", "handles", "on_backtrack", "on_dropped"],
+    "confidence": ["ConfidenceTracker", "logsumexp_f32"],
+    "detokenizer": ["IncrementalDetokenizer"],
+    "interning": ["TOKENS", "ByTokenizer", "TokenConstants", "constant_ids", "intern", "tokenizer_hash"],
+    "json_grammar": ["JSONGrammar", "VocabTrie"],
+    "json_stream": ["INITIAL", "JSONBlockValidator", "JSONState", "StreamingJSONValidator"],
+    "prefill": ["PrefillRewriter"],
+    "profiling": ["PROFILER", "Profiler", "ProfiledMod", "profiled"],
+    "registry": ["ModInfo", "ModRegistry"],
+    "request_state": ["RequestStore", "all_stats", "complete_request"],
+    "response_cache": ["ANY", "FIRST", "FOLLOWUP", "CannedResponse", "ResponseCache", "normalize"],
+    "scoring": ["ScoreSequence", "SequenceScored", "score_sequence", "scored_from_logits"],
+    "tool_router": ["ARGS_JSON", "ToolRoute", "ToolRouter", "ToolTrigger"],
+    "trace": ["TraceReader", "TraceWriter", "TracedMod", "traced"],
+    "triggers": ["BACKTRACK", "FORCE", "AhoCorasick", "TriggerMatch", "TriggerMatcher", "TriggerRule", "TriggerSet"],
+    "vocab_index": ["BannedStrings", "VocabIndex", "decode_vocab", "get_vocab_index"],
+}
+_MODULE_OF = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = [name for names in _EXPORTS.values() for name in names]
+
+
+def __getattr__(name: str) -> Any:
+    module = _MODULE_OF.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .async_guard import AsyncGuard
+    from .batching import BatchedAction, BatchedActionBuilder, BatchedForwardPass, batched_forward_pass, logsumexp_rows
+    from .branching import BranchesSampled, ForkBranches, fork_branches
+    from .composition import ComposedMod, RecordingActionBuilder, compose, handled_events, handles, on_backtrack, on_dropped
+    from .confidence import ConfidenceTracker, logsumexp_f32
+    from .detokenizer import IncrementalDetokenizer
+    from .interning import TOKENS, ByTokenizer, TokenConstants, constant_ids, intern, tokenizer_hash
+    from .json_grammar import JSONGrammar, VocabTrie
+    from .json_stream import INITIAL, JSONBlockValidator, JSONState, StreamingJSONValidator
+    from .prefill import PrefillRewriter
+    from .profiling import PROFILER, Profiler, ProfiledMod, profiled
+    from .registry import ModInfo, ModRegistry
+    from .request_state import RequestStore, all_stats, complete_request
+    from .response_cache import ANY, FIRST, FOLLOWUP, CannedResponse, ResponseCache, normalize
+    from .scoring import ScoreSequence, SequenceScored, score_sequence, scored_from_logits
+    from .tool_router import ARGS_JSON, ToolRoute, ToolRouter, ToolTrigger
+    from .trace import TraceReader, TraceWriter, TracedMod, traced
+    from .triggers import BACKTRACK, FORCE, AhoCorasick, TriggerMatch, TriggerMatcher, TriggerRule, TriggerSet
+    from .vocab_index import BannedStrings, VocabIndex, decode_vocab, get_vocab_index
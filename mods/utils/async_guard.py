@@ -0,0 +1,194 @@
+import threading
+import time
+from concurrent.futures import CancelledError, Executor, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from typing import Any, Callable, Dict, List, Optional
+
+from .request_state import RequestStore
+
+PASS = "pass"   # on_timeout: a check that misses its deadline is treated as passed
+FAIL = "fail"   # ... or as failed
+
+
+class PendingCheck:
+    """
+    One submitted check over generated tokens [start, end).
+    """
+    __slots__ = ("future", "start", "end", "deadline")
+
+    def __init__(self, future: Future, start: int, end: int, deadline: float):
+        self.future = future
+        self.start = start
+        self.end = end
+        self.deadline = deadline
+
+
+class AsyncGuard:
+    """
+    Runs slow checks (a classifier call, a schema validation) on a worker pool while generation continues.
+
+    `submit` starts a check over tokens [start, end) and returns at once. A check returns True or None to
+    pass, False to fail (roll back to `start`), or the generated-token index to roll back to. `poll`, called
+    from the mod's events, turns the earliest failure into the number of tokens to backtrack. Checks over
+    tokens that are being removed are cancelled and their results ignored, so a passing guard costs no decode
+    latency, and a failing one costs the tokens generated since the check was submitted.
+
+    Each check has a deadline of `deadline` seconds; a check still running after it counts as `on_timeout`.
+    `finish` settles a request that is about to end: it waits briefly for outstanding checks, counts the rest
+    as timed out, and releases the request when nothing fails. `drain` waits up to the deadlines instead.
+    Pending checks are cancelled when the request is released with `release` or `complete_request`.
+
+    Checks run on `executor` (a thread pool of `max_workers` by default). With a ProcessPoolExecutor the
+    check and its arguments must be picklable.
+    """
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        max_workers: int = 4,
+        deadline: Optional[float] = 2.0,
+        on_timeout: str = PASS,
+        name: str = "async_guard",
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if on_timeout not in (PASS, FAIL):
+            raise ValueError(f"on_timeout must be {PASS!r} or {FAIL!r}")
+        self.executor = executor or ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self.deadline = deadline
+        self.on_timeout = on_timeout
+        self.clock = clock
+        self.state: RequestStore[List[PendingCheck]] = RequestStore(list, name=name, on_evict=self._cancel_all)
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "passed": 0, "failed": 0, "timed_out": 0, "cancelled": 0, "errors": 0}
+
+    def submit(self, request_id: str, start: int, end: int, check: Callable[..., Any], *args: Any) -> Future:
+        """
+        Run check(*args) in the background; it judges generated tokens [start, end).
+        Pass it a snapshot (e.g. the text), not live per-request state.
+        """
+        future = self.executor.submit(check, *args)
+        deadline = self.clock() + self.deadline if self.deadline is not None else float("inf")
+        self.state.get(request_id).append(PendingCheck(future, start, end, deadline))
+        self._count("submitted")
+        return future
+
+    def pending(self, request_id: str) -> int:
+        checks = self.state.peek(request_id)
+        return len(checks) if checks else 0
+
+    def poll(self, request_id: str, length: int) -> int:
+        """
+        Number of tokens to backtrack from a sequence of `length` generated tokens: 0 while no finished
+        check has failed. Never blocks.
+        """
+        checks = self.state.peek(request_id)
+        if not checks:
+            return 0
+        now = self.clock()
+        target: Optional[int] = None
+        running: List[PendingCheck] = []
+        for check in checks:
+            if check.future.done():
+                at = self._verdict(check)
+            elif now >= check.deadline:
+                check.future.cancel()
+                self._count("timed_out")
+                at = check.start if self.on_timeout == FAIL else None
+            else:
+                running.append(check)
+                continue
+            if at is not None and (target is None or at < target):
+                target = at
+        if target is None:
+            checks[:] = running
+            return 0
+        self._drop_after(checks, running, target)
+        return max(0, length - target)
+
+    def drain(self, request_id: str, length: int, timeout: Optional[float] = None) -> int:
+        """
+        Wait for outstanding checks (up to their deadlines, and at most `timeout` seconds), then poll.
+        """
+        checks = self.state.peek(request_id)
+        if not checks:
+            return 0
+        limit = max(check.deadline for check in checks) - self.clock()
+        if timeout is not None:
+            limit = min(limit, timeout)
+        wait_futures([check.future for check in checks], timeout=max(0.0, limit) if limit != float("inf") else None)
+        return self.poll(request_id, length)
+
+    def finish(self, request_id: str, length: int, timeout: float = 0.05) -> int:
+        """
+        For a request about to end: wait at most `timeout` seconds for outstanding checks, count the ones still
+        running as timed out (`on_timeout`), and return the number of tokens to backtrack. When that is 0 the
+        request is released.
+        """
+        checks = self.state.peek(request_id)
+        if checks:
+            wait_futures([check.future for check in checks], timeout=timeout)
+            now = self.clock()
+            for check in checks:
+                if not check.future.done():
+                    check.deadline = min(check.deadline, now)
+        n = self.poll(request_id, length)
+        if not n:
+            self.release(request_id)
+        return n
+
+    def rollback(self, request_id: str, length: int) -> None:
+        """
+        The sequence was cut to `length` tokens by something else (another backtrack): drop the checks over
+        tokens that no longer exist.
+        """
+        checks = self.state.peek(request_id)
+        if checks:
+            self._drop_after(checks, list(checks), length)
+
+    def release(self, request_id: str) -> None:
+        self.state.release(request_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return {**counts, "requests": len(self.state)}
+
+    def shutdown(self, wait: bool = False) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _verdict(self, check: PendingCheck) -> Optional[int]:
+        try:
+            result = check.future.result()
+        except CancelledError:
+            return None
+        except Exception:
+            # A broken check must not stall or rewrite the generation
+            self._count("errors")
+            return None
+        if result is None or result is True:
+            self._count("passed")
+            return None
+        self._count("failed")
+        if result is False:
+            return check.start
+        return max(check.start, int(result))
+
+    def _drop_after(self, checks: List[PendingCheck], running: List[PendingCheck], length: int) -> None:
+        kept = []
+        for check in running:
+            if check.end <= length:
+                kept.append(check)
+            else:
+                check.future.cancel()
+                self._count("cancelled")
+        checks[:] = kept
+
+    def _cancel_all(self, request_id: str, checks: List[PendingCheck], reason: str) -> None:
+        for check in checks:
+            if not check.future.done():
+                check.future.cancel()
+                self._count("cancelled")
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
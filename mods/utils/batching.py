@@ -0,0 +1,85 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass
+class BatchedForwardPass:
+    """
+    One decode step for the whole batch: `logits` is [batch, vocab] and row i belongs to request_ids[i].
+    """
+    request_ids: List[str]
+    logits: Any
+
+    def __post_init__(self):
+        self._row_of: Optional[Dict[str, int]] = None
+
+    def to_numpy(self) -> np.ndarray:
+        """
+        The logits matrix as one host array (one copy per step, not one per request).
+        """
+        logits = self.logits
+        if isinstance(logits, np.ndarray):
+            return logits
+        return logits.to_numpy()
+
+    def row(self, request_id: str) -> int:
+        if self._row_of is None:
+            self._row_of = {rid: i for i, rid in enumerate(self.request_ids)}
+        return self._row_of[request_id]
+
+
+@dataclass
+class BatchedAction:
+    """
+    Result of a batched handler.
+
+    logits: the adjusted [batch, vocab] matrix, or None to leave logits untouched.
+    defer: request IDs the host should hand to the per-request mod's ForwardPass branch instead.
+    """
+    logits: Optional[Any] = None
+    defer: List[str] = field(default_factory=list)
+
+
+class BatchedActionBuilder:
+    def adjust_logits(self, logits: Any, defer: Sequence[str] = ()) -> BatchedAction:
+        return BatchedAction(logits=logits, defer=list(defer))
+
+    def defer(self, request_ids: Sequence[str]) -> BatchedAction:
+        return BatchedAction(defer=list(request_ids))
+
+    def noop(self) -> BatchedAction:
+        return BatchedAction()
+
+
+BatchedHandler = Callable[[BatchedForwardPass, BatchedActionBuilder, Any], BatchedAction]
+
+
+def batched_forward_pass(per_request_mod: Any) -> Callable[[BatchedHandler], BatchedHandler]:
+    """
+    Register a batched ForwardPass handler for a per-request mod.
+
+    A host that supports batching looks for `mod.batched_forward_pass`. When it is present, the host calls
+    it once per decode step with the whole batch and skips the mod's per-request ForwardPass branch,
+    except for the requests listed in the returned `defer`. Other events still go to the per-request mod,
+    and hosts without batching ignore the attribute.
+    """
+    def register(fn: BatchedHandler) -> BatchedHandler:
+        per_request_mod.batched_forward_pass = fn
+        fn.per_request_mod = per_request_mod
+        return fn
+    return register
+
+
+def logsumexp_rows(logits: np.ndarray) -> np.ndarray:
+    """
+    Stable log-sum-exp over the last axis of a [batch, vocab] array, in float64.
+    """
+    m = logits.max(axis=-1, keepdims=True)
+    m = np.where(np.isfinite(m), m, 0.0)
+    # exp in place in the input dtype; only the sums are float64
+    shifted = logits - m
+    s = np.exp(shifted, out=shifted).sum(axis=-1, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        return np.log(s) + m[..., 0]
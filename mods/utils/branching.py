@@ -0,0 +1,56 @@
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Sequence
+
+from .scoring import SequenceScored
+
+
+@dataclass
+class ForkBranches:
+    """
+    Action payload: sample `n` continuations of the request as sibling sequences in the batch.
+
+    Every branch starts from the current sequence with its last `rewind` tokens removed and `prefix` appended,
+    so the branches share that prefix, and samples up to `max_tokens` tokens from softmax(logits / tau),
+    stopping early at EOS. The request itself is paused while they decode and its sequence is not changed.
+    Mods see no events for the branches; the host answers with one BranchesSampled event, and `tag` is
+    echoed back.
+    """
+    n: int
+    max_tokens: int
+    rewind: int = 0
+    prefix: List[int] = field(default_factory=list)
+    tau: float = 1.0
+    tag: Any = None
+
+
+@dataclass
+class BranchesSampled:
+    """
+    Event: the branches of a ForkBranches request, in order.
+
+    Each branch is a SequenceScored over the tokens it sampled, with the statistics of the raw logits
+    (before tau) at every position, so `logprobs()` and `logprobs_tau()` give the target and proposal
+    log-probabilities of the branch. A branch that stopped at EOS is shorter than `max_tokens` and ends with it.
+    """
+    request_id: str
+    branches: List[SequenceScored]
+    tag: Any = None
+
+
+def fork_branches(
+    action: Any,
+    n: int,
+    max_tokens: int,
+    rewind: int = 0,
+    prefix: Sequence[int] = (),
+    tau: float = 1.0,
+    tag: Any = None,
+) -> Optional[Any]:
+    """
+    Build a fork_branches action, or return None if the host's ActionBuilder does not support it.
+    Callers fall back to proposing one continuation at a time on None.
+    """
+    build = getattr(action, "fork_branches", None)
+    if build is None:
+        return None
+    return build(ForkBranches(int(n), int(max_tokens), int(rewind), [int(t) for t in prefix], tau, tag))
@@ -0,0 +1,290 @@
+import ast
+import inspect
+import textwrap
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .batching import BatchedAction, BatchedActionBuilder, BatchedForwardPass, batched_forward_pass
+from .registry import isinstance_names
+
+# Lower wins when mods return conflicting actions for the same event
+KIND_PRIORITY: Dict[str, int] = {
+    "force_output": 0,
+    "tool_calls": 0,
+    "backtrack": 1,
+    "adjust_prefill": 2,
+    "score_sequence": 3,
+    "fork_branches": 3,
+    "force_tokens": 4,
+    "adjust_logits": 5,
+}
+# Rank of an action the composer did not record (e.g. one a SelfPrompt built itself)
+OPAQUE_PRIORITY = 1
+MERGEABLE = ("force_tokens", "adjust_logits")
+
+
+def handles(*event_types: type) -> Callable:
+    """
+    Declare the event types a mod handles, e.g. `@handles(ForwardPass, Added)` under `@mod`.
+    The composer then never calls it for other events.
+    """
+    def mark(fn):
+        fn.handles = tuple(event_types)
+        return fn
+    return mark
+
+
+def on_dropped(callback: Callable[[Any, str, tuple], None]) -> Callable:
+    """
+    Register `callback(event, kind, args)`, called when a composer drops an action the mod returned for `event`
+    because another mod's action won. Mods that update their own state before returning a backtrack or
+    force_tokens use it to undo that update, since the host never sees the action.
+    """
+    def mark(fn):
+        fn.on_dropped = callback
+        return fn
+    return mark
+
+
+def on_backtrack(callback: Callable[[Any, int], None]) -> Callable:
+    """
+    Register `callback(event, n)`, called when a composer emits a backtrack of n tokens that another mod returned
+    for `event`. Mods that keep per-token state but never see the sequence shrink (a grammar parser) use it to
+    drop their last n entries; the replacement arrives afterwards as a forced Added event.
+    """
+    def mark(fn):
+        fn.on_backtrack = callback
+        return fn
+    return mark
+
+
+def handled_events(fn: Callable) -> Optional[Tuple[type, ...]]:
+    """
+    The event types a mod handles: declared with @handles, or detected from the `isinstance(event, ...)`
+    checks on its first parameter. None means every event (no checks found, or the source is unavailable).
+    """
+    declared = getattr(fn, "handles", None)
+    if declared is not None:
+        return tuple(declared)
+    target = inspect.unwrap(fn)
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(target)))
+        params = list(inspect.signature(target).parameters)
+    except (OSError, TypeError, SyntaxError, ValueError):
+        return None
+    names = isinstance_names(tree, params[0]) if params else None
+    if names is None:
+        return None
+    types = []
+    for name in names:
+        resolved = target.__globals__.get(name)
+        if not isinstance(resolved, type):
+            return None
+        types.append(resolved)
+    return tuple(dict.fromkeys(types))
+
+
+class Recorded:
+    """
+    An action a mod asked for, kept until the composer has heard from every mod.
+    """
+    __slots__ = ("kind", "args", "kwargs")
+
+    def __init__(self, kind: str, args: tuple, kwargs: dict):
+        self.kind = kind
+        self.args = args
+        self.kwargs = kwargs
+
+
+NOOP = Recorded("noop", (), {})
+
+
+class RecordingActionBuilder:
+    """
+    Stands in for the host's ActionBuilder inside a composed mod: every method records its call instead of
+    building the action, and `emit` replays the merged result on the real builder.
+    """
+
+    def __init__(self, action: Any = None):
+        self.action = action
+
+    def noop(self) -> Recorded:
+        return NOOP
+
+    def __getattr__(self, kind: str) -> Callable[..., Recorded]:
+        if kind.startswith("_") or (self.action is not None and not hasattr(self.action, kind)):
+            raise AttributeError(kind)
+        return lambda *args, **kwargs: Recorded(kind, args, kwargs)
+
+    def emit(self, recorded: Recorded) -> Any:
+        if recorded.kind == "noop":
+            return self.action.noop()
+        return getattr(self.action, recorded.kind)(*recorded.args, **recorded.kwargs)
+
+
+def _to_numpy(logits: Any) -> np.ndarray:
+    return logits if isinstance(logits, np.ndarray) else logits.to_numpy()
+
+
+class ComposedMod:
+    """
+    Several mods run as one, with a dispatch table from event type to the mods that handle it.
+
+    On each event only the mods that handle it are called, in order, with a recording builder.
+    Their actions are then combined into the single action the host receives:
+    - adjust_logits: the adjustments are summed as deltas against the event's logits, so independent masks
+      and biases stack (only one host copy is made, and only when two or more mods adjust).
+    - force_tokens: concatenated in mod order.
+    - anything else conflicts: the action with the lowest KIND_PRIORITY rank wins, ties go to the earlier mod
+      (or the lower value in `priorities`), and the other actions are dropped and counted in `stats`.
+
+    A dropped action never reaches the host, so a mod that already updated its state for it (rolled back its
+    text for a backtrack, advanced a matcher for force_tokens) is out of sync unless it registered @on_dropped.
+
+    Events the composer returns to a single mod (SequenceScored for a score_sequence request, BranchesSampled
+    for fork_branches) go through the same table, so only mods that check for them see them.
+    """
+
+    def __init__(self, mods: Sequence[Callable], name: Optional[str] = None, priorities: Optional[Dict[Callable, int]] = None):
+        self.mods = list(mods)
+        self.__name__ = name or "composed"
+        self._order = {fn: (priorities or {}).get(fn, i) for i, fn in enumerate(self.mods)}
+        self._handles = [(fn, handled_events(fn)) for fn in self.mods]
+        self._table: Dict[type, List[Callable]] = {}
+        self._recorder = RecordingActionBuilder()
+        self._backtrack_hooks = [fn for fn in self.mods if getattr(fn, "on_backtrack", None) is not None]
+        # Mods that see ForwardPass; matched by class name because utils does not import the SDK
+        self._forward_mods = [
+            fn for fn, types in self._handles if types is None or any(t.__name__ == "ForwardPass" for t in types)
+        ]
+        # request_id -> mods whose batched handler already covered this step's ForwardPass
+        self._batched_done: Dict[str, Set[Callable]] = {}
+        self.stats: Counter = Counter()
+        if any(getattr(fn, "batched_forward_pass", None) is not None for fn in self.mods):
+            @batched_forward_pass(self)
+            def composed_batched(event, action, tokenizer):
+                return self._batched(event, action, tokenizer)
+
+    def mods_for(self, event_type: type) -> List[Callable]:
+        mods = self._table.get(event_type)
+        if mods is None:
+            mods = [fn for fn, types in self._handles if types is None or issubclass(event_type, types)]
+            self._table[event_type] = mods
+        return mods
+
+    def __call__(self, event: Any, action: Any, tokenizer: Any) -> Any:
+        mods = self.mods_for(type(event))
+        skip = None
+        if self._batched_done and type(event).__name__ == "ForwardPass":
+            skip = self._batched_done.pop(event.request_id, None)
+        recorder = self._builder(action)
+        results: List[Tuple[Callable, Any]] = []
+        for fn in mods:
+            if skip and fn in skip:
+                continue
+            result = fn(event, recorder, tokenizer)
+            # Host noops (e.g. from a SelfPrompt handler) are not actions and must not outrank real ones
+            if result is None or result is NOOP or getattr(result, "kind", None) == "noop":
+                continue
+            results.append((fn, result))
+        if not results:
+            return action.noop()
+        result = results[0][1] if len(results) == 1 else self._merge(event, results)
+        if self._backtrack_hooks and getattr(result, "kind", None) == "backtrack":
+            self._notify_backtrack(event, result, results)
+        return self._emit(recorder, result)
+
+    def _builder(self, action: Any) -> RecordingActionBuilder:
+        if self._recorder.action is not action:
+            self._recorder = RecordingActionBuilder(action)
+        return self._recorder
+
+    def _emit(self, recorder: RecordingActionBuilder, result: Any) -> Any:
+        return recorder.emit(result) if isinstance(result, Recorded) else result
+
+    def _rank(self, fn: Callable, result: Any) -> Tuple[int, int]:
+        kind = getattr(result, "kind", None)
+        return (KIND_PRIORITY.get(kind, OPAQUE_PRIORITY), self._order[fn])
+
+    def _merge(self, event: Any, results: List[Tuple[Callable, Any]]) -> Any:
+        ranked = sorted(results, key=lambda item: self._rank(*item))
+        winner = ranked[0][1]
+        kind = winner.kind if isinstance(winner, Recorded) else None
+        if kind not in MERGEABLE:
+            self._drop(event, ranked[1:])
+            return winner
+        same = [r for _, r in ranked if isinstance(r, Recorded) and r.kind == kind]
+        self._drop(event, [(fn, r) for fn, r in ranked if not (isinstance(r, Recorded) and r.kind == kind)])
+        self.stats[f"merged_{kind}"] += len(same) - 1
+        if kind == "force_tokens":
+            tokens: List[int] = []
+            for r in same:
+                tokens.extend(r.args[0])
+            return Recorded("force_tokens", (tokens,), {})
+        base = event.logits.to_numpy()
+        # Deltas only where the host left the logit finite; -inf - -inf would turn masked entries into NaN
+        finite = np.isfinite(base)
+        masked = ~finite
+        first = same[0].args[0]
+        merged = _to_numpy(first).astype(base.dtype, copy=True)
+        with np.errstate(invalid="ignore"):
+            for r in same[1:]:
+                other = _to_numpy(r.args[0])
+                np.add(merged, other - base, out=merged, where=finite)
+                np.minimum(merged, other, out=merged, where=masked)
+        out = merged if isinstance(first, np.ndarray) else type(first).from_numpy(merged)
+        return Recorded("adjust_logits", (out,), {})
+
+    def _notify_backtrack(self, event: Any, result: Any, results: List[Tuple[Callable, Any]]):
+        owner = next(fn for fn, r in results if r is result)
+        args = tuple(getattr(result, "args", ())) or tuple(getattr(result, "kwargs", {}).values())
+        n = int(args[0]) if args else 0
+        for fn in self._backtrack_hooks:
+            if fn is not owner:
+                fn.on_backtrack(event, n)
+
+    def _drop(self, event: Any, dropped: List[Tuple[Callable, Any]]):
+        self.stats["dropped"] += len(dropped)
+        for fn, result in dropped:
+            self.stats[f"dropped_{getattr(result, 'kind', 'opaque')}"] += 1
+            callback = getattr(fn, "on_dropped", None)
+            if callback is not None:
+                callback(event, getattr(result, "kind", None), tuple(getattr(result, "args", ())))
+
+    def _batched(self, event: BatchedForwardPass, action: BatchedActionBuilder, tokenizer: Any) -> BatchedAction:
+        """
+        Chain every mod's batched handler over the shared [batch, vocab] matrix. Rows a handler defers, and all
+        rows for mods without a batched handler, go back to the per-request path for the mods that still owe them.
+        """
+        mods = self._forward_mods
+        logits = event.logits
+        changed = False
+        defer: Set[str] = set()
+        handled: Dict[Callable, Set[str]] = {}
+        for fn in mods:
+            batched = getattr(fn, "batched_forward_pass", None)
+            if batched is None:
+                defer.update(event.request_ids)
+                continue
+            result = batched(event, action, tokenizer)
+            if result.logits is not None:
+                logits = result.logits
+                event.logits = logits
+                changed = True
+            deferred = set(result.defer)
+            defer |= deferred
+            handled[fn] = deferred
+        for request_id in defer:
+            self._batched_done[request_id] = {fn for fn, deferred in handled.items() if request_id not in deferred}
+        if changed:
+            return action.adjust_logits(logits, defer=sorted(defer))
+        return action.defer(sorted(defer))
+
+
+def compose(*mods: Callable, name: Optional[str] = None, priorities: Optional[Dict[Callable, int]] = None) -> ComposedMod:
+    """
+    Combine mods into one callable with the mod signature; decorate the result with @mod to register it.
+    """
+    return ComposedMod(mods, name=name, priorities=priorities)
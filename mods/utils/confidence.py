@@ -0,0 +1,125 @@
+import math
+import threading
+from typing import Optional
+
+import numpy as np
+
+# Reusable exp buffers, one per thread, so a log-sum-exp over a vocab row allocates nothing per token
+_scratch = threading.local()
+
+
+def _scratch_buffer(size: int) -> np.ndarray:
+    buf = getattr(_scratch, "buf", None)
+    if buf is None or buf.size < size:
+        buf = _scratch.buf = np.empty(size, dtype=np.float32)
+    return buf[:size]
+
+
+def logsumexp_f32(row: np.ndarray) -> float:
+    """
+    Log-sum-exp of a 1D logits row in float32, computed in a reused scratch buffer.
+
+    The row itself is left untouched, so `row[token] - logsumexp_f32(row)` is that token's log-probability.
+    """
+    row = row.reshape(-1)
+    m = float(row.max()) if row.size else float("-inf")
+    if not math.isfinite(m):
+        return m
+    buf = _scratch_buffer(row.size)
+    np.subtract(row, m, out=buf, casting="unsafe")
+    np.exp(buf, out=buf)
+    return m + math.log(float(buf.sum()))
+
+
+class ConfidenceTracker:
+    """
+    Running confidence over a generated sequence, from per-token log-probabilities.
+
+    Prefix sums and EMA values are kept per position in preallocated float64 arrays (grown by doubling),
+    so `push`, `confidence` and `rollback(n)` are O(1) and do not allocate.
+
+    - window=None, ema=None: geometric mean of every token probability so far.
+    - window=W: geometric mean of the last W token probabilities.
+    - ema=a: exp of the exponential moving average of log-probabilities, with weight a on the newest token.
+    """
+
+    def __init__(self, window: Optional[int] = None, ema: Optional[float] = None, floor: float = 1e-32, capacity: int = 1024):
+        if window is not None and window <= 0:
+            raise ValueError("window must be positive")
+        if ema is not None and not 0.0 < ema <= 1.0:
+            raise ValueError("ema must be in (0, 1]")
+        self.window = window
+        self.ema = ema
+        self.min_logprob = math.log(floor)
+        self._n = 0
+        self._cum = np.zeros(capacity + 1, dtype=np.float64)   # _cum[i] = sum of the first i log-probs
+        self._ema = np.zeros(capacity + 1 if ema is not None else 0, dtype=np.float64)   # _ema[i] = EMA after i log-probs
+
+    def __len__(self) -> int:
+        return self._n
+
+    def nbytes(self) -> int:
+        return self._cum.nbytes + self._ema.nbytes
+
+    def push(self, logprob: float):
+        """
+        Record the log-probability of one more token.
+        """
+        n = self._n
+        if n + 1 >= self._cum.size:
+            self._grow()
+        lp = max(min(logprob, 0.0), self.min_logprob)
+        self._cum[n + 1] = self._cum[n] + lp
+        if self.ema is not None:
+            self._ema[n + 1] = lp if n == 0 else self._ema[n] + self.ema * (lp - self._ema[n])
+        self._n = n + 1
+
+    def push_prob(self, prob: float):
+        self.push(math.log(prob) if prob > 0.0 else self.min_logprob)
+
+    def push_certain(self, n: int = 1):
+        """
+        Record n tokens with probability 1 (e.g. forced tokens).
+        """
+        for _ in range(n):
+            self.push(0.0)
+
+    def rollback(self, n: int):
+        """
+        Forget the last n tokens, e.g. after a backtrack.
+        """
+        self._n = max(0, self._n - n)
+
+    def truncate(self, length: int):
+        self._n = max(0, min(self._n, length))
+
+    def reset(self):
+        self._n = 0
+
+    def mean_logprob(self) -> Optional[float]:
+        n = self._n
+        if n == 0:
+            return None
+        if self.window is not None:
+            k = min(n, self.window)
+            return float((self._cum[n] - self._cum[n - k]) / k)
+        if self.ema is not None:
+            return float(self._ema[n])
+        return float(self._cum[n] / n)
+
+    def confidence(self) -> Optional[float]:
+        """
+        Confidence in [0, 1], or None before the first token.
+        """
+        mean = self.mean_logprob()
+        return None if mean is None else math.exp(mean)
+
+    def _grow(self):
+        size = 2 * self._cum.size
+        cum = np.zeros(size, dtype=np.float64)
+        cum[: self._cum.size] = self._cum
+        self._cum = cum
+        if self.ema is not None:
+            ema = np.zeros(size, dtype=np.float64)
+            ema[: self._ema.size] = self._ema
+            self._ema = ema
@@ -0,0 +1,152 @@
+from bisect import bisect_right
+from typing import Any, Iterable, List, Optional, Tuple
+
+# Decoders emit U+FFFD while a multi-byte UTF-8 character is still split across tokens.
+REPLACEMENT_CHAR = "\ufffd"
+
+
+class IncrementalDetokenizer:
+    """
+    Streaming detokenizer for one request.
+
+    Appending a token decodes only a small window around it (the same prefix/read offset scheme
+    used by streaming servers), so the cost per token is constant instead of growing with the
+    sequence. Text is kept as a list of chunks and every token records the character offset its
+    text starts at, so rolling back k tokens after a backtrack is O(k).
+    """
+
+    def __init__(self, tokenizer: Any):
+        self.tokenizer = tokenizer
+        self.token_ids: List[int] = []
+        self.char_offsets: List[int] = []               # char_offsets[i] = text length before token i
+        self._offset_state: List[Tuple[int, int]] = []  # (prefix_offset, read_offset) before token i
+        self._prefix_offset: int = 0
+        self._read_offset: int = 0
+        self._chunks: List[str] = []
+        self._chunk_starts: List[int] = []
+        self._length: int = 0
+        self._joined: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.token_ids)
+
+    @property
+    def text_length(self) -> int:
+        return self._length
+
+    @property
+    def text(self) -> str:
+        if self._joined is None:
+            self._joined = "".join(self._chunks)
+        return self._joined
+
+    def append(self, token_id: int) -> str:
+        """
+        Add one token and return the newly completed text (possibly empty).
+        """
+        token_id = int(token_id)
+        self._offset_state.append((self._prefix_offset, self._read_offset))
+        self.char_offsets.append(self._length)
+        self.token_ids.append(token_id)
+
+        ids = self.token_ids
+        prefix_text = self.tokenizer.decode(ids[self._prefix_offset:self._read_offset])
+        new_text = self.tokenizer.decode(ids[self._prefix_offset:])
+        if len(new_text) > len(prefix_text) and not new_text.endswith(REPLACEMENT_CHAR):
+            piece = new_text[len(prefix_text):]
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(ids)
+            self._push(piece)
+            return piece
+        # Incomplete character: hold the bytes back until the next token completes it
+        return ""
+
+    def extend(self, token_ids: Iterable[int]) -> str:
+        """
+        Add several tokens and return the newly completed text.
+        """
+        return "".join([self.append(t) for t in token_ids])
+
+    def rollback(self, n_tokens: int) -> None:
+        """
+        Remove the last n_tokens tokens and the text they produced.
+        """
+        if n_tokens <= 0:
+            return
+        keep = max(len(self.token_ids) - n_tokens, 0)
+        if keep == len(self.token_ids):
+            return
+        cut = self.char_offsets[keep]
+        self._prefix_offset, self._read_offset = self._offset_state[keep]
+        del self.token_ids[keep:]
+        del self.char_offsets[keep:]
+        del self._offset_state[keep:]
+        self._truncate_text(cut)
+
+    def truncate(self, n_tokens: int) -> None:
+        """
+        Keep only the first n_tokens tokens.
+        """
+        self.rollback(len(self.token_ids) - n_tokens)
+
+    def reset(self) -> None:
+        self.truncate(0)
+
+    def endswith(self, suffix: str) -> bool:
+        if len(suffix) > self._length:
+            return False
+        return self.tail(len(suffix)) == suffix
+
+    def tail(self, n_chars: int) -> str:
+        """
+        Last n_chars characters of the text, read from the trailing chunks only.
+        """
+        if n_chars <= 0:
+            return ""
+        parts: List[str] = []
+        needed = n_chars
+        for chunk in reversed(self._chunks):
+            if len(chunk) >= needed:
+                parts.append(chunk[len(chunk) - needed:])
+                break
+            parts.append(chunk)
+            needed -= len(chunk)
+        return "".join(reversed(parts))
+
+    def text_from(self, char_offset: int) -> str:
+        """
+        Text from char_offset to the end.
+        """
+        return self.tail(self._length - char_offset)
+
+    def token_at(self, char_offset: int) -> Optional[int]:
+        """
+        Index of the token whose text contains char_offset, or None if out of range.
+        """
+        if char_offset < 0 or char_offset >= self._length:
+            return None
+        idx = bisect_right(self.char_offsets, char_offset) - 1
+        # Tokens that only held back partial bytes share an offset with the token that completed them
+        while idx > 0 and self.char_offsets[idx - 1] == self.char_offsets[idx]:
+            idx -= 1
+        return idx
+
+    def _push(self, piece: str) -> None:
+        if not piece:
+            return
+        self._chunk_starts.append(self._length)
+        self._chunks.append(piece)
+        self._length += len(piece)
+        self._joined = None
+
+    def _truncate_text(self, cut: int) -> None:
+        if cut >= self._length:
+            return
+        while self._chunks and self._chunk_starts[-1] >= cut:
+            self._chunks.pop()
+            self._chunk_starts.pop()
+        if self._chunks:
+            start = self._chunk_starts[-1]
+            self._chunks[-1] = self._chunks[-1][:cut - start]
+        self._length = cut
+        self._joined = None
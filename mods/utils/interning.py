@@ -0,0 +1,230 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import weakref
+from pathlib import Path
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+# Opt-in directory for per-tokenizer caches: a path, or "1"/"on" for DEFAULT_CACHE_DIR; unset keeps everything in memory
+ENV_CACHE_DIR = "MODS_TOKEN_CACHE"
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "concordance-mods"
+
+V = TypeVar("V")
+
+
+class ByTokenizer(Generic[V]):
+    """
+    Values keyed by tokenizer object. Tokenizers are held weakly, so the entry of a collected tokenizer cannot
+    pass to a new object that reuses its id(); ones that cannot be weakly referenced are held strongly.
+    """
+
+    def __init__(self):
+        self._weak: "weakref.WeakKeyDictionary[Any, V]" = weakref.WeakKeyDictionary()
+        self._strong: Dict[int, Tuple[Any, V]] = {}
+
+    def get(self, tokenizer: Any) -> Optional[V]:
+        try:
+            return self._weak.get(tokenizer)
+        except TypeError:
+            entry = self._strong.get(id(tokenizer))
+            return entry[1] if entry is not None else None
+
+    def set(self, tokenizer: Any, value: V) -> V:
+        try:
+            self._weak[tokenizer] = value
+        except TypeError:
+            self._strong[id(tokenizer)] = (tokenizer, value)
+        return value
+
+    def setdefault(self, tokenizer: Any, default: V) -> V:
+        value = self.get(tokenizer)
+        return self.set(tokenizer, default) if value is None else value
+
+    def items(self) -> List[Tuple[Any, V]]:
+        return list(self._weak.items()) + list(self._strong.values())
+
+
+_NO_HASH = ""
+_hashes: ByTokenizer[str] = ByTokenizer()
+
+
+def tokenizer_hash(tokenizer: Any) -> Optional[str]:
+    """
+    Fingerprint of a tokenizer's vocabulary and special tokens, or None when it has no `get_vocab()`
+    (such tokenizers get no disk cache, since two of them could not be told apart safely).
+    """
+    cached = _hashes.get(tokenizer)
+    if cached is not None:
+        return cached or None
+    get_vocab = getattr(tokenizer, "get_vocab", None)
+    digest = None
+    if get_vocab is not None:
+        h = hashlib.blake2b(type(tokenizer).__qualname__.encode(), digest_size=16)
+        for token, token_id in sorted(get_vocab().items(), key=lambda item: item[1]):
+            h.update(f"{token_id}\t{token}\n".encode("utf-8", "surrogatepass"))
+        for attr in ("bos_token_id", "eos_token_id", "pad_token_id", "unk_token_id"):
+            h.update(f"{attr}={getattr(tokenizer, attr, None)}\n".encode())
+        # Normalizer and pre-tokenizer settings are not in the vocabulary; a probe encoding covers them
+        h.update(repr(tokenizer.encode(" Hello, World! 123\n\tÀß中", add_special_tokens=False)).encode())
+        digest = h.hexdigest()
+    _hashes.set(tokenizer, digest or _NO_HASH)
+    return digest
+
+
+def cache_dir() -> Optional[Path]:
+    value = os.environ.get(ENV_CACHE_DIR, "")
+    if value in ("", "0", "off"):
+        return None
+    if value in ("1", "on"):
+        return DEFAULT_CACHE_DIR
+    return Path(value)
+
+
+def load_cached(tokenizer: Any, name: str) -> Optional[Any]:
+    """
+    A JSON value cached on disk for this tokenizer, or None.
+    """
+    root = cache_dir()
+    digest = tokenizer_hash(tokenizer) if root is not None else None
+    if digest is None:
+        return None
+    try:
+        with open(root / digest / f"{name}.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_cached(tokenizer: Any, name: str, value: Any) -> bool:
+    """
+    Write a JSON value to this tokenizer's disk cache (atomically). Returns False if there is no cache.
+    """
+    root = cache_dir()
+    digest = tokenizer_hash(tokenizer) if root is not None else None
+    if digest is None:
+        return False
+    path = root / digest / f"{name}.json"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".tmp.{os.getpid()}")
+        with open(tmp, "w") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def store_cached_later(tokenizer: Any, name: str, value: Any) -> None:
+    """
+    `store_cached` from a daemon thread, so a cache write never runs inside a mod event.
+    """
+    if cache_dir() is not None:
+        threading.Thread(target=store_cached, args=(tokenizer, name, value), name=f"store-{name}", daemon=True).start()
+
+
+class TokenConstants:
+    """
+    Constant strings that mods send as tokens, encoded once per tokenizer.
+
+    Declare them at import with `add` (or `intern`). The first lookup for a tokenizer (or `warm`) encodes every
+    declared string in one pass, or loads them from the opt-in disk cache for that tokenizer's hash, so no
+    event encodes a constant and a worker with a warm cache does not encode at all. Strings looked up without
+    being declared are encoded on first use and cached with the rest.
+
+    The returned lists are shared; copy before mutating.
+    """
+
+    def __init__(self, *texts: str, name: str = "constants"):
+        self.name = name
+        self._declared: Dict[str, None] = dict.fromkeys(texts)
+        self._tables: ByTokenizer[_Table] = ByTokenizer()
+        self._lock = threading.Lock()
+        atexit.register(self.save)
+
+    def add(self, text: str) -> str:
+        with self._lock:
+            self._declared[text] = None
+            for tokenizer, table in self._tables.items():
+                if text not in table.ids:
+                    table.encode(tokenizer, text)
+        return text
+
+    def ids(self, tokenizer: Any, text: str) -> List[int]:
+        table = self._tables.get(tokenizer)
+        if table is None:
+            table = self.warm(tokenizer)
+        ids = table.ids.get(text)
+        if ids is None:
+            with self._lock:
+                ids = table.encode(tokenizer, text)
+        return ids
+
+    def length(self, tokenizer: Any, text: str) -> int:
+        return len(self.ids(tokenizer, text))
+
+    def warm(self, tokenizer: Any) -> "_Table":
+        """
+        Build the table for a tokenizer: load it from the disk cache if enabled, then encode what is missing.
+        Call it at worker start-up to keep this off the first event; new entries are written to the disk
+        cache from a background thread.
+        """
+        with self._lock:
+            table = self._tables.get(tokenizer)
+            if table is not None:
+                return table
+            cached = load_cached(tokenizer, self.name) or {}
+            table = _Table({text: ids for text, ids in cached.items() if isinstance(ids, list)})
+            for text in self._declared:
+                if text not in table.ids:
+                    table.encode(tokenizer, text)
+            self._tables.set(tokenizer, table)
+        if table.dirty and cache_dir() is not None:
+            threading.Thread(target=self.save, name=f"save-{self.name}", daemon=True).start()
+        return table
+
+    def save(self):
+        """
+        Write tables with new entries to the disk cache (also run at exit).
+        """
+        with self._lock:
+            pending = []
+            for tokenizer, table in self._tables.items():
+                if table.dirty:
+                    table.dirty = False
+                    pending.append((tokenizer, dict(table.ids)))
+        for tokenizer, ids in pending:
+            store_cached(tokenizer, self.name, ids)
+
+
+class _Table:
+    __slots__ = ("ids", "dirty")
+
+    def __init__(self, ids: Dict[str, List[int]]):
+        self.ids = ids
+        self.dirty = False    # has entries the disk cache lacks
+
+    def encode(self, tokenizer: Any, text: str) -> List[int]:
+        ids = self.ids[text] = tokenizer.encode(text, add_special_tokens=False)
+        self.dirty = True
+        return ids
+
+
+# Shared table for the example mods
+TOKENS = TokenConstants()
+
+
+def intern(text: str) -> str:
+    """
+    Declare a constant string in the shared table; returns it, so `WAIT = intern(" - Wait...")` reads naturally.
+    """
+    return TOKENS.add(text)
+
+
+def constant_ids(tokenizer: Any, text: str) -> List[int]:
+    """
+    Token IDs of a constant string from the shared table.
+    """
+    return TOKENS.ids(tokenizer, text)
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .detokenizer import REPLACEMENT_CHAR
+from .json_stream import DONE, VALUE, WHITESPACE, JSONState, is_complete, step
+from .vocab_index import decode_vocab
+
+# First characters allowed for each JSON-Schema root "type"
+ROOT_TYPE_CHARS = {
+    "object": "{",
+    "array": "[",
+    "string": '"',
+    "number": "-0123456789",
+    "integer": "-0123456789",
+    "boolean": "tf",
+    "null": "n",
+}
+
+# Stands in for the part of a parser stack below the depth any single token can reach
+DEEP = ("deep", None)
+
+
+class VocabTrie:
+    """
+    Character trie over the decoded vocabulary. Token IDs sharing a prefix share trie nodes,
+    so checking the whole vocabulary against a parser state steps each shared prefix once.
+    """
+
+    def __init__(self, token_strs: Sequence[str]):
+        self.children: List[Dict[str, int]] = [{}]
+        self.token_ids: List[List[int]] = [[]]
+        for tid, text in enumerate(token_strs):
+            # Empty (special) tokens and tokens holding partial UTF-8 cannot be checked per character
+            if not text or REPLACEMENT_CHAR in text:
+                continue
+            node = 0
+            for ch in text:
+                nxt = self.children[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.children)
+                    self.children[node][ch] = nxt
+                    self.children.append({})
+                    self.token_ids.append([])
+                node = nxt
+            self.token_ids[node].append(tid)
+
+
+class JSONGrammar:
+    """
+    JSON grammar compiled against a tokenizer vocabulary.
+
+    Parser states from json_stream act as the states of a token-level automaton: `advance` moves
+    along one token, and `mask` gives the boolean vector of tokens allowed next. Masks are computed
+    with one pruned walk over the vocabulary trie and kept in an LRU keyed by the parser state with its
+    stack cut to the depth a single token can pop, so nesting depth does not multiply cache entries.
+    """
+
+    def __init__(
+        self,
+        token_strs: Sequence[str],
+        eos_token_id: int,
+        vocab_size: Optional[int] = None,
+        root_types: Optional[Iterable[str]] = None,
+        cache_size: int = 4096,
+    ):
+        # A finished document may only end, so without EOS its mask would ban every token
+        if eos_token_id is None:
+            raise ValueError("JSONGrammar needs an EOS token id to end a finished document")
+        self.token_strs = list(token_strs)
+        self.vocab_size = vocab_size or len(self.token_strs)
+        self.eos_token_id = eos_token_id
+        self.trie = VocabTrie(self.token_strs)
+        self.root_chars: Optional[frozenset] = None
+        if root_types is not None:
+            self.root_chars = frozenset("".join(ROOT_TYPE_CHARS[t] for t in root_types))
+        closers = [s.count("}") + s.count("]") for s in self.token_strs if s]
+        self.max_depth = 1 + max(closers, default=0)
+        self.cache_size = cache_size
+        self._masks: "OrderedDict[Any, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer: Any, vocab_size: int, **kwargs) -> "JSONGrammar":
+        return cls(decode_vocab(tokenizer, vocab_size), getattr(tokenizer, "eos_token_id", None), vocab_size, **kwargs)
+
+    def step(self, state: JSONState, ch: str) -> Optional[JSONState]:
+        if self.root_chars is not None and state[0] == VALUE and state[2] is None:
+            if ch not in WHITESPACE and ch not in self.root_chars:
+                return None
+        return step(state, ch)
+
+    def advance(self, state: JSONState, token_id: int) -> Optional[JSONState]:
+        """
+        Parser state after token_id, or None if the token breaks the grammar.
+        """
+        if token_id < 0 or token_id >= len(self.token_strs):
+            return None
+        for ch in self.token_strs[token_id]:
+            state = self.step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    def mask(self, state: JSONState) -> np.ndarray:
+        """
+        Read-only boolean mask over the vocabulary of tokens allowed in `state`.
+        """
+        key = self._cache_key(state)
+        cached = self._masks.get(key)
+        if cached is not None:
+            self._masks.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        mask = self._compute_mask(key)
+        mask.flags.writeable = False
+        self._masks[key] = mask
+        if len(self._masks) > self.cache_size:
+            self._masks.popitem(last=False)
+        return mask
+
+    def _cache_key(self, state: JSONState):
+        mode, sub, stack = state
+        return (mode, sub, _truncate(stack, self.max_depth))
+
+    def _compute_mask(self, state: JSONState) -> np.ndarray:
+        mask = np.zeros(self.vocab_size, dtype=np.bool_)
+        if is_complete(state):
+            mask[self.eos_token_id] = True
+        if state[0] == DONE:
+            # Finished documents may only end; trailing whitespace would let generation run on
+            return mask
+        children = self.trie.children
+        token_ids = self.trie.token_ids
+        allowed: List[int] = []
+        todo = [(0, state)]
+        while todo:
+            node, st = todo.pop()
+            for ch, child in children[node].items():
+                nxt = self.step(st, ch)
+                if nxt is None:
+                    continue
+                if token_ids[child]:
+                    allowed.extend(token_ids[child])
+                if children[child]:
+                    todo.append((child, nxt))
+        if allowed:
+            mask[np.asarray(allowed, dtype=np.int64)] = True
+        return mask
+
+
+def _truncate(stack, depth: int):
+    if stack is None:
+        return None
+    if depth == 0:
+        return DEEP
+    return (stack[0], _truncate(stack[1], depth - 1))
@@ -0,0 +1,274 @@
+from typing import Any, Iterable, List, Optional, Tuple
+
+from .detokenizer import IncrementalDetokenizer
+from .triggers import AhoCorasick
+
+# Parser modes. A parser state is the immutable tuple (mode, sub, stack), where stack is a linked
+# list of nested tuples ("o" | "a", rest) or None. Immutability makes a checkpoint a plain reference.
+VALUE, ARRAY_START, OBJECT_START, KEY, COLON, AFTER_VALUE, STRING, STRING_ESC, STRING_HEX, NUMBER, LITERAL, DONE = range(12)
+
+# NUMBER sub-states
+N_MINUS, N_ZERO, N_INT, N_DOT, N_FRAC, N_E, N_ESIGN, N_EXP = range(8)
+N_ACCEPTING = frozenset((N_ZERO, N_INT, N_FRAC, N_EXP))
+
+WHITESPACE = frozenset(" \t\n\r")
+DIGITS = frozenset("0123456789")
+HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+ESCAPES = frozenset('"\\/bfnrt')
+LITERALS = {"t": "rue", "f": "alse", "n": "ull"}
+
+JSONState = Tuple[int, Any, Any]
+INITIAL: JSONState = (VALUE, 0, None)
+
+
+def _after_value(stack) -> JSONState:
+    if stack is None:
+        return (DONE, 0, None)
+    return (AFTER_VALUE, 0, stack)
+
+
+def _start_value(ch: str, stack) -> Optional[JSONState]:
+    if ch == "{":
+        return (OBJECT_START, 0, ("o", stack))
+    if ch == "[":
+        return (ARRAY_START, 0, ("a", stack))
+    if ch == '"':
+        return (STRING, False, stack)
+    if ch == "-":
+        return (NUMBER, N_MINUS, stack)
+    if ch == "0":
+        return (NUMBER, N_ZERO, stack)
+    if ch in DIGITS:
+        return (NUMBER, N_INT, stack)
+    rest = LITERALS.get(ch)
+    if rest is not None:
+        return (LITERAL, rest, stack)
+    return None
+
+
+def _step_number(sub: int, ch: str) -> Optional[int]:
+    if ch in DIGITS:
+        if sub in (N_MINUS, N_INT):
+            return N_INT if sub == N_INT or ch != "0" else N_ZERO
+        if sub in (N_DOT, N_FRAC):
+            return N_FRAC
+        if sub in (N_E, N_ESIGN, N_EXP):
+            return N_EXP
+        return None  # digits after a leading zero
+    if ch == "." and sub in (N_ZERO, N_INT):
+        return N_DOT
+    if ch in "eE" and sub in (N_ZERO, N_INT, N_FRAC):
+        return N_E
+    if ch in "+-" and sub == N_E:
+        return N_ESIGN
+    return None
+
+
+def step(state: JSONState, ch: str) -> Optional[JSONState]:
+    """
+    Advance a JSON parser state by one character. Returns None if ch cannot continue valid JSON.
+    """
+    mode, sub, stack = state
+    if mode == STRING:
+        if ch == '"':
+            return (COLON, 0, stack) if sub else _after_value(stack)
+        if ch == "\\":
+            return (STRING_ESC, sub, stack)
+        if ch < " ":
+            return None
+        return state
+    if mode == STRING_ESC:
+        if ch in ESCAPES:
+            return (STRING, sub, stack)
+        if ch == "u":
+            return (STRING_HEX, (4, sub), stack)
+        return None
+    if mode == STRING_HEX:
+        if ch not in HEX_DIGITS:
+            return None
+        remaining, is_key = sub
+        if remaining == 1:
+            return (STRING, is_key, stack)
+        return (STRING_HEX, (remaining - 1, is_key), stack)
+    if mode == NUMBER:
+        nxt = _step_number(sub, ch)
+        if nxt is not None:
+            return (NUMBER, nxt, stack)
+        if sub not in N_ACCEPTING:
+            return None
+        # The number ended; the character belongs to whatever follows it
+        return step(_after_value(stack), ch)
+    if mode == LITERAL:
+        if ch != sub[0]:
+            return None
+        if len(sub) == 1:
+            return _after_value(stack)
+        return (LITERAL, sub[1:], stack)
+
+    if ch in WHITESPACE:
+        return state
+    if mode == VALUE:
+        return _start_value(ch, stack)
+    if mode == AFTER_VALUE:
+        top = stack[0]
+        if ch == ",":
+            return (KEY, 0, stack) if top == "o" else (VALUE, 0, stack)
+        if (ch == "}" and top == "o") or (ch == "]" and top == "a"):
+            return _after_value(stack[1])
+        return None
+    if mode == ARRAY_START:
+        if ch == "]":
+            return _after_value(stack[1])
+        return _start_value(ch, stack)
+    if mode == OBJECT_START:
+        if ch == "}":
+            return _after_value(stack[1])
+        if ch == '"':
+            return (STRING, True, stack)
+        return None
+    if mode == KEY:
+        if ch == '"':
+            return (STRING, True, stack)
+        return None
+    if mode == COLON:
+        if ch == ":":
+            return (VALUE, 0, stack)
+        return None
+    # DONE: only trailing whitespace is allowed
+    return None
+
+
+def is_complete(state: JSONState) -> bool:
+    """
+    True if the text fed so far is a complete JSON document.
+    """
+    mode, sub, stack = state
+    return mode == DONE or (mode == NUMBER and stack is None and sub in N_ACCEPTING)
+
+
+class StreamingJSONValidator:
+    """
+    Character-at-a-time JSON validator. Feeding a piece costs O(len(piece)) however long the document is.
+    """
+
+    def __init__(self, state: JSONState = INITIAL):
+        self.state: JSONState = state
+
+    def feed(self, text: str) -> Optional[int]:
+        """
+        Feed text. Returns the index in `text` of the first invalid character, or None.
+        On error the state is left at the last valid character.
+        """
+        s = self.state
+        for i, ch in enumerate(text):
+            nxt = step(s, ch)
+            if nxt is None:
+                self.state = s
+                return i
+            s = nxt
+        self.state = s
+        return None
+
+    @property
+    def complete(self) -> bool:
+        return is_complete(self.state)
+
+
+# Block scanner modes
+OUTSIDE, HEADER, BLOCK, FENCE = range(4)
+OPENER = AhoCorasick(["```json"])
+
+
+class JSONBlockValidator:
+    """
+    Validates ```json fenced blocks in a token stream as the tokens arrive.
+
+    Each token records the scanner state before it (an immutable tuple), so rolling back
+    k tokens after a backtrack is O(k) and restoring the parser itself is O(1).
+    """
+
+    def __init__(self, tokenizer: Any):
+        self.detok = IncrementalDetokenizer(tokenizer)
+        # (scan mode, scan sub-state, json state)
+        self.state: Tuple[int, Any, JSONState] = (OUTSIDE, 0, INITIAL)
+        self.checkpoints: List[Tuple[int, Any, JSONState]] = []
+        self.error_message: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.detok)
+
+    def extend(self, token_ids: Iterable[int]) -> Optional[int]:
+        """
+        Feed tokens. Returns the index of the first token holding invalid JSON, or None.
+        Every token is recorded even after an error, so len(self) stays equal to the host's sequence and
+        len(self) - index is the backtrack that removes the error. The parser state stays at the last valid
+        character; call rollback() before continuing.
+        """
+        err_token = None
+        for tok in token_ids:
+            self.checkpoints.append(self.state)
+            piece = self.detok.append(tok)
+            if err_token is not None:
+                continue
+            offset = self.detok.text_length - len(piece)
+            for i, ch in enumerate(piece):
+                err = self._step(ch, offset + i)
+                if err is not None:
+                    err_token = self.detok.token_at(err)
+                    break
+        return err_token
+
+    def rollback(self, n_tokens: int) -> List[int]:
+        """
+        Remove the last n tokens and restore the state before them. Returns the removed tokens.
+        """
+        keep = max(len(self.detok) - n_tokens, 0)
+        removed = self.detok.token_ids[keep:]
+        if keep == len(self.detok):
+            return removed
+        self.state = self.checkpoints[keep]
+        del self.checkpoints[keep:]
+        self.detok.truncate(keep)
+        self.error_message = None
+        return removed
+
+    @property
+    def in_block(self) -> bool:
+        return self.state[0] in (BLOCK, FENCE)
+
+    def _step(self, ch: str, offset: int) -> Optional[int]:
+        """
+        Advance the scanner by one character at absolute text offset `offset`. Returns an error offset or None.
+        """
+        mode, sub, js = self.state
+        if mode == OUTSIDE:
+            node = OPENER.step(sub, ch.lower())
+            self.state = (HEADER, 0, INITIAL) if OPENER.outputs[node] else (OUTSIDE, node, js)
+            return None
+        if mode == HEADER:
+            if ch == "\n":
+                self.state = (BLOCK, 0, INITIAL)
+            return None
+        if mode == BLOCK:
+            if ch == "`" and js[0] not in (STRING, STRING_ESC, STRING_HEX):
+                if not is_complete(js):
+                    self.error_message = "unexpected end of JSON"
+                    return offset
+                self.state = (FENCE, (1, offset), js)
+                return None
+            nxt = step(js, ch)
+            if nxt is None:
+                self.error_message = f"unexpected character {ch!r}"
+                return offset
+            self.state = (BLOCK, 0, nxt)
+            return None
+        # FENCE
+        count, fence_start = sub
+        if ch != "`":
+            self.error_message = "unexpected '`' after JSON"
+            return fence_start
+        if count == 2:
+            self.state = (OUTSIDE, 0, INITIAL)
+        else:
+            self.state = (FENCE, (count + 1, fence_start), js)
+        return None
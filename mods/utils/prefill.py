@@ -0,0 +1,171 @@
+from bisect import bisect_left
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .detokenizer import REPLACEMENT_CHAR, IncrementalDetokenizer
+from .interning import ByTokenizer
+from .vocab_index import get_vocab_index
+
+def tokenizer_size(tokenizer: Any) -> int:
+    try:
+        return len(tokenizer)
+    except TypeError:
+        return int(tokenizer.vocab_size)
+
+
+def encode_continuation(tokenizer: Any, text: str) -> List[int]:
+    """
+    Token IDs for text that continues a sequence instead of starting one. SentencePiece tokenizers put a
+    dummy-prefix space in front of whatever they encode, so the text is encoded after a newline and the
+    newline's tokens are dropped; if the newline merges with the text, it is encoded on its own.
+    """
+    head = tokenizer.encode("\n", add_special_tokens=False)
+    ids = tokenizer.encode("\n" + text, add_special_tokens=False)
+    if ids[:len(head)] == head:
+        return ids[len(head):]
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+class PrefillRewriter:
+    """
+    Phrase replacements applied to prompt token IDs without decoding or re-encoding the whole prompt.
+
+    Every tokenization of a phrase has a token containing each of its characters. So the only candidate
+    positions are tokens whose text contains the phrase character that is rarest in this prompt; they are
+    found with one `np.bincount` and one vectorized `np.isin` over the prompt IDs. Only a small window around
+    each candidate is decoded. Only the tokens overlapping a match are re-encoded, and every other token ID is
+    kept as is, so the host's prefix/KV cache still hits up to the first edit. This also handles a phrase that
+    was tokenized together with its neighbours (e.g. " Say" or "hi.\\n").
+
+    SentencePiece tokenizers drop the leading space of the first token they decode and add one to the text
+    they encode. Each window is therefore decoded after one token of context, and edits after the start of
+    the prompt are re-encoded with `encode_continuation`. Whitespace is never an anchor, since the vocabulary
+    is decoded one token at a time and such tokens lose their leading space.
+    """
+
+    def __init__(self, replacements: Union[Mapping[str, str], Sequence[Tuple[str, str]]]):
+        pairs = list(replacements.items()) if isinstance(replacements, Mapping) else list(replacements)
+        if any(not phrase for phrase, _ in pairs):
+            raise ValueError("phrases must be non-empty")
+        self.replacements: List[Tuple[str, str]] = pairs
+        # tokenizer -> phrase -> candidate anchor ID arrays
+        self._anchors: ByTokenizer[Dict[str, List[np.ndarray]]] = ByTokenizer()
+
+    def _phrase_anchors(self, tokenizer: Any, phrase: str) -> List[np.ndarray]:
+        by_phrase = self._anchors.setdefault(tokenizer, {})
+        anchors = by_phrase.get(phrase)
+        if anchors is None:
+            index = get_vocab_index(tokenizer, tokenizer_size(tokenizer))
+            strs = index.token_strs
+            empty = np.empty(0, dtype=np.int32)
+            options = []
+            for ch in set(phrase):
+                if ch.isspace():
+                    continue
+                ids = index.postings.get(ch, empty)
+                if ord(ch) > 127:
+                    # The character may also be spelled with partial-byte tokens, which decode to U+FFFD; take the
+                    # ones the tokenizer uses for it on its own and after a space
+                    spelled = tokenizer.encode(ch, add_special_tokens=False) + tokenizer.encode(" " + ch, add_special_tokens=False)
+                    partial = [t for t in spelled if t < len(strs) and REPLACEMENT_CHAR in strs[t]]
+                    ids = np.union1d(ids, np.asarray(partial, dtype=np.int32)).astype(np.int32)
+                if ids.size:
+                    options.append(ids)
+            anchors = options
+            by_phrase[phrase] = anchors
+        return anchors
+
+    def _candidates(self, ids: np.ndarray, counts: np.ndarray, tokenizer: Any, phrase: str) -> np.ndarray:
+        anchors = self._phrase_anchors(tokenizer, phrase)
+        if not anchors:
+            # No usable anchor: every position is a candidate
+            return np.arange(ids.size)
+        # The character whose tokens are least frequent in this prompt gives the fewest windows to decode
+        best = min(anchors, key=lambda anchor: int(counts[anchor].sum()))
+        return np.flatnonzero(np.isin(ids, best))
+
+    def _windows(self, ids: np.ndarray, tokenizer: Any) -> List[Tuple[int, int]]:
+        spans = []
+        counts = np.bincount(ids, minlength=tokenizer_size(tokenizer))
+        for phrase, _ in self.replacements:
+            # Each token holds at least one byte, so a match lies within this many tokens of its anchor
+            reach = len(phrase.encode("utf-8")) + 2
+            for c in self._candidates(ids, counts, tokenizer, phrase).tolist():
+                spans.append((max(0, c - reach), min(ids.size, c + reach + 1)))
+        spans.sort()
+        merged: List[Tuple[int, int]] = []
+        for lo, hi in spans:
+            if merged and lo <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+            else:
+                merged.append((lo, hi))
+        return merged
+
+    def find(self, token_ids: Sequence[int], tokenizer: Any) -> List[Tuple[int, int, str]]:
+        """
+        Token spans to rewrite, as (start, end, new_text) with new_text the decoded span after replacement.
+        Spans are sorted and disjoint; a match that overlaps an earlier one is skipped.
+        """
+        ids = np.asarray(token_ids, dtype=np.int64)
+        edits: List[Tuple[int, int, str]] = []
+        for lo, hi in self._windows(ids, tokenizer):
+            # One token of context, so the window's first token decodes with its leading space
+            ctx = 1 if lo > 0 else 0
+            lo -= ctx
+            detok = IncrementalDetokenizer(tokenizer)
+            detok.extend(token_ids[lo:hi])
+            text = detok.text
+            start = detok.char_offsets[ctx] if ctx < len(detok) else len(text)
+            matches = []
+            for phrase, replacement in self.replacements:
+                at = text.find(phrase, start)
+                while at != -1:
+                    matches.append((at, at + len(phrase), replacement))
+                    at = text.find(phrase, at + len(phrase))
+            matches.sort()
+            offsets = detok.char_offsets
+            groups: List[List[Any]] = []   # [t0, t1, [(start, end, replacement)]]
+            end = -1
+            for s, e, replacement in matches:
+                if s < end:
+                    continue
+                end = e
+                t0 = detok.token_at(s)
+                # token_at walks back over tokens with no text of their own; keep special tokens out of the edit
+                while t0 < len(offsets) - 1 and offsets[t0] == offsets[t0 + 1] and tokenizer.decode([token_ids[lo + t0]]) == "":
+                    t0 += 1
+                t1 = bisect_left(offsets, e)
+                if groups and t0 < groups[-1][1]:
+                    groups[-1][1] = max(groups[-1][1], t1)
+                    groups[-1][2].append((s, e, replacement))
+                else:
+                    groups.append([t0, t1, [(s, e, replacement)]])
+            for t0, t1, subs in groups:
+                c0 = offsets[t0]
+                c1 = offsets[t1] if t1 < len(offsets) else len(text)
+                pieces, pos = [], c0
+                for s, e, replacement in subs:
+                    pieces.append(text[pos:s])
+                    pieces.append(replacement)
+                    pos = e
+                pieces.append(text[pos:c1])
+                edits.append((lo + t0, lo + t1, "".join(pieces)))
+        return edits
+
+    def rewrite(self, token_ids: Sequence[int], tokenizer: Any) -> Optional[List[int]]:
+        """
+        The rewritten token IDs, or None when no phrase occurs (so the prefill can be left alone).
+        """
+        token_ids = list(token_ids)
+        edits = self.find(token_ids, tokenizer)
+        if not edits:
+            return None
+        out: List[int] = []
+        pos = 0
+        for start, end, new_text in edits:
+            out.extend(token_ids[pos:start])
+            out.extend(encode_continuation(tokenizer, new_text) if start else tokenizer.encode(new_text, add_special_tokens=False))
+            pos = end
+        out.extend(token_ids[pos:])
+        return out
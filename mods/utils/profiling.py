@@ -0,0 +1,341 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import urllib.request
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ENV_ENABLE = "MOD_PROFILE"              # "1" turns the profiler on at import
+ENV_EXPORT = "MOD_PROFILE_EXPORT"       # file path or http(s) URL for export_from_env()
+ENV_INTERVAL = "MOD_PROFILE_INTERVAL"   # seconds between exports; unset means only at exit
+
+# Wall-time histogram bucket upper bounds in seconds: 1us doubling up to ~1s
+BUCKETS: Tuple[float, ...] = tuple(1e-6 * 2 ** k for k in range(21))
+_BUCKETS_NS = [int(round(b * 1e9)) for b in BUCKETS]
+
+
+class Series:
+    """
+    Counters for one (mod, event type).
+    """
+    __slots__ = ("calls", "total_ns", "buckets", "actions", "backtrack_tokens", "to_numpy_bytes")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.buckets = [0] * (len(_BUCKETS_NS) + 1)   # last slot is +Inf
+        self.actions: Counter = Counter()
+        self.backtrack_tokens = 0
+        self.to_numpy_bytes = 0
+
+    def observe(self, ns: int):
+        self.calls += 1
+        self.total_ns += ns
+        self.buckets[bisect_left(_BUCKETS_NS, ns)] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "total_s": self.total_ns / 1e9,
+            "mean_us": self.total_ns / 1e3 / self.calls if self.calls else 0.0,
+            "buckets": {_le(i): n for i, n in enumerate(self.buckets) if n},
+            "actions": dict(self.actions),
+            "backtrack_tokens": self.backtrack_tokens,
+            "to_numpy_bytes": self.to_numpy_bytes,
+        }
+
+
+class _CountingBuilder:
+    """
+    Passes every call through to the host's ActionBuilder and counts it against the current series.
+    """
+
+    def __init__(self, action: Any, profiler: "Profiler"):
+        self._action = action
+        self._profiler = profiler
+
+    def __getattr__(self, kind: str) -> Any:
+        target = getattr(self._action, kind)
+        if kind.startswith("_") or not callable(target):
+            return target
+        local = self._profiler._local
+
+        def call(*args, **kwargs):
+            series = getattr(local, "series", None)
+            if series is not None:
+                series.actions[kind] += 1
+                if kind == "backtrack":
+                    n = args[0] if args else kwargs.get("n_to_remove", 0)
+                    series.backtrack_tokens += int(n)
+            return target(*args, **kwargs)
+
+        # Cached on the instance, so later lookups of the same action skip __getattr__
+        setattr(self, kind, call)
+        return call
+
+
+class Profiler:
+    """
+    Per-mod, per-event-type call counts, wall-time histograms, action counts, tokens removed by backtrack,
+    and bytes returned by `to_numpy` on event tensors.
+
+    Disabled, a profiled mod costs one attribute check per call. `export` writes JSON or Prometheus text
+    to a file (e.g. a node_exporter textfile collector directory) or POSTs it to an http(s) URL.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = os.environ.get(ENV_ENABLE, "") not in ("", "0") if enabled is None else enabled
+        self._series: Dict[Tuple[str, str], Series] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._exporter: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            for series in self._series.values():
+                series.clear()
+
+    def series(self, mod_name: str, event_name: str) -> Series:
+        key = (mod_name, event_name)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, Series())
+        return series
+
+    def _builder(self, action: Any) -> _CountingBuilder:
+        builder = getattr(self._local, "builder", None)
+        if builder is None or builder._action is not action:
+            builder = self._local.builder = _CountingBuilder(action, self)
+        return builder
+
+    def call(self, name: str, fn: Callable, event: Any, action: Any, tokenizer: Any) -> Any:
+        series = self.series(name, type(event).__name__)
+        logits = getattr(event, "logits", None)
+        uncount = _count_copies(logits, series) if logits is not None else None
+        local = self._local
+        outer = getattr(local, "series", None)
+        local.series = series
+        start = time.perf_counter_ns()
+        try:
+            return fn(event, self._builder(action), tokenizer)
+        finally:
+            series.observe(time.perf_counter_ns() - start)
+            local.series = outer
+            if uncount is not None:
+                uncount()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        {mod: {event type: counters}} for every series that has seen a call.
+        """
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            items = sorted(self._series.items())
+        for (mod_name, event_name), series in items:
+            if series.calls:
+                out.setdefault(mod_name, {})[event_name] = series.as_dict()
+        return out
+
+    def to_json(self) -> str:
+        return json.dumps({"buckets_s": list(BUCKETS), "mods": self.snapshot()}, indent=2)
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            items = sorted((k, s) for k, s in self._series.items() if s.calls)
+        lines: List[str] = []
+
+        def family(metric: str, kind: str, help_text: str):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+
+        family("mod_calls_total", "counter", "Mod calls by mod and event type.")
+        for (m, e), s in items:
+            lines.append(f"mod_calls_total{_labels(mod=m, event=e)} {s.calls}")
+        family("mod_call_seconds", "histogram", "Wall time of one mod call.")
+        for (m, e), s in items:
+            cumulative = 0
+            for i, n in enumerate(s.buckets):
+                cumulative += n
+                lines.append(f"mod_call_seconds_bucket{_labels(mod=m, event=e, le=_le(i))} {cumulative}")
+            lines.append(f"mod_call_seconds_sum{_labels(mod=m, event=e)} {s.total_ns / 1e9!r}")
+            lines.append(f"mod_call_seconds_count{_labels(mod=m, event=e)} {s.calls}")
+        family("mod_actions_total", "counter", "Actions built by mods, by action type.")
+        for (m, e), s in items:
+            for kind, n in sorted(s.actions.items()):
+                lines.append(f"mod_actions_total{_labels(mod=m, event=e, action=kind)} {n}")
+        family("mod_backtrack_tokens_total", "counter", "Tokens removed by backtrack actions.")
+        for (m, e), s in items:
+            lines.append(f"mod_backtrack_tokens_total{_labels(mod=m, event=e)} {s.backtrack_tokens}")
+        family("mod_to_numpy_bytes_total", "counter", "Bytes returned by to_numpy on event tensors.")
+        for (m, e), s in items:
+            lines.append(f"mod_to_numpy_bytes_total{_labels(mod=m, event=e)} {s.to_numpy_bytes}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, target: str, fmt: Optional[str] = None):
+        """
+        Write the metrics to a file path (replaced atomically) or POST them to an http(s) URL.
+        `fmt` is "json" or "prometheus"; by default a target ending in .json gets JSON.
+        """
+        fmt = fmt or ("json" if target.endswith(".json") else "prometheus")
+        body = self.to_json() if fmt == "json" else self.to_prometheus()
+        if target.startswith(("http://", "https://")):
+            content_type = "application/json" if fmt == "json" else "text/plain; version=0.0.4"
+            request = urllib.request.Request(target, data=body.encode(), method="POST", headers={"Content-Type": content_type})
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+            return
+        tmp = f"{target}.tmp.{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write(body)
+        os.replace(tmp, target)
+
+    def export_from_env(self) -> bool:
+        """
+        Export as configured by MOD_PROFILE_EXPORT and MOD_PROFILE_INTERVAL: periodically and at exit with an
+        interval, else only at exit. Nothing is exported unless a worker calls this. Returns False if unset.
+        """
+        target = os.environ.get(ENV_EXPORT)
+        if not target:
+            return False
+        interval = float(os.environ.get(ENV_INTERVAL) or 0)
+        if interval > 0:
+            self.start_exporter(target, interval)
+        else:
+            atexit.register(self._final_export, target, None)
+        return True
+
+    def start_exporter(self, target: str, interval: float, fmt: Optional[str] = None):
+        """
+        Export every `interval` seconds from a daemon thread, and once more at exit.
+        """
+        if self._exporter is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.export(target, fmt)
+                except OSError:
+                    pass
+
+        self._exporter = threading.Thread(target=loop, name="mod-profile-export", daemon=True)
+        self._exporter.start()
+        atexit.register(self._final_export, target, fmt)
+
+    def stop_exporter(self):
+        self._stop.set()
+
+    def _final_export(self, target: str, fmt: Optional[str]):
+        self._stop.set()
+        try:
+            self.export(target, fmt)
+        except OSError:
+            pass
+
+
+PROFILER = Profiler()
+
+
+class ProfiledMod:
+    """
+    A mod that reports to a Profiler when it is enabled, and otherwise calls straight through.
+    A batched ForwardPass handler registered on it is profiled as event type "BatchedForwardPass".
+    """
+
+    def __init__(self, fn: Callable, name: Optional[str] = None, profiler: Optional[Profiler] = None):
+        functools.update_wrapper(self, fn)
+        self.fn = fn
+        self.name = name or getattr(fn, "__name__", type(fn).__name__)
+        self.profiler = profiler or PROFILER
+        self._batched: Optional[Callable] = None
+        # update_wrapper copied a handler registered on `fn` into __dict__, where the property hides it
+        self.batched_forward_pass = self.__dict__.pop("batched_forward_pass", None)
+
+    def __call__(self, event: Any, action: Any, tokenizer: Any) -> Any:
+        if not self.profiler.enabled:
+            return self.fn(event, action, tokenizer)
+        return self.profiler.call(self.name, self.fn, event, action, tokenizer)
+
+    @property
+    def batched_forward_pass(self) -> Optional[Callable]:
+        return self._batched
+
+    @batched_forward_pass.setter
+    def batched_forward_pass(self, handler: Optional[Callable]):
+        if handler is None:
+            self._batched = None
+            return
+        profiler = self.profiler
+        name = self.name
+
+        @functools.wraps(handler)
+        def batched(event, action, tokenizer):
+            if not profiler.enabled:
+                return handler(event, action, tokenizer)
+            return profiler.call(name, handler, event, action, tokenizer)
+
+        self._batched = batched
+
+
+def profiled(fn: Optional[Callable] = None, *, name: Optional[str] = None, profiler: Optional[Profiler] = None) -> Any:
+    """
+    Profile a mod: put `@profiled` under `@mod` (or wrap a composed mod with `profiled(pipeline)`).
+    """
+    if fn is None:
+        return lambda f: ProfiledMod(f, name=name, profiler=profiler)
+    return ProfiledMod(fn, name=name, profiler=profiler)
+
+
+def _count_copies(tensor: Any, series: Series) -> Optional[Callable[[], None]]:
+    """
+    Count the bytes `to_numpy` returns by shadowing the method on this tensor instance, so the mod still
+    gets the event and tensor it would get unprofiled. Returns the function that removes the shadow, or None
+    when the tensor has no `to_numpy` or takes no instance attributes (its copies then go uncounted).
+    """
+    original = getattr(tensor, "to_numpy", None)
+    if original is None:
+        return None
+    shadowed = "to_numpy" in getattr(tensor, "__dict__", ())
+
+    def to_numpy(*args, **kwargs):
+        out = original(*args, **kwargs)
+        series.to_numpy_bytes += getattr(out, "nbytes", 0)
+        return out
+
+    try:
+        tensor.to_numpy = to_numpy
+    except (AttributeError, TypeError):
+        return None
+
+    def uncount():
+        if shadowed:
+            tensor.to_numpy = original
+        else:
+            del tensor.to_numpy
+    return uncount
+
+
+def _le(i: int) -> str:
+    return repr(BUCKETS[i]) if i < len(BUCKETS) else "+Inf"
+
+
+def _labels(**labels: str) -> str:
+    def escape(value: str) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
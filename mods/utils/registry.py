@@ -0,0 +1,170 @@
+import ast
+import importlib.util
+import itertools
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+MODS_ROOT = Path(__file__).resolve().parent.parent
+SCAN_DIRS = ("simple", "scaffolding", "agent")
+# Comma-separated mod or file names to enable; unset enables every mod found
+ENV_ENABLED = "MODS_ENABLED"
+
+_load_counter = itertools.count()
+
+
+@dataclass(frozen=True)
+class ModInfo:
+    """
+    What a mod file declares, read from its source without importing it.
+    """
+    name: str                              # the @mod function
+    path: Path
+    doc: str                               # first line of its docstring
+    events: Optional[Tuple[str, ...]]      # event class names from its isinstance checks; None means all
+    batched: bool                          # has a @batched_forward_pass handler
+    imports: Tuple[str, ...]               # top-level packages the file imports
+
+    @property
+    def stem(self) -> str:
+        return self.path.stem
+
+
+def scan_file(path: Path) -> List[ModInfo]:
+    """
+    The @mod functions defined in a file, found by parsing it.
+    """
+    tree = ast.parse(path.read_text(), filename=str(path))
+    imports = set()
+    mods: Dict[str, ast.FunctionDef] = {}
+    batched = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            imports.add(node.module.split(".")[0])
+        elif isinstance(node, ast.FunctionDef):
+            for dec in node.decorator_list:
+                if _decorator_name(dec) == "mod":
+                    mods[node.name] = node
+                elif isinstance(dec, ast.Call) and _decorator_name(dec.func) == "batched_forward_pass":
+                    if dec.args and isinstance(dec.args[0], ast.Name):
+                        batched.add(dec.args[0].id)
+    infos = []
+    for name, fn in mods.items():
+        doc = (ast.get_docstring(fn) or "").strip().split("\n")[0]
+        infos.append(ModInfo(name, path, doc, _event_names(fn), name in batched, tuple(sorted(imports))))
+    return infos
+
+
+def _decorator_name(node: ast.expr) -> Optional[str]:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _event_names(fn: ast.FunctionDef) -> Optional[Tuple[str, ...]]:
+    if not fn.args.args:
+        return None
+    return isinstance_names(fn, fn.args.args[0].arg)
+
+
+def isinstance_names(tree: ast.AST, param: str) -> Optional[Tuple[str, ...]]:
+    """
+    Class names from every `isinstance(param, ...)` check in tree, in order; None if there are none or a
+    check uses anything but plain names. Shared by the registry and the composer's dispatch table.
+    """
+    names: List[str] = []
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "isinstance"
+            and len(node.args) == 2
+            and isinstance(node.args[0], ast.Name)
+            and node.args[0].id == param
+        ):
+            spec = node.args[1]
+            for elt in spec.elts if isinstance(spec, ast.Tuple) else [spec]:
+                if not isinstance(elt, ast.Name):
+                    return None
+                names.append(elt.id)
+    return tuple(dict.fromkeys(names)) or None
+
+
+class ModRegistry:
+    """
+    Index of the mods under `root`, built by parsing the files instead of importing them.
+
+    `infos()` lists every mod with its metadata at the cost of reading the sources, so a worker can decide
+    what to run before paying for imports (numpy, `max.driver`, grammar or vocabulary setup). `load(name)`
+    imports one mod's file on first use; `enabled()` loads only the mods named in `enabled` or in the
+    MODS_ENABLED environment variable (by mod name or file name). Files are re-parsed when they change.
+    """
+
+    def __init__(self, root: Path = MODS_ROOT, dirs: Sequence[str] = SCAN_DIRS, enabled: Optional[Sequence[str]] = None):
+        self.root = Path(root)
+        self.dirs = tuple(dirs)
+        self._enabled = list(enabled) if enabled is not None else None
+        self._scanned: Dict[Path, Tuple[Tuple[int, int], List[ModInfo]]] = {}
+        self._modules: Dict[Path, Dict[str, Callable]] = {}
+        self._lock = threading.Lock()
+
+    def files(self) -> List[Path]:
+        files = []
+        for d in self.dirs:
+            directory = self.root / d
+            if directory.is_dir():
+                files.extend(p for p in sorted(directory.glob("*.py")) if p.name != "__init__.py")
+        return files
+
+    def infos(self) -> List[ModInfo]:
+        infos = []
+        for path in self.files():
+            st = path.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+            cached = self._scanned.get(path)
+            if cached is None or cached[0] != stamp:
+                cached = self._scanned[path] = (stamp, scan_file(path))
+            infos.extend(cached[1])
+        return infos
+
+    def info(self, name: str) -> ModInfo:
+        matches = [i for i in self.infos() if name in (i.name, i.stem, i.path.name)]
+        if not matches:
+            raise KeyError(f"no mod named {name!r} under {self.root}")
+        if len(matches) > 1:
+            raise KeyError(f"mod name {name!r} is ambiguous: {[str(i.path) for i in matches]}")
+        return matches[0]
+
+    def load(self, name: str) -> Callable:
+        """
+        Import the mod's file (once) and return the mod.
+        """
+        info = self.info(name)
+        with self._lock:
+            module = self._modules.get(info.path)
+            if module is None:
+                spec = importlib.util.spec_from_file_location(f"mods_registry.{info.stem}_{next(_load_counter)}", info.path)
+                loaded = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(loaded)
+                module = self._modules[info.path] = vars(loaded)
+        return module[info.name]
+
+    def enabled_names(self) -> List[str]:
+        if self._enabled is not None:
+            return list(self._enabled)
+        env = os.environ.get(ENV_ENABLED)
+        if env is not None:
+            return [n.strip() for n in env.split(",") if n.strip()]
+        return [i.name for i in self.infos()]
+
+    def enabled(self) -> List[Callable]:
+        """
+        The enabled mods, importing only their files.
+        """
+        return [self.load(name) for name in self.enabled_names()]
@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Every live store, so the host can release a finished request from all mods with one call
+_stores: "weakref.WeakSet[RequestStore]" = weakref.WeakSet()
+
+TTL = "ttl"
+LRU = "lru"
+MEMORY = "memory"
+RELEASED = "released"
+
+
+def default_sizeof(value: Any) -> int:
+    """
+    Size of a state object in bytes, as reported by its `nbytes()` method (0 if it has none).
+    """
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is None:
+        return 0
+    return int(nbytes() if callable(nbytes) else nbytes)
+
+
+class RequestStore(Generic[T]):
+    """
+    Per-request state container for mods, replacing module-level dicts keyed by request_id.
+
+    - `get(request_id, *args)` returns the request's state, creating it with `factory(*args)` on first use.
+    - `release(request_id)` drops it when the request completes; `complete_request(request_id)` does so for every store.
+    - Entries idle longer than `ttl` seconds are swept, the least recently used entries are evicted past
+      `max_entries`, and past `max_bytes` (measured with `sizeof`, by default the state's `nbytes()`).
+    - `on_evict(request_id, state, reason)` runs for every removal; `stats()` reports live entries and evictions.
+
+    Only released requests are known to be finished, so every eviction may hit a request that is still
+    generating. Evictions are remembered: `evicted(request_id)` stays True until the request is released.
+    On hosts without `complete_request` every request ends in a TTL eviction, so those are logged at debug
+    level; LRU and memory evictions log a warning when the entry was used within `recent` seconds.
+    Fresh state would be out of step with the sequence, so a mod should return noop for an evicted
+    request instead of calling `get`. Bounds should sit well above the number of concurrent requests.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[..., T],
+        name: Optional[str] = None,
+        ttl: Optional[float] = 600.0,
+        max_entries: Optional[int] = 4096,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[T], int] = default_sizeof,
+        on_evict: Optional[Callable[[str, T, str], None]] = None,
+        measure_every: int = 64,
+        sweep_interval: float = 5.0,
+        recent: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.factory = factory
+        self.name = name or getattr(factory, "__name__", "state")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.measure_every = max(1, measure_every)
+        self.sweep_interval = sweep_interval
+        self.recent = recent
+        self.clock = clock
+
+        # request_id -> [state, last_access, size_bytes, accesses]
+        self._entries: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._bytes = 0
+        self._last_sweep = clock()
+        self._lock = threading.RLock()
+        self._counts: Dict[str, int] = {"created": 0, TTL: 0, LRU: 0, MEMORY: 0, RELEASED: 0}
+        # request_id -> reason, for evicted requests not yet released (oldest first, bounded)
+        self._evicted: "OrderedDict[str, str]" = OrderedDict()
+        self._max_evicted = max(max_entries or 0, 4096)
+        _stores.add(self)
+
+    def get(self, request_id: str, *factory_args: Any) -> T:
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(request_id)
+            if entry is None:
+                entry = [self.factory(*factory_args), now, 0, 0]
+                self._entries[request_id] = entry
+                self._counts["created"] += 1
+            else:
+                self._entries.move_to_end(request_id)
+                entry[1] = now
+            entry[3] += 1
+            if self.max_bytes is not None and (entry[3] - 1) % self.measure_every == 0:
+                self._measure(entry)
+            if now - self._last_sweep >= self.sweep_interval:
+                self.sweep(now)
+            self._enforce_bounds(keep=request_id)
+            return entry[0]
+
+    def peek(self, request_id: str) -> Optional[T]:
+        """
+        The request's state if it exists, without creating it or refreshing its TTL.
+        """
+        entry = self._entries.get(request_id)
+        return entry[0] if entry is not None else None
+
+    def evicted(self, request_id: str) -> bool:
+        """
+        True if the request's state was evicted (not released) and the request has not completed since.
+        """
+        return request_id in self._evicted
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> Iterator[Tuple[str, T]]:
+        return ((rid, entry[0]) for rid, entry in list(self._entries.items()))
+
+    def release(self, request_id: str) -> Optional[T]:
+        """
+        Drop a finished request's state. Returns it, or None if it was not stored.
+        """
+        with self._lock:
+            self._evicted.pop(request_id, None)
+            return self._remove(request_id, RELEASED)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Evict entries idle longer than the TTL. Returns how many were removed.
+        """
+        with self._lock:
+            now = self.clock() if now is None else now
+            self._last_sweep = now
+            if self.ttl is None:
+                return 0
+            expired = [rid for rid, entry in self._entries.items() if now - entry[1] > self.ttl]
+            for rid in expired:
+                self._remove(rid, TTL)
+            return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.max_bytes is not None:
+                for entry in self._entries.values():
+                    self._measure(entry)
+            return {
+                "name": self.name,
+                "live": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                **self._counts,
+            }
+
+    def _measure(self, entry: List[Any]) -> None:
+        size = self.sizeof(entry[0])
+        self._bytes += size - entry[2]
+        entry[2] = size
+
+    def _enforce_bounds(self, keep: str) -> None:
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)), LRU)
+        if self.max_bytes is not None:
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                if oldest == keep:
+                    break
+                self._remove(oldest, MEMORY)
+
+    def _remove(self, request_id: str, reason: str) -> Optional[T]:
+        entry = self._entries.pop(request_id, None)
+        if entry is None:
+            return None
+        self._bytes -= entry[2]
+        self._counts[reason] += 1
+        if reason != RELEASED:
+            idle = self.clock() - entry[1]
+            level = logging.WARNING if reason != TTL and idle < self.recent else logging.DEBUG
+            logger.log(level, "%s: evicted state of request %s (%s, idle %.1fs)", self.name, request_id, reason, idle)
+            self._evicted[request_id] = reason
+            if len(self._evicted) > self._max_evicted:
+                self._evicted.popitem(last=False)
+        if self.on_evict is not None:
+            self.on_evict(request_id, entry[0], reason)
+        return entry[0]
+
+
+def complete_request(request_id: str) -> None:
+    """
+    Lifecycle hook for the host: call when a request finishes to free its state in every mod.
+    """
+    for store in list(_stores):
+        store.release(request_id)
+
+
+def all_stats() -> List[Dict[str, Any]]:
+    """
+    stats() for every live store.
+    """
+    return [store.stats() for store in list(_stores)]
@@ -0,0 +1,220 @@
+import difflib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from .interning import ByTokenizer, constant_ids, intern, tokenizer_hash
+
+FIRST = "first"        # only the opening user turn
+FOLLOWUP = "followup"  # only a later user turn
+ANY = "any"
+
+
+def normalize(text: str) -> str:
+    """
+    Lookup key for a chat turn: NFKC, case-folded, punctuation dropped, whitespace collapsed.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    kept = "".join(" " if unicodedata.category(ch)[0] in "PZC" else ch for ch in text)
+    return " ".join(kept.split())
+
+
+@dataclass
+class CannedResponse:
+    reply: str
+    when: str = ANY
+    token_ids: Optional[List[int]] = None   # pre-tokenized reply; skips encoding even at load time
+    tokenizer: Optional[str] = None         # tokenizer_hash of the tokenizer that produced token_ids
+
+    def ids_for(self, tokenizer: Any) -> List[int]:
+        """
+        The pre-tokenized reply if it was produced by this tokenizer, else the reply encoded with it.
+        """
+        if self.token_ids is not None and self.tokenizer is not None and self.tokenizer == tokenizer_hash(tokenizer):
+            return list(self.token_ids)
+        return list(constant_ids(tokenizer, self.reply))
+
+
+class _Table:
+    """
+    One loaded table with everything derived from it; a reload swaps in a new one, so a lookup that
+    started on the old table finishes on it.
+    """
+    __slots__ = ("responses", "tokens", "lookups")
+
+    def __init__(self, responses: Dict[str, CannedResponse]):
+        self.responses = responses
+        self.tokens: ByTokenizer[Dict[str, List[int]]] = ByTokenizer()
+        self.lookups: "OrderedDict[Tuple[str, bool], Optional[str]]" = OrderedDict()
+
+
+class ResponseCache:
+    """
+    Canned replies for trivial user turns, looked up by the normalized last user turn.
+
+    Replies are encoded once per tokenizer when the table is (re)loaded, so a hit returns token IDs with no
+    encoding. Lookups, including fuzzy ones (`fuzzy` = minimum difflib ratio, 0 disables), are memoized in
+    an LRU of `max_entries` keys. With `path` set, the table is read from a JSON file:
+
+        {"responses": [{"match": ["hi", "hello"], "reply": "Hi! How can I help you today?", "when": "first"}]}
+
+    An entry may carry pre-tokenized `token_ids` with the `tokenizer` (its `tokenizer_hash`) that produced
+    them; other tokenizers encode the reply instead. The file is re-read when its mtime changes, checked at
+    most every `reload_interval` seconds. A reload builds a new table and swaps it in whole, so lookups
+    running at the same time see either the old table or the new one. A file that does not parse (e.g. one
+    caught half-written) leaves the current table in place and is read again on the next check.
+    `stats()` reports hits, misses, fuzzy hits and reloads.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[Mapping[str, Union[str, CannedResponse]]] = None,
+        path: Optional[str] = None,
+        fuzzy: float = 0.0,
+        max_entries: int = 4096,
+        reload_interval: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.path = path
+        self.fuzzy = fuzzy
+        self.max_entries = max_entries
+        self.reload_interval = reload_interval
+        self.clock = clock
+        self._inline = {normalize(k): _as_response(v) for k, v in (responses or {}).items()}
+        for response in self._inline.values():
+            intern(response.reply)
+        self._table = _Table({})
+        self._mtime: Optional[float] = None
+        self._last_check = float("-inf")
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "fuzzy_hits": 0, "reloads": 0}
+        self._rebuild(self._read_file() if path else {})
+
+    def _read_file(self) -> Dict[str, CannedResponse]:
+        try:
+            self._mtime = os.stat(self.path).st_mtime
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            self._mtime = None
+            return {}
+        table = {}
+        for item in data.get("responses", []):
+            response = CannedResponse(item["reply"], item.get("when", ANY), item.get("token_ids"), item.get("tokenizer"))
+            for pattern in item["match"]:
+                table[normalize(pattern)] = response
+        return table
+
+    def _rebuild(self, from_file: Dict[str, CannedResponse]):
+        responses = dict(from_file)
+        responses.update(self._inline)
+        self._table = _Table(responses)
+
+    def maybe_reload(self) -> bool:
+        """
+        Re-read the file if it changed. Cheap enough to call on every lookup: it stats at most once per interval.
+        """
+        if self.path is None:
+            return False
+        now = self.clock()
+        if now - self._last_check < self.reload_interval:
+            return False
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            previous = self._mtime
+            try:
+                from_file = self._read_file()
+            except (OSError, ValueError, KeyError, TypeError):
+                # Half-written or malformed file: keep serving the current table and read it again next interval
+                self._mtime = previous
+                return False
+            self._rebuild(from_file)
+            self._counts["reloads"] += 1
+        return True
+
+    def _match(self, table: _Table, key: str, first_turn: bool) -> Optional[str]:
+        cache_key = (key, first_turn)
+        lookups = table.lookups
+        found = lookups.get(cache_key, _MISSING)
+        if found is not _MISSING:
+            try:
+                lookups.move_to_end(cache_key)
+            except KeyError:
+                pass    # evicted by another thread in between
+            return found
+        responses = table.responses
+        found = key if key in responses and _allowed(responses[key], first_turn) else None
+        if found is None and self.fuzzy > 0 and key:
+            best = 0.0
+            for candidate, response in responses.items():
+                if not _allowed(response, first_turn):
+                    continue
+                # Cheap upper bound on the ratio before running the matcher
+                if 2 * min(len(key), len(candidate)) / (len(key) + len(candidate)) < self.fuzzy:
+                    continue
+                ratio = difflib.SequenceMatcher(None, key, candidate).ratio()
+                if ratio >= self.fuzzy and ratio > best:
+                    best, found = ratio, candidate
+            if found is not None:
+                self._counts["fuzzy_hits"] += 1
+        lookups[cache_key] = found
+        if len(lookups) > self.max_entries:
+            try:
+                lookups.popitem(last=False)
+            except KeyError:
+                pass
+        return found
+
+    def lookup(self, conversation: Sequence[Mapping[str, str]], tokenizer: Any) -> Optional[List[int]]:
+        """
+        Reply token IDs for the conversation's last turn, or None when it is not a user turn or not in the table.
+        """
+        self.maybe_reload()
+        if not conversation or conversation[-1].get("role", "user") != "user":
+            self._counts["misses"] += 1
+            return None
+        first_turn = len(conversation) == 1
+        # One table for the whole lookup, even if a reload swaps it meanwhile
+        table = self._table
+        found = self._match(table, normalize(conversation[-1]["content"]), first_turn)
+        if found is None:
+            self._counts["misses"] += 1
+            return None
+        self._counts["hits"] += 1
+        return self._token_ids(table, found, tokenizer)
+
+    def token_ids(self, key: str, tokenizer: Any) -> List[int]:
+        return self._token_ids(self._table, key, tokenizer)
+
+    def _token_ids(self, table: _Table, key: str, tokenizer: Any) -> List[int]:
+        by_key = table.tokens.get(tokenizer)
+        if by_key is None:
+            # First hit for this tokenizer: encode every reply at once, off the per-request path afterwards
+            by_key = table.tokens.set(tokenizer, {k: response.ids_for(tokenizer) for k, response in table.responses.items()})
+        return by_key[key]
+
+    def stats(self) -> Dict[str, Any]:
+        table = self._table
+        return {**self._counts, "entries": len(table.responses), "memoized": len(table.lookups)}
+
+
+_MISSING = object()
+
+
+def _as_response(value: Union[str, CannedResponse]) -> CannedResponse:
+    return value if isinstance(value, CannedResponse) else CannedResponse(value)
+
+
+def _allowed(response: CannedResponse, first_turn: bool) -> bool:
+    return response.when == ANY or (response.when == FIRST) == first_turn
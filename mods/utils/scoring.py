@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass
+class ScoreSequence:
+    """
+    Action payload: score `token_ids` with teacher forcing in one prefill-style pass.
+
+    The tokens are scored as if they followed the current sequence with its last `rewind` tokens removed.
+    The sequence itself is not changed. The host answers with a SequenceScored event before the next
+    ForwardPass, and `tag` is echoed back so the mod can tell its requests apart.
+    """
+    token_ids: List[int]
+    rewind: int = 0
+    tau: float = 1.0
+    tag: Any = None
+
+
+@dataclass
+class SequenceScored:
+    """
+    Event: per-position statistics for a ScoreSequence request.
+
+    chosen_logits[i] is the raw logit of token_ids[i], lse[i] is the log-sum-exp of that position's logits,
+    and lse_tau[i] is the log-sum-exp of the logits divided by tau.
+    """
+    request_id: str
+    token_ids: List[int]
+    chosen_logits: np.ndarray
+    lse: np.ndarray
+    lse_tau: np.ndarray
+    tau: float = 1.0
+    tag: Any = None
+
+    def logprobs(self) -> np.ndarray:
+        return self.chosen_logits - self.lse
+
+    def logprobs_tau(self) -> np.ndarray:
+        return self.chosen_logits / self.tau - self.lse_tau
+
+
+def score_sequence(action: Any, token_ids: Sequence[int], rewind: int = 0, tau: float = 1.0, tag: Any = None) -> Optional[Any]:
+    """
+    Build a score_sequence action, or return None if the host's ActionBuilder does not support it.
+    Callers fall back to their token-by-token path on None.
+    """
+    build = getattr(action, "score_sequence", None)
+    if build is None:
+        return None
+    return build(ScoreSequence([int(t) for t in token_ids], rewind, tau, tag))
+
+
+def scored_from_logits(request_id: str, request: ScoreSequence, logits: np.ndarray) -> SequenceScored:
+    """
+    Host helper: reduce the [n, vocab] logits predicting each of the n scored tokens into a SequenceScored event.
+    """
+    ids = np.asarray(request.token_ids, dtype=np.int64)
+    x = np.asarray(logits)
+    m = x.max(axis=-1, keepdims=True)
+    shifted = x - m
+    lse = np.log(np.exp(shifted).sum(axis=-1, dtype=np.float64)) + m[:, 0]
+    lse_tau = np.log(np.exp(shifted / request.tau).sum(axis=-1, dtype=np.float64)) + m[:, 0] / request.tau
+    chosen = x[np.arange(len(ids)), ids].astype(np.float64)
+    return SequenceScored(
+        request_id=request_id,
+        token_ids=list(request.token_ids),
+        chosen_logits=chosen,
+        lse=lse,
+        lse_tau=lse_tau,
+        tau=request.tau,
+        tag=request.tag,
+    )
@@ -0,0 +1,213 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .interning import ByTokenizer
+from .triggers import AhoCorasick
+
+EXACT = "exact"
+PREFIX = "prefix"
+TOKENS = "tokens"
+REGEX = "regex"
+# Among triggers of equal priority, earlier kinds win
+KIND_ORDER = {EXACT: 0, PREFIX: 1, TOKENS: 2, REGEX: 3}
+
+# Template value replaced by the extracted arguments as a JSON string (OpenAI-style "arguments")
+ARGS_JSON = "{__args_json__}"
+
+_NAMED_GROUP = re.compile(r"\(\?P<([A-Za-z_][A-Za-z0-9_]*)>")
+_NAMED_BACKREF = re.compile(r"\(\?P=([A-Za-z_][A-Za-z0-9_]*)\)")
+_PLACEHOLDER = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+
+def fold(text: str) -> str:
+    """
+    Default key for exact and prefix triggers: case-folded, surrounding and repeated whitespace collapsed.
+    """
+    return " ".join(text.casefold().split())
+
+
+@dataclass
+class ToolTrigger:
+    """
+    One tool trigger. Set exactly one of `exact`, `prefix`, `token_ids` (a token-ID sequence, or text encoded
+    with the request's tokenizer) or `regex` (matched against the whole stripped turn; named groups become
+    arguments).
+
+    `exact`, `prefix` and `regex` are anchored to the whole turn or its start. `token_ids` is a substring
+    trigger: it fires when the sequence occurs anywhere in the encoded turn, e.g. a special tool token inside
+    a longer message. When a turn matches several triggers, the lowest (priority, kind) wins, with kinds
+    ordered exact, prefix, token_ids, regex, so an anchored match beats a substring one of equal priority.
+
+    `payload` is a template: `{name}` in strings is replaced by the argument `name`, `request_id` or `call_id`
+    (other braces are kept as written), and ARGS_JSON becomes the arguments as JSON. A callable gets (args) and returns the payload.
+    A prefix trigger passes the normalized text after the prefix as `rest`.
+    """
+    name: str
+    payload: Union[Dict[str, Any], Callable[[Dict[str, str]], Any]]
+    exact: Optional[str] = None
+    prefix: Optional[str] = None
+    token_ids: Optional[Union[Sequence[int], str]] = None
+    regex: Optional[str] = None
+    priority: int = 0
+    flags: int = re.IGNORECASE
+    kind: str = field(init=False)
+
+    def __post_init__(self):
+        given = [k for k, v in ((EXACT, self.exact), (PREFIX, self.prefix), (TOKENS, self.token_ids), (REGEX, self.regex)) if v is not None]
+        if len(given) != 1:
+            raise ValueError(f"tool trigger {self.name!r} needs exactly one of exact/prefix/token_ids/regex")
+        self.kind = given[0]
+
+
+@dataclass
+class ToolRoute:
+    trigger: ToolTrigger
+    args: Dict[str, str]
+
+    def payload(self, request_id: str) -> Any:
+        args = dict(self.args)
+        if callable(self.trigger.payload):
+            return self.trigger.payload(args)
+        values = {**args, "request_id": request_id, "call_id": f"call_{request_id.split('-')[0]}"}
+        return _render(self.trigger.payload, values, json.dumps(args))
+
+
+class ToolRouter:
+    """
+    Routes the last user turn to at most one tool trigger.
+
+    All triggers are compiled together: exact keys into one dict, prefixes into one character trie,
+    token-ID sequences into one Aho-Corasick automaton, and regexes into one alternation with per-trigger
+    named groups, ordered by rank so the first alternative that matches is the best regex trigger. Routing is one dict lookup, one trie walk over the turn, one automaton pass over its tokens
+    and one regex match, whichever kinds are registered. The cost depends on the length of the turn,
+    not on how many tools are registered, except for the regex alternation, which runs in C.
+    The winner is the lowest (priority, kind order, registration order).
+    """
+
+    def __init__(self, triggers: Sequence[ToolTrigger], normalize: Callable[[str], str] = fold):
+        self.triggers = list(triggers)
+        self.normalize = normalize
+        self._rank = {id(t): (t.priority, KIND_ORDER[t.kind], i) for i, t in enumerate(self.triggers)}
+
+        self._exact: Dict[str, ToolTrigger] = {}
+        self._prefix_children: List[Dict[str, int]] = [{}]
+        self._prefix_end: List[Optional[ToolTrigger]] = [None]
+        regex_parts: List[str] = []
+        self._regex_groups: Dict[str, Tuple[ToolTrigger, Dict[str, str]]] = {}
+        self._token_triggers = [t for t in self.triggers if t.kind == TOKENS]
+        self._automata: ByTokenizer[Tuple[AhoCorasick, List[ToolTrigger]]] = ByTokenizer()
+
+        for i, t in sorted(enumerate(self.triggers), key=lambda it: self._rank[id(it[1])]):
+            if t.kind == EXACT:
+                self._exact.setdefault(self.normalize(t.exact), t)
+            elif t.kind == PREFIX:
+                node = 0
+                for ch in self.normalize(t.prefix):
+                    nxt = self._prefix_children[node].get(ch)
+                    if nxt is None:
+                        nxt = len(self._prefix_children)
+                        self._prefix_children[node][ch] = nxt
+                        self._prefix_children.append({})
+                        self._prefix_end.append(None)
+                    node = nxt
+                if self._prefix_end[node] is None:
+                    self._prefix_end[node] = t
+            elif t.kind == REGEX:
+                tag = f"_t{i}"
+                renamed = {}
+                def rename(m, tag=tag, renamed=renamed):
+                    renamed[f"{tag}_{m.group(1)}"] = m.group(1)
+                    return f"(?P<{tag}_{m.group(1)}>"
+                pattern = _NAMED_GROUP.sub(rename, t.regex)
+                pattern = _NAMED_BACKREF.sub(lambda m, tag=tag: f"(?P={tag}_{m.group(1)})", pattern)
+                inline = _inline_flags(t.flags)
+                regex_parts.append(f"(?P<{tag}>{inline}{pattern}))")
+                self._regex_groups[tag] = (t, renamed)
+        self._regex = re.compile("|".join(regex_parts), re.DOTALL) if regex_parts else None
+
+    def _automaton(self, tokenizer: Any) -> Optional[Tuple[AhoCorasick, List[ToolTrigger]]]:
+        """
+        The automaton over the token-ID triggers for this tokenizer, and the trigger owning each pattern.
+        """
+        if not self._token_triggers:
+            return None
+        compiled = self._automata.get(tokenizer)
+        if compiled is None:
+            patterns, owners = [], []
+            for t in self._token_triggers:
+                if isinstance(t.token_ids, str):
+                    # Text tokenizes differently at the start of a turn and after a space; match both spellings
+                    spellings = {tuple(tokenizer.encode(v, add_special_tokens=False)) for v in (t.token_ids, " " + t.token_ids)}
+                else:
+                    spellings = {tuple(int(x) for x in t.token_ids)}
+                for ids in spellings:
+                    patterns.append(ids)
+                    owners.append(t)
+            compiled = self._automata.set(tokenizer, (AhoCorasick(patterns), owners))
+        return compiled
+
+    def route(self, text: str, tokenizer: Any = None, token_ids: Optional[Sequence[int]] = None) -> Optional[ToolRoute]:
+        """
+        The winning trigger for a user turn, with its extracted arguments, or None.
+        Token-ID triggers use `token_ids` if given, else the turn encoded with `tokenizer`, and match anywhere in it.
+        """
+        best: Optional[ToolRoute] = None
+
+        def offer(trigger: ToolTrigger, args: Dict[str, str]):
+            nonlocal best
+            if best is None or self._rank[id(trigger)] < self._rank[id(best.trigger)]:
+                best = ToolRoute(trigger, args)
+
+        key = self.normalize(text)
+        exact = self._exact.get(key)
+        if exact is not None:
+            offer(exact, {})
+
+        if len(self._prefix_children) > 1:
+            node, longest = 0, None
+            for pos, ch in enumerate(key):
+                node = self._prefix_children[node].get(ch)
+                if node is None:
+                    break
+                if self._prefix_end[node] is not None:
+                    longest = (self._prefix_end[node], pos + 1)
+            if longest is not None:
+                offer(longest[0], {"rest": key[longest[1]:].strip()})
+
+        compiled = self._automaton(tokenizer) if (tokenizer is not None or token_ids is not None) else None
+        if compiled is not None:
+            automaton, owners = compiled
+            if token_ids is None:
+                token_ids = tokenizer.encode(text, add_special_tokens=False)
+            node = 0
+            for tok in token_ids:
+                node = automaton.step(node, int(tok))
+                for pattern_index in automaton.outputs[node]:
+                    offer(owners[pattern_index], {})
+
+        if self._regex is not None:
+            m = self._regex.fullmatch(text.strip())
+            if m is not None:
+                trigger, renamed = self._regex_groups[m.lastgroup]
+                args = {name: m.group(group) for group, name in renamed.items() if m.group(group) is not None}
+                offer(trigger, args)
+        return best
+
+
+def _inline_flags(flags: int) -> str:
+    letters = "".join(ch for flag, ch in ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x")) if flags & flag)
+    return f"(?{letters}:" if letters else "(?:"
+
+
+def _render(template: Any, values: Dict[str, str], args_json: str) -> Any:
+    if isinstance(template, str):
+        if template == ARGS_JSON:
+            return args_json
+        return _PLACEHOLDER.sub(lambda m: str(values.get(m.group(1), m.group(0))), template)
+    if isinstance(template, dict):
+        return {k: _render(v, values, args_json) for k, v in template.items()}
+    if isinstance(template, list):
+        return [_render(v, values, args_json) for v in template]
+    return template
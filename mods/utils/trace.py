@@ -0,0 +1,519 @@
+import functools
+import hashlib
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b"MODTRC01"
+BLOCK_MAGIC = b"BLK1"
+_HEADER = struct.Struct("<8sI")          # magic, header JSON length
+_BLOCK = struct.Struct("<4sIII")         # magic, events, forward passes, columns
+_COLUMN = struct.Struct("<16s8sQ")       # name, numpy dtype, byte length
+
+EVENT_KINDS = ("Prefilled", "ForwardPass", "Added")
+PREFILLED, FORWARD_PASS, ADDED = range(3)
+ACTION_KINDS = (
+    "noop", "adjust_prefill", "adjust_logits", "force_tokens", "backtrack",
+    "force_output", "tool_calls", "score_sequence", "opaque", "fork_branches",
+)
+_ACTION_CODE = {kind: i for i, kind in enumerate(ACTION_KINDS)}
+
+# How ForwardPass logits are stored
+NONE = "none"     # not stored
+TOPK = "topk"     # top-k ids and float16 values; the rest share one value that keeps the log-sum-exp
+Q8 = "q8"         # every logit, uint8 with a per-row min and scale
+F16 = "f16"       # every logit as float16
+LOGIT_MODES = (NONE, TOPK, Q8, F16)
+_LOGIT_COLUMNS = {
+    TOPK: ("lg_ids", "lg_vals", "lg_fill"),
+    Q8: ("lg_q8", "lg_min", "lg_scale"),
+    F16: ("lg_f16",),
+}
+
+
+def _to_numpy(value: Any) -> np.ndarray:
+    return value if isinstance(value, np.ndarray) else value.to_numpy()
+
+
+def action_digest(kind: str, args: Sequence[Any], logits: Optional[np.ndarray] = None, masks: bool = True) -> Tuple[int, int]:
+    """
+    (size, 64-bit digest) of an action, stable across processes.
+
+    size is the number of tokens (force/prefill/output), tokens removed (backtrack) or logits changed
+    (adjust_logits). An adjust_logits digest covers which logits changed and in which direction, not the
+    values, so it still matches when the input logits were stored lossily. Working that out compares the
+    whole vocabulary row on every call; with `masks=False` an adjust_logits digest covers only the kind.
+    """
+    h = hashlib.blake2b(kind.encode(), digest_size=8)
+    size = 0
+    if kind == "adjust_logits":
+        if args and masks:
+            out = _to_numpy(args[0]).reshape(-1)
+            if logits is not None and logits.shape == out.shape:
+                changed = np.flatnonzero(out != logits)
+                direction = np.sign(out[changed].astype(np.float64) - logits[changed]).astype(np.int8)
+            else:
+                changed = np.arange(out.size)
+                direction = np.zeros(out.size, dtype=np.int8)
+            h.update(changed.astype(np.int32).tobytes())
+            h.update(direction.tobytes())
+            size = int(changed.size)
+    elif kind == "backtrack":
+        size = int(args[0]) if args else 0
+        h.update(struct.pack("<i", size))
+        if len(args) > 1 and args[1]:
+            h.update(np.asarray(list(args[1]), dtype=np.int32).tobytes())
+    elif kind in ("adjust_prefill", "force_tokens", "force_output"):
+        ids = np.asarray(list(args[0]) if args else [], dtype=np.int32)
+        size = int(ids.size)
+        h.update(ids.tobytes())
+    elif args:
+        h.update(json.dumps(args[0], sort_keys=True, default=repr).encode())
+    return size, int.from_bytes(h.digest(), "little")
+
+
+class ActionTap:
+    """
+    Passes calls through to the host's ActionBuilder and remembers the last action built.
+    """
+
+    def __init__(self, action: Any):
+        self._action = action
+        self.last: Optional[Tuple[str, tuple]] = None
+
+    def __getattr__(self, kind: str) -> Any:
+        target = getattr(self._action, kind)
+        if kind.startswith("_") or not callable(target):
+            return target
+
+        def call(*args, **kwargs):
+            self.last = (kind, args + tuple(kwargs.values()))
+            return target(*args, **kwargs)
+
+        setattr(self, kind, call)
+        return call
+
+
+class TraceWriter:
+    """
+    Appends events and the actions taken on them to a columnar binary trace.
+
+    Events are buffered and written in blocks of `block_events`: every column of a block is one contiguous
+    little-endian array (event kinds, request indices, all token IDs as one int32 array with offsets,
+    action kinds/sizes/digests, and the ForwardPass logits in the chosen `logits` mode), so a reader can
+    memory-map the file and use the columns without parsing. `sample` records only that fraction of requests.
+
+    Each logits row is reduced to its stored form when it is recorded, and full blocks are encoded and written
+    on a background thread, so a traced mod call waits on the file only when two blocks are already queued. `masks=False` skips the per-call
+    comparison of every logit behind adjust_logits digests (see `action_digest`).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        logits: str = TOPK,
+        k: int = 64,
+        tokenizer: Any = None,
+        block_events: int = 4096,
+        sample: float = 1.0,
+        masks: bool = True,
+    ):
+        if logits not in LOGIT_MODES:
+            raise ValueError(f"logits must be one of {LOGIT_MODES}")
+        self.path = path
+        self.logits = logits
+        self.k = k
+        self.block_events = block_events
+        self.sample = sample
+        self.masks = masks
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")
+        header = json.dumps({
+            "version": 1,
+            "logits": logits,
+            "k": k,
+            "masks": masks,
+            "tokenizer": getattr(tokenizer, "name_or_path", None) or (type(tokenizer).__name__ if tokenizer else None),
+        }).encode()
+        header += b" " * (-(_HEADER.size + len(header)) % 8)
+        self._file.write(_HEADER.pack(MAGIC, len(header)) + header)
+        # A few blocks may wait for the writer thread; past that, record waits instead of buffering more
+        self._blocks: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=2)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write_loop, name=f"trace-{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+        self._reset()
+
+    def _reset(self):
+        self._kinds: List[int] = []
+        self._requests: List[int] = []
+        self._flags: List[int] = []
+        self._aux: List[int] = []
+        self._tok_off: List[int] = [0]
+        self._tokens: List[int] = []
+        self._act_kinds: List[int] = []
+        self._act_sizes: List[int] = []
+        self._act_digests: List[int] = []
+        self._rows: List[Tuple[np.ndarray, ...]] = []
+        self._vocab = 0
+        self._request_index: Dict[str, int] = {}
+        self._conversations: Dict[int, Any] = {}
+
+    def wants(self, request_id: str) -> bool:
+        if self.sample >= 1.0:
+            return True
+        return zlib.crc32(request_id.encode()) / 2 ** 32 < self.sample
+
+    def record(self, event: Any, action: Optional[Tuple[str, tuple]], logits: Optional[np.ndarray] = None, conversation: Any = None):
+        """
+        Record one event and the action returned for it (kind, args), or None if unknown.
+        `logits` is the ForwardPass row as the mod received it. `conversation` is stored as JSON; values JSON
+        cannot hold are stored as their repr, and a conversation that still cannot be encoded is dropped.
+        """
+        kind = EVENT_KINDS.index(type(event).__name__)
+        if conversation is not None:
+            conversation = _json_safe(conversation)
+        if action is None:
+            act_code, size, digest = _ACTION_CODE["opaque"], 0, 0
+        else:
+            act_code = _ACTION_CODE.get(action[0], _ACTION_CODE["opaque"])
+            size, digest = action_digest(action[0], action[1], logits, masks=self.masks)
+        row = None
+        if kind == FORWARD_PASS and self.logits != NONE and logits is not None:
+            row = self._reduce(np.asarray(logits, dtype=np.float32).reshape(-1))
+        with self._lock:
+            rid = self._request_index.setdefault(event.request_id, len(self._request_index))
+            self._kinds.append(kind)
+            self._requests.append(rid)
+            flags, aux, tokens = 0, 0, ()
+            if kind == PREFILLED:
+                info = getattr(event, "context_info", None)
+                tokens = list(getattr(info, "tokens", None) or ())
+                aux = int(getattr(info, "_prompt_len", len(tokens)) or 0)
+                if conversation is not None:
+                    self._conversations[len(self._kinds) - 1] = conversation
+            elif kind == ADDED:
+                tokens = event.added_tokens
+                flags = 1 if getattr(event, "forced", False) else 0
+            else:
+                self._vocab = int(np.size(logits))
+                if row is not None:
+                    self._rows.append(row)
+            self._flags.append(flags)
+            self._aux.append(aux)
+            self._tokens.extend(int(t) for t in tokens)
+            self._tok_off.append(len(self._tokens))
+            self._act_kinds.append(act_code)
+            self._act_sizes.append(size)
+            self._act_digests.append(digest)
+            if len(self._kinds) >= self.block_events:
+                self._write_block()
+
+    def _reduce(self, row: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        One logits row in its stored form, in the order of `_LOGIT_COLUMNS[self.logits]`.
+        """
+        if self.logits == F16:
+            return (row.astype(np.float16),)
+        if self.logits == Q8:
+            finite = row[np.isfinite(row)]
+            lo = np.float32(finite.min() if finite.size else 0.0)
+            hi = np.float32(finite.max() if finite.size else 0.0)
+            scale = np.float32(max(hi - lo, 1e-12) / 255.0)
+            q = np.clip(np.rint((np.where(np.isfinite(row), row, lo) - lo) / scale), 0, 255)
+            return q.astype(np.uint8), np.array([lo], dtype=np.float32), np.array([scale], dtype=np.float32)
+        k = min(self.k, row.size)
+        ids = np.argpartition(row, -k)[-k:]
+        vals = row[ids]
+        # One value for every other logit, chosen so the row's log-sum-exp (and so every top-k probability) is kept
+        m = row.max()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            total = np.exp(row - m).sum()
+            top = np.exp(vals - m).sum()
+            fill = np.log(max(total - top, 0.0) / max(row.size - k, 1)) + m
+        if not np.isfinite(fill):
+            fill = row.min()
+        return ids.astype(np.int32), vals.astype(np.float16), np.array([fill], dtype=np.float32)
+
+    def _write_block(self):
+        """
+        Hand the buffered events to the writer thread and start a new block. Called with the lock held.
+        """
+        if not self._kinds:
+            return
+        self._raise_error()
+        self._blocks.put({
+            "kinds": self._kinds, "requests": self._requests, "flags": self._flags, "aux": self._aux,
+            "tok_off": self._tok_off, "tokens": self._tokens, "act_kinds": self._act_kinds,
+            "act_sizes": self._act_sizes, "act_digests": self._act_digests, "rows": self._rows,
+            "vocab": self._vocab, "request_index": self._request_index, "conversations": self._conversations,
+        })
+        self._reset()
+
+    def _write_loop(self):
+        while True:
+            block = self._blocks.get()
+            try:
+                if block is not None and self._error is None:
+                    self._file.write(self._encode(block))
+            except BaseException as e:  # noqa: BLE001
+                self._error = e
+            finally:
+                self._blocks.task_done()
+            if block is None:
+                return
+
+    def _encode(self, block: dict) -> bytes:
+        kinds = block["kinds"]
+        requests = sorted(block["request_index"], key=block["request_index"].get)
+        meta = json.dumps({"requests": requests, "conversations": block["conversations"]}).encode()
+        columns = [
+            ("kind", np.asarray(kinds, dtype=np.uint8)),
+            ("request", np.asarray(block["requests"], dtype=np.uint32)),
+            ("flags", np.asarray(block["flags"], dtype=np.uint8)),
+            ("aux", np.asarray(block["aux"], dtype=np.int32)),
+            ("tok_off", np.asarray(block["tok_off"], dtype=np.uint32)),
+            ("tokens", np.asarray(block["tokens"], dtype=np.int32)),
+            ("act_kind", np.asarray(block["act_kinds"], dtype=np.uint8)),
+            ("act_size", np.asarray(block["act_sizes"], dtype=np.int32)),
+            ("act_digest", np.asarray(block["act_digests"], dtype=np.uint64)),
+            ("vocab", np.asarray([block["vocab"]], dtype=np.int64)),
+            ("meta", np.frombuffer(meta, dtype=np.uint8)),
+        ]
+        rows = block["rows"]
+        if rows:
+            columns += [(name, np.concatenate([row[i] for row in rows])) for i, name in enumerate(_LOGIT_COLUMNS[self.logits])]
+        parts = [_BLOCK.pack(BLOCK_MAGIC, len(kinds), kinds.count(FORWARD_PASS), len(columns))]
+        for name, arr in columns:
+            parts.append(_COLUMN.pack(name.encode(), arr.dtype.str.encode(), arr.nbytes))
+        for _, arr in columns:
+            data = arr.astype(arr.dtype.newbyteorder("<"), copy=False).tobytes()
+            parts.append(data + b"\0" * (-len(data) % 8))
+        return b"".join(parts)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"writing trace {self.path} failed") from self._error
+
+    def flush(self):
+        """
+        Write the buffered events and wait until every block is in the file.
+        """
+        with self._lock:
+            self._write_block()
+            self._blocks.join()
+            self._raise_error()
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            try:
+                self._write_block()
+            finally:
+                self._blocks.put(None)
+                self._thread.join()
+                self._file.close()
+            self._raise_error()
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TracedMod:
+    """
+    A mod whose events and actions are recorded to a TraceWriter.
+
+    The mod runs unchanged; a batched ForwardPass handler is not exposed while tracing, so every ForwardPass
+    reaches the per-request path and is recorded. Trace one mod per writer (or a composed pipeline).
+    """
+
+    def __init__(self, fn: Callable, writer: TraceWriter):
+        functools.update_wrapper(self, fn)
+        self.__dict__.pop("batched_forward_pass", None)
+        self.fn = fn
+        self.writer = writer
+
+    def __call__(self, event: Any, action: Any, tokenizer: Any) -> Any:
+        name = type(event).__name__
+        if name not in EVENT_KINDS or not self.writer.wants(event.request_id):
+            return self.fn(event, action, tokenizer)
+        logits = _to_numpy(event.logits) if name == "ForwardPass" else None
+        if logits is not None and (self.writer.logits != NONE or self.writer.masks):
+            # A copy: the mod may write into the array its own to_numpy returns
+            logits = np.array(logits, dtype=np.float32).reshape(-1)
+        conversation = _conversation() if name == "Prefilled" else None
+        tap = ActionTap(action)
+        result = self.fn(event, tap, tokenizer)
+        recorded = tap.last
+        if recorded is None and getattr(result, "kind", None) is not None:
+            recorded = (result.kind, tuple(getattr(result, "args", ())))
+        self.writer.record(event, recorded, logits, conversation)
+        return result
+
+
+def traced(writer: TraceWriter, fn: Optional[Callable] = None) -> Any:
+    """
+    Record a mod's events and actions: `traced(writer, my_mod)`, or `@traced(writer)` under `@mod`.
+    """
+    if fn is None:
+        return lambda f: TracedMod(f, writer)
+    return TracedMod(fn, writer)
+
+
+def _json_safe(value: Any) -> Any:
+    """
+    A JSON round-trip of value (so later changes to it are not recorded), or None if it cannot be encoded.
+    """
+    try:
+        return json.loads(json.dumps(value, default=repr))
+    except (TypeError, ValueError):
+        return None
+
+
+def _conversation() -> Any:
+    try:
+        from quote_mod_sdk import get_conversation
+    except ImportError:
+        return None
+    return get_conversation()
+
+
+@dataclass
+class TraceEvent:
+    kind: int
+    request_id: str
+    tokens: np.ndarray        # prompt for Prefilled, added tokens for Added
+    forced: bool
+    prompt_len: int
+    action_kind: str
+    action_size: int
+    action_digest: int
+    conversation: Any
+    _block: "TraceBlock"
+    _row: int                 # ForwardPass row within the block, -1 otherwise
+
+    @property
+    def kind_name(self) -> str:
+        return EVENT_KINDS[self.kind]
+
+    def logits(self) -> Optional[np.ndarray]:
+        """
+        The ForwardPass logits as a fresh float32 array (reconstructed from top-k or dequantized), or None.
+        """
+        return self._block.logits_row(self._row) if self._row >= 0 else None
+
+
+class TraceBlock:
+    """
+    Zero-copy views of one block's columns.
+    """
+
+    def __init__(self, buf: Any, offset: int):
+        magic, self.n, self.n_forward, n_columns = _BLOCK.unpack_from(buf, offset)
+        if magic != BLOCK_MAGIC:
+            raise ValueError(f"bad trace block at byte {offset}")
+        pos = offset + _BLOCK.size
+        specs = []
+        for _ in range(n_columns):
+            name, dtype, nbytes = _COLUMN.unpack_from(buf, pos)
+            specs.append((name.rstrip(b"\0").decode(), np.dtype(dtype.rstrip(b"\0").decode()), nbytes))
+            pos += _COLUMN.size
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, dtype, nbytes in specs:
+            self.columns[name] = np.frombuffer(buf, dtype=dtype, count=nbytes // dtype.itemsize, offset=pos)
+            pos += nbytes + (-nbytes % 8)
+        self.end = pos
+        self.vocab = int(self.columns["vocab"][0])
+        self.meta = json.loads(self.columns["meta"].tobytes())
+        self._forward_rows: Optional[np.ndarray] = None
+
+    def logits_row(self, row: int) -> np.ndarray:
+        c, v = self.columns, self.vocab
+        if "lg_f16" in c:
+            return c["lg_f16"][row * v:(row + 1) * v].astype(np.float32)
+        if "lg_q8" in c:
+            q = c["lg_q8"][row * v:(row + 1) * v].astype(np.float32)
+            return q * c["lg_scale"][row] + c["lg_min"][row]
+        if "lg_ids" in c:
+            k = c["lg_ids"].size // max(self.n_forward, 1)
+            out = np.full(v, c["lg_fill"][row], dtype=np.float32)
+            out[c["lg_ids"][row * k:(row + 1) * k]] = c["lg_vals"][row * k:(row + 1) * k]
+            return out
+        return np.zeros(v, dtype=np.float32)
+
+    def __iter__(self) -> Iterator[TraceEvent]:
+        c = self.columns
+        kinds, requests, flags, aux, tok_off = c["kind"], c["request"], c["flags"], c["aux"], c["tok_off"]
+        tokens, act_kind, act_size, act_digest = c["tokens"], c["act_kind"], c["act_size"], c["act_digest"]
+        names = self.meta["requests"]
+        conversations = self.meta.get("conversations", {})
+        row = 0
+        for i in range(self.n):
+            kind = int(kinds[i])
+            yield TraceEvent(
+                kind, names[requests[i]], tokens[tok_off[i]:tok_off[i + 1]], bool(flags[i] & 1), int(aux[i]),
+                ACTION_KINDS[act_kind[i]], int(act_size[i]), int(act_digest[i]),
+                conversations.get(str(i)), self, row if kind == FORWARD_PASS else -1,
+            )
+            if kind == FORWARD_PASS:
+                row += 1
+
+
+class TraceReader:
+    """
+    Memory-maps a trace and iterates its events; column data is read straight from the mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = open(path, "rb")
+        size = os.fstat(self._fh.fileno()).st_size
+        self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        magic, header_len = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a mod trace")
+        self.header = json.loads(bytes(self._mmap[_HEADER.size:_HEADER.size + header_len]))
+        self.blocks: List[TraceBlock] = []
+        pos = _HEADER.size + header_len
+        while pos + _BLOCK.size <= size:
+            block = TraceBlock(self._mmap, pos)
+            self.blocks.append(block)
+            pos = block.end
+
+    def __len__(self) -> int:
+        return sum(block.n for block in self.blocks)
+
+    def __iter__(self) -> Iterator[TraceEvent]:
+        for block in self.blocks:
+            yield from block
+
+    def nbytes(self) -> int:
+        return len(self._mmap)
+
+    def close(self):
+        self.blocks = []
+        if isinstance(self._mmap, mmap.mmap):
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass   # column views still alive; the mapping goes with them
+        self._fh.close()
+
+    def __enter__(self) -> "TraceReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
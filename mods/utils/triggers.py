@@ -0,0 +1,223 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Generic, Hashable, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from .detokenizer import IncrementalDetokenizer
+from .interning import ByTokenizer, constant_ids, intern
+
+S = TypeVar("S", bound=Hashable)
+
+FORCE = "force"
+BACKTRACK = "backtrack"
+
+
+class AhoCorasick(Generic[S]):
+    """
+    Aho-Corasick automaton over any hashable symbols (characters or token IDs).
+
+    Stepping one symbol is amortized O(1) regardless of how many patterns are compiled in.
+    Node 0 is the root; `outputs[node]` lists the pattern indices ending at that node, longest first.
+    """
+
+    def __init__(self, patterns: Sequence[Sequence[S]]):
+        self.goto: List[Dict[S, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[List[int]] = [[]]
+        self.lengths: List[int] = [len(p) for p in patterns]
+        for idx, pat in enumerate(patterns):
+            if not pat:
+                raise ValueError(f"pattern {idx} is empty")
+            node = 0
+            for sym in pat:
+                nxt = self.goto[node].get(sym)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][sym] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                node = nxt
+            self.outputs[node].append(idx)
+        self._build_fail_links()
+
+    def _build_fail_links(self) -> None:
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for sym, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and sym not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(sym, 0) if node else 0
+                # Inherit matches that end here through the failure link
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+        for out in self.outputs:
+            out.sort(key=lambda i: -self.lengths[i])
+
+    def step(self, node: int, sym: S) -> int:
+        goto = self.goto
+        while True:
+            nxt = goto[node].get(sym)
+            if nxt is not None:
+                return nxt
+            if node == 0:
+                return 0
+            node = self.fail[node]
+
+
+@dataclass
+class TriggerRule:
+    """
+    A rewrite rule. Give either `phrase` (matched on decoded text) or `token_ids` (matched on raw IDs).
+
+    kind is FORCE (force `replacement` after the trigger) or BACKTRACK (remove the trigger and
+    optionally replace it with `replacement`).
+    """
+    phrase: Optional[str] = None
+    kind: str = BACKTRACK
+    replacement: Optional[str] = None
+    token_ids: Optional[Tuple[int, ...]] = None
+    name: Optional[str] = None
+
+    def __post_init__(self):
+        if (self.phrase is None) == (self.token_ids is None):
+            raise ValueError("TriggerRule needs exactly one of phrase or token_ids")
+        if self.kind not in (FORCE, BACKTRACK):
+            raise ValueError(f"unknown trigger kind {self.kind!r}")
+        if self.token_ids is not None:
+            self.token_ids = tuple(int(t) for t in self.token_ids)
+
+
+@dataclass
+class TriggerMatch:
+    rule: TriggerRule
+    start_token: int                # index of the first generated token covering the trigger
+    n_tokens: int                   # tokens from start_token to the end of the sequence
+    replacement_ids: Optional[List[int]] = None   # for a backtrack, led by any text of start_token before the phrase
+
+
+class TriggerSet:
+    """
+    A compiled set of TriggerRules. Build once at module load and share across requests;
+    each request gets its own TriggerMatcher from `matcher(tokenizer)`.
+    """
+
+    def __init__(self, rules: Iterable[TriggerRule]):
+        self.rules: List[TriggerRule] = list(rules)
+        self.text_rules = [r for r in self.rules if r.phrase is not None]
+        self.id_rules = [r for r in self.rules if r.token_ids is not None]
+        self.text_automaton: AhoCorasick[str] = AhoCorasick([r.phrase for r in self.text_rules])
+        self.id_automaton: AhoCorasick[int] = AhoCorasick([r.token_ids for r in self.id_rules])
+        self._replacements: ByTokenizer[List[Optional[List[int]]]] = ByTokenizer()
+        for r in self.rules:
+            if r.replacement:
+                intern(r.replacement)
+
+    def replacement_ids(self, tokenizer: Any) -> List[Optional[List[int]]]:
+        """
+        Replacement encodings for every rule, computed once per tokenizer.
+        """
+        cached = self._replacements.get(tokenizer)
+        if cached is None:
+            cached = [constant_ids(tokenizer, r.replacement) if r.replacement else None for r in self.rules]
+            self._replacements.set(tokenizer, cached)
+        return cached
+
+    def matcher(self, tokenizer: Any) -> "TriggerMatcher":
+        return TriggerMatcher(self, tokenizer)
+
+
+class TriggerMatcher:
+    """
+    Per-request matcher. Feeds generated tokens through a detokenizer and both automata,
+    recording the automaton states per token so a backtrack restores them in O(k).
+    """
+
+    def __init__(self, triggers: TriggerSet, tokenizer: Any):
+        self.triggers = triggers
+        self.detok = IncrementalDetokenizer(tokenizer)
+        self._rule_index = {id(r): i for i, r in enumerate(triggers.rules)}
+        self._text_node: int = 0
+        self._id_node: int = 0
+        self._states: List[Tuple[int, int]] = []    # (text_node, id_node) before token i
+        self._removed: List[int] = []               # tokens the last rollback removed
+
+    def __len__(self) -> int:
+        return len(self.detok)
+
+    def extend(self, token_ids: Iterable[int], report: bool = True) -> Optional[TriggerMatch]:
+        """
+        Feed tokens and return the first trigger they complete, if any.
+        Pass report=False for forced tokens so a replacement cannot re-trigger its own rule.
+        """
+        found: Optional[TriggerMatch] = None
+        ts = self.triggers
+        for tok in token_ids:
+            self._states.append((self._text_node, self._id_node))
+            piece = self.detok.append(tok)
+            end_len = self.detok.text_length - len(piece)
+
+            self._id_node = ts.id_automaton.step(self._id_node, int(tok))
+            if report and found is None and ts.id_automaton.outputs[self._id_node]:
+                rule = ts.id_rules[ts.id_automaton.outputs[self._id_node][0]]
+                start = len(self.detok) - len(rule.token_ids)
+                found = self._match(rule, start)
+
+            for ch in piece:
+                self._text_node = ts.text_automaton.step(self._text_node, ch)
+                end_len += 1
+                if report and found is None and ts.text_automaton.outputs[self._text_node]:
+                    rule = ts.text_rules[ts.text_automaton.outputs[self._text_node][0]]
+                    phrase_start = end_len - len(rule.phrase)
+                    found = self._match(rule, self.detok.token_at(phrase_start), phrase_start)
+        if found is not None:
+            # Later tokens in the same event also sit after the trigger
+            found.n_tokens = len(self.detok) - found.start_token
+        return found
+
+    def rollback(self, n_tokens: int) -> None:
+        keep = max(len(self.detok) - n_tokens, 0)
+        self._removed = self.detok.token_ids[keep:]
+        if keep == len(self.detok):
+            return
+        self._text_node, self._id_node = self._states[keep]
+        del self._states[keep:]
+        self.detok.truncate(keep)
+
+    def undo_rollback(self) -> None:
+        """
+        Re-feed the tokens the last rollback removed, when its backtrack never reached the host
+        (e.g. a composer dropped it). They are not reported again.
+        """
+        removed, self._removed = self._removed, []
+        self.extend(removed, report=False)
+
+    def apply(self, match: TriggerMatch, action: Any):
+        """
+        Turn a match into the rule's action. Backtracks also roll this matcher back.
+        """
+        if match.rule.kind == FORCE:
+            return action.force_tokens(match.replacement_ids or [])
+        self.rollback(match.n_tokens)
+        if match.replacement_ids:
+            return action.backtrack(match.n_tokens, match.replacement_ids)
+        return action.backtrack(match.n_tokens)
+
+    def _match(self, rule: TriggerRule, start_token: int, phrase_start: Optional[int] = None) -> TriggerMatch:
+        tokenizer = self.detok.tokenizer
+        replacement_ids = self.triggers.replacement_ids(tokenizer)[self._rule_index[id(rule)]]
+        if rule.kind == BACKTRACK and phrase_start is not None:
+            # The phrase starts inside its first token; the backtrack removes that whole token, so the
+            # text before the phrase is encoded again in front of the replacement
+            token_start = self.detok.char_offsets[start_token]
+            lead = self.detok.text_from(token_start)[: phrase_start - token_start]
+            if lead:
+                replacement_ids = tokenizer.encode(lead + (rule.replacement or ""), add_special_tokens=False)
+        return TriggerMatch(
+            rule=rule,
+            start_token=start_token,
+            n_tokens=len(self.detok) - start_token,
+            replacement_ids=replacement_ids,
+        )
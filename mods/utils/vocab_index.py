@@ -0,0 +1,124 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .interning import ByTokenizer, load_cached, store_cached_later
+
+# Decoded vocabularies per tokenizer and vocab size; decoding 100k+ tokens is a load-time cost
+_vocab_strings: ByTokenizer[Dict[int, List[str]]] = ByTokenizer()
+_indexes: ByTokenizer[Dict[int, "VocabIndex"]] = ByTokenizer()
+
+
+def decode_vocab(tokenizer: Any, vocab_size: int) -> List[str]:
+    """
+    Decode every token ID on its own. Cached per tokenizer, and on disk by tokenizer hash when the disk cache
+    is enabled (MODS_TOKEN_CACHE), so it runs once per tokenizer rather than once per worker start.
+    """
+    by_size = _vocab_strings.setdefault(tokenizer, {})
+    strs = by_size.get(vocab_size)
+    if strs is None:
+        name = f"vocab_{vocab_size}"
+        strs = load_cached(tokenizer, name)
+        if not isinstance(strs, list) or len(strs) != vocab_size:
+            strs = [tokenizer.decode([i]) for i in range(vocab_size)]
+            store_cached_later(tokenizer, name, strs)
+        by_size[vocab_size] = strs
+    return strs
+
+
+def get_vocab_index(tokenizer: Any, vocab_size: int) -> "VocabIndex":
+    """
+    The shared VocabIndex for a tokenizer, built on first use.
+    """
+    by_size = _indexes.setdefault(tokenizer, {})
+    index = by_size.get(vocab_size)
+    if index is None:
+        index = by_size[vocab_size] = VocabIndex(decode_vocab(tokenizer, vocab_size))
+    return index
+
+
+class VocabIndex:
+    """
+    Maps a substring to every token ID whose decoded text contains it.
+
+    Built once from the decoded vocabulary as a character -> token IDs inverted index. A lookup scans
+    only the posting list of the substring's rarest character and is cached, so each distinct string
+    is resolved once.
+    """
+
+    def __init__(self, token_strs: Sequence[str]):
+        self.token_strs = list(token_strs)
+        self.vocab_size = len(self.token_strs)
+        postings: Dict[str, List[int]] = {}
+        for tid, text in enumerate(self.token_strs):
+            for ch in set(text):
+                postings.setdefault(ch, []).append(tid)
+        self.postings: Dict[str, np.ndarray] = {ch: np.asarray(ids, dtype=np.int32) for ch, ids in postings.items()}
+        self._cache: Dict[str, np.ndarray] = {}
+
+    def containing(self, substring: str) -> np.ndarray:
+        """
+        Sorted int32 array of token IDs whose decoded text contains substring.
+        """
+        cached = self._cache.get(substring)
+        if cached is not None:
+            return cached
+        if not substring:
+            raise ValueError("substring must be non-empty")
+        lists = [self.postings.get(ch) for ch in set(substring)]
+        if any(ids is None for ids in lists):
+            ids = np.empty(0, dtype=np.int32)
+        else:
+            rarest = min(lists, key=len)
+            if len(substring) == 1:
+                ids = rarest
+            else:
+                strs = self.token_strs
+                ids = np.asarray([t for t in rarest.tolist() if substring in strs[t]], dtype=np.int32)
+        ids.flags.writeable = False
+        self._cache[substring] = ids
+        return ids
+
+    def ban_ids(self, substrings: Iterable[str]) -> np.ndarray:
+        """
+        Union of containing() over several strings, as one sorted int32 index array.
+        """
+        arrays = [self.containing(s) for s in substrings]
+        if not arrays:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(arrays)).astype(np.int32, copy=False)
+
+
+class BannedStrings:
+    """
+    A fixed list of banned strings resolved to one index array per tokenizer.
+
+    Applying it is a single fancy-index assignment, so the per-pass cost depends on how many tokens
+    are banned, not on how many strings were listed.
+    """
+
+    def __init__(self, strings: Iterable[str], value: float = -1e9):
+        self.strings: List[str] = list(strings)
+        self.value = value
+        self._ids: ByTokenizer[Dict[int, np.ndarray]] = ByTokenizer()
+
+    def ids(self, tokenizer: Any, vocab_size: int) -> np.ndarray:
+        by_size = self._ids.setdefault(tokenizer, {})
+        ids = by_size.get(vocab_size)
+        if ids is None:
+            ids = by_size[vocab_size] = get_vocab_index(tokenizer, vocab_size).ban_ids(self.strings)
+        return ids
+
+    def warm(self, tokenizer: Any, vocab_size: Optional[int] = None) -> np.ndarray:
+        """
+        Resolve the strings before the first forward pass, e.g. at Prefilled. vocab_size defaults to
+        len(tokenizer); logits of another width resolve again on first use.
+        """
+        return self.ids(tokenizer, vocab_size or len(tokenizer))
+
+    def apply(self, logits: np.ndarray, tokenizer: Any) -> np.ndarray:
+        """
+        Mask the banned tokens in place on the last axis and return logits.
+        """
+        logits[..., self.ids(tokenizer, logits.shape[-1])] = self.value
+        return logits
@@ -0,0 +1,16 @@
+"""
+Offline stand-ins for the generation host, so mods can be exercised without a model server.
+"""
+from .host import LocalScoringHost
+from .loop import SimHost, SimRequest, load_mod_file
+from .model import SyntheticModel
+from .tokenizer import FakeTokenizer
+
+__all__ = [
+    "FakeTokenizer",
+    "LocalScoringHost",
+    "SimHost",
+    "SimRequest",
+    "SyntheticModel",
+    "load_mod_file",
+]
@@ -0,0 +1,170 @@
+"""
+Per-mod latency benchmark on the simulated host.
+
+    python -m sim.bench                                   # every mod under mods/simple and mods/scaffolding
+    python -m sim.bench --mods mods/simple/2_logits.py --seq-lens 256 1024 --batch-sizes 1 16 --json out.json
+
+For each mod, sequence length and batch size it reports p50/p99 latency per event type, transient allocations
+per event (a separate tracemalloc pass, so tracing does not skew the timings), tokens/sec next to a run of
+the same host with no mods, and the mod's share of the step time.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from sim.loop import SimHost, load_mod_file
+from sim.model import SyntheticModel
+from sim.tokenizer import FakeTokenizer
+
+MOD_DIRS = ("mods/simple", "mods/scaffolding")
+
+# Prompts covering the triggers of the example mods
+CONVERSATIONS = [
+    [{"role": "user", "content": "Say hi."}],
+    [{"role": "user", "content": "Write a JSON object describing a cat."}],
+    [{"role": "user", "content": "hi"}],
+    [{"role": "user", "content": "Can you help me plan a trip?"}],
+]
+
+
+class Recorder:
+    """
+    Wraps every mod call made by SimHost and collects nanosecond latencies (and, with track_allocs,
+    peak transient bytes) per (mod, event type).
+    """
+
+    def __init__(self, track_allocs: bool = False):
+        self.track_allocs = track_allocs
+        self.latency: Dict[tuple, List[int]] = defaultdict(list)
+        self.alloc: Dict[tuple, List[int]] = defaultdict(list)
+
+    def call(self, fn: Callable, event: Any, builder: Any, tokenizer: Any) -> Any:
+        key = (getattr(fn, "per_request_mod", fn).__name__, type(event).__name__)
+        if self.track_allocs:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            result = fn(event, builder, tokenizer)
+            _, peak = tracemalloc.get_traced_memory()
+            self.alloc[key].append(peak - before)
+            return result
+        start = time.perf_counter_ns()
+        result = fn(event, builder, tokenizer)
+        self.latency[key].append(time.perf_counter_ns() - start)
+        return result
+
+    def total_ns(self) -> int:
+        return sum(sum(v) for v in self.latency.values())
+
+
+def discover(paths: Sequence[str] = MOD_DIRS) -> List[Path]:
+    files = []
+    for p in map(Path, paths):
+        files.extend(sorted(p.glob("*.py")) if p.is_dir() else [p])
+    return [f for f in files if f.name != "__init__.py"]
+
+
+def _run(mods, tokenizer, model, seq_len: int, batch_size: int, n_requests: int, recorder=None, use_batched: bool = True):
+    host = SimHost(
+        mods, tokenizer=tokenizer, model=model, max_new_tokens=seq_len, ignore_eos=True, use_batched=use_batched, recorder=recorder
+    )
+    convs = [CONVERSATIONS[i % len(CONVERSATIONS)] for i in range(n_requests)]
+    start = time.perf_counter()
+    done = host.run(convs, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    steps = sum(req.steps for req in done)
+    return steps, elapsed
+
+
+def bench_mod(
+    path: Path, tokenizer, model, seq_len: int, batch_size: int, baseline_tps: float, use_batched: bool = True
+) -> Dict[str, Any]:
+    mods = load_mod_file(path)
+    n_requests = batch_size
+    # Warm-up: load-time work (vocab decoding, grammar compilation) is reported separately
+    start = time.perf_counter()
+    _run(mods, tokenizer, model, 8, 1, 1)
+    warmup = time.perf_counter() - start
+
+    timing = Recorder()
+    steps, elapsed = _run(mods, tokenizer, model, seq_len, batch_size, n_requests, timing, use_batched)
+    allocs = Recorder(track_allocs=True)
+    tracemalloc.start()
+    try:
+        _run(mods, tokenizer, model, seq_len, batch_size, n_requests, allocs, use_batched)
+    finally:
+        tracemalloc.stop()
+
+    events = {}
+    for key, samples in sorted(timing.latency.items()):
+        arr = np.asarray(samples, dtype=np.float64) / 1e3
+        mem = np.asarray(allocs.alloc.get(key, [0]), dtype=np.float64)
+        events[f"{key[0]}.{key[1]}"] = {
+            "count": len(samples),
+            "p50_us": float(np.percentile(arr, 50)),
+            "p99_us": float(np.percentile(arr, 99)),
+            "alloc_mean_kib": float(mem.mean() / 1024),
+            "alloc_max_kib": float(mem.max() / 1024),
+        }
+    tps = steps / elapsed if elapsed else float("inf")
+    mod_s = timing.total_ns() / 1e9
+    return {
+        "mod": str(path),
+        "seq_len": seq_len,
+        "batch_size": batch_size,
+        "batched_handlers": use_batched,
+        "warmup_s": warmup,
+        "steps": steps,
+        "tokens_per_s": tps,
+        "baseline_tokens_per_s": baseline_tps,
+        # Mod time relative to the host's own time in the same run; steadier than comparing two runs
+        "overhead_pct": 100.0 * mod_s / max(elapsed - mod_s, 1e-9),
+        "mod_us_per_token": timing.total_ns() / 1e3 / max(steps, 1),
+        "events": events,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mods", nargs="*", default=list(MOD_DIRS), help="mod files or directories")
+    parser.add_argument("--seq-lens", nargs="*", type=int, default=[128, 512])
+    parser.add_argument("--batch-sizes", nargs="*", type=int, default=[1, 8])
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--per-request", action="store_true", help="ignore batched ForwardPass handlers")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    tokenizer = FakeTokenizer(args.vocab_size)
+    model = SyntheticModel(vocab_size=args.vocab_size)
+    files = discover(args.mods)
+    results = []
+    for seq_len in args.seq_lens:
+        for batch_size in args.batch_sizes:
+            steps, elapsed = _run([], tokenizer, model, seq_len, batch_size, batch_size)
+            baseline = steps / elapsed
+            print(f"\n== seq_len={seq_len} batch={batch_size}  baseline {baseline:,.0f} tok/s")
+            for path in files:
+                res = bench_mod(path, tokenizer, model, seq_len, batch_size, baseline, not args.per_request)
+                results.append(res)
+                print(
+                    f"{path.name:32s} {res['tokens_per_s']:>9,.0f} tok/s  overhead {res['overhead_pct']:6.1f}%  "
+                    f"{res['mod_us_per_token']:8.1f} us/tok  warmup {res['warmup_s']:.2f}s"
+                )
+                for name, ev in res["events"].items():
+                    print(
+                        f"    {name:44s} n={ev['count']:<6d} p50 {ev['p50_us']:9.1f}us  p99 {ev['p99_us']:9.1f}us  "
+                        f"alloc {ev['alloc_mean_kib']:8.1f} KiB (max {ev['alloc_max_kib']:.1f})"
+                    )
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,91 @@
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+
+from mods.utils.branching import BranchesSampled, ForkBranches
+from mods.utils.scoring import ScoreSequence, SequenceScored, scored_from_logits
+from sim.model import SyntheticModel
+
+
+class LocalScoringHost:
+    """
+    Offline implementation of the score_sequence action on top of a SyntheticModel.
+
+    `score` runs the teacher-forced request as one prefill pass. `score_stepwise` walks the same tokens
+    one decode step at a time, which is what a mod has to do without the action, and serves as the reference.
+    """
+
+    def __init__(self, model: SyntheticModel):
+        self.model = model
+
+    def score(self, request_id: str, sequence: Sequence[int], request: ScoreSequence) -> SequenceScored:
+        context = list(sequence[: len(sequence) - request.rewind])
+        full = context + list(request.token_ids)
+        # Row i of the prefill predicts full[i]; keep the rows that predict the scored tokens
+        logits = self.model.prefill_logits(full)[len(context): len(full)]
+        return scored_from_logits(request_id, request, logits)
+
+    def score_stepwise(self, request_id: str, sequence: Sequence[int], request: ScoreSequence) -> SequenceScored:
+        context: List[int] = list(sequence[: len(sequence) - request.rewind])
+        rows = []
+        for tok in request.token_ids:
+            rows.append(self.model.next_logits(context))
+            context.append(int(tok))
+        return scored_from_logits(request_id, request, np.stack(rows) if rows else np.empty((0, self.model.vocab_size)))
+
+
+class BranchSet:
+    """
+    Host side of one fork_branches action: the sibling sequences of a paused request.
+
+    The host adds `contexts()` to each decode step's batch and hands the resulting rows to `advance`, which
+    samples every branch at the request's tau and keeps only per-position statistics, not logits rows.
+    """
+
+    def __init__(self, request_id: str, fn: Any, sequence: Sequence[int], request: ForkBranches, eos_token_id: int):
+        self.request_id = request_id
+        self.fn = fn
+        self.request = request
+        self.eos_token_id = eos_token_id
+        self.context = list(sequence[: len(sequence) - request.rewind]) + list(request.prefix)
+        self.tokens: List[List[int]] = [[] for _ in range(request.n)]
+        self._stats: List[List[Tuple[float, float, float]]] = [[] for _ in range(request.n)]
+        self._open = [k for k in range(request.n) if request.max_tokens > 0]
+
+    @property
+    def finished(self) -> bool:
+        return not self._open
+
+    @property
+    def width(self) -> int:
+        """
+        Branches still decoding, i.e. rows this fork adds to the next step.
+        """
+        return len(self._open)
+
+    def contexts(self) -> List[List[int]]:
+        return [self.context + self.tokens[k] for k in self._open]
+
+    def advance(self, logits: np.ndarray, rng: np.random.Generator):
+        """
+        Sample one token for every open branch from its row of `logits` (rows in `contexts()` order).
+        """
+        x = np.asarray(logits, dtype=np.float64) / self.request.tau
+        # Gumbel-max: one draw per row from softmax(logits / tau)
+        sampled = np.argmax(x + rng.gumbel(size=x.shape), axis=-1)
+        step = scored_from_logits(self.request_id, ScoreSequence(sampled.tolist(), tau=self.request.tau), logits)
+        still_open = []
+        for j, k in enumerate(self._open):
+            tok = int(sampled[j])
+            self.tokens[k].append(tok)
+            self._stats[k].append((step.chosen_logits[j], step.lse[j], step.lse_tau[j]))
+            if tok != self.eos_token_id and len(self.tokens[k]) < self.request.max_tokens:
+                still_open.append(k)
+        self._open = still_open
+
+    def event(self) -> BranchesSampled:
+        branches = []
+        for tokens, stats in zip(self.tokens, self._stats):
+            chosen, lse, lse_tau = (np.asarray(col, dtype=np.float64) for col in zip(*stats)) if stats else (np.empty(0),) * 3
+            branches.append(SequenceScored(self.request_id, list(tokens), chosen, lse, lse_tau, self.request.tau))
+        return BranchesSampled(self.request_id, branches, self.request.tag)
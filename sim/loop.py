@@ -0,0 +1,284 @@
+import importlib.util
+import inspect
+import itertools
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from mods.utils.request_state import complete_request
+from mods.utils.batching import BatchedAction, BatchedActionBuilder, BatchedForwardPass
+from mods.utils.scoring import ScoreSequence
+from sim import sdk
+from sim.host import BranchSet, LocalScoringHost
+from sim.model import SyntheticModel
+from sim.tokenizer import FakeTokenizer
+
+# Actions one event may chain (force -> Added -> force ...) before the host gives up on a request
+MAX_CHAINED_ACTIONS = 256
+
+_load_counter = itertools.count()
+
+
+def load_mod_file(path) -> List[Callable]:
+    """
+    Import a mod file (names like `1_prefill.py` are not importable normally) and return its mods.
+
+    A mod is a module-level function defined in that file whose first parameter is `event`, or one marked
+    by the SDK's @mod. Batched handlers are reached through their per-request mod, not listed separately.
+    """
+    sdk.install()
+    path = Path(path)
+    spec = importlib.util.spec_from_file_location(f"sim_mods.{path.stem}_{next(_load_counter)}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    mods = []
+    for obj in vars(module).values():
+        if not callable(obj) or inspect.isclass(obj) or hasattr(obj, "per_request_mod"):
+            continue
+        if getattr(obj, "is_mod", False):
+            mods.append(obj)
+        elif getattr(obj, "__module__", None) == module.__name__:
+            params = list(inspect.signature(obj).parameters)
+            if params[:1] == ["event"] and len(params) == 3:
+                mods.append(obj)
+    return mods
+
+
+@dataclass
+class SimRequest:
+    request_id: str
+    prompt_ids: List[int]
+    conversation: List[Dict[str, str]]
+    generated: List[int] = field(default_factory=list)
+    finished: Optional[str] = None          # "eos", "length", "force_output", "tool_calls", "steps"
+    output: Optional[List[int]] = None
+    tool_calls: Any = None
+    steps: int = 0
+    chain: int = 0                          # events dispatched in the current step
+    pending: List[Any] = field(default_factory=list)
+    fork: Optional[BranchSet] = None        # branches decoding while the request is paused
+
+    @property
+    def sequence(self) -> List[int]:
+        return self.prompt_ids + self.generated
+
+
+class SimHost:
+    """
+    Offline generation host: runs requests through mods with a SyntheticModel and a FakeTokenizer.
+
+    Each decode step fires ForwardPass for every active request (or the mod's batched handler once per step),
+    samples a token and fires Added. Actions are applied like a serving host would:
+    - `adjust_logits` feeds the next mod and the sampler; `adjust_prefill` replaces the prompt.
+    - `force_tokens` appends tokens and fires `Added(forced=True)`; `backtrack(n, replacement)` removes the last n
+      tokens and fires `Added(forced=True)` for the replacement.
+    - `score_sequence` is answered with a SequenceScored event to the same mod; `force_output`/`tool_calls` end
+      the request.
+    - `fork_branches` pauses the request and decodes its branches as extra rows of the following steps' batches;
+      when every branch is done, the same mod gets a BranchesSampled event.
+    For events other than ForwardPass, the first mod that returns an action wins; every mod still sees the event.
+    Finished requests are released with `complete_request`, as a serving host would.
+
+    `recorder`, if given, wraps every mod call (see sim.bench.Recorder).
+    """
+
+    def __init__(
+        self,
+        mods: Sequence[Callable],
+        tokenizer: Optional[FakeTokenizer] = None,
+        model: Optional[SyntheticModel] = None,
+        max_new_tokens: int = 128,
+        max_steps: Optional[int] = None,
+        temperature: float = 1.0,
+        ignore_eos: bool = False,
+        use_batched: bool = True,
+        seed: int = 0,
+        recorder: Any = None,
+    ):
+        self.mods = list(mods)
+        self.tokenizer = tokenizer or FakeTokenizer()
+        self.model = model or SyntheticModel(vocab_size=self.tokenizer.vocab_size)
+        self.scorer = LocalScoringHost(self.model)
+        self.max_new_tokens = max_new_tokens
+        self.max_steps = max_steps or 16 * max_new_tokens
+        self.temperature = temperature
+        self.ignore_eos = ignore_eos
+        self.use_batched = use_batched
+        self.rng = np.random.default_rng(seed)
+        self.recorder = recorder
+        self.types = sdk.event_types()
+        self.builder = sdk.ActionBuilder()
+        self.batched_builder = BatchedActionBuilder()
+
+    def run(self, conversations: Sequence[List[Dict[str, str]]], batch_size: int = 1, prefix: str = "req") -> List[SimRequest]:
+        """
+        Generate a response for each conversation, batch_size requests at a time. Returns the finished requests.
+        """
+        done = []
+        for start in range(0, len(conversations), batch_size):
+            batch = [
+                self.new_request(f"{prefix}{start + i}-{id(self):x}", conv)
+                for i, conv in enumerate(conversations[start:start + batch_size])
+            ]
+            for req in batch:
+                self.prefill(req)
+            active = [req for req in batch if req.finished is None]
+            while active:
+                self.step(active)
+                active = [req for req in active if req.finished is None]
+            for req in batch:
+                complete_request(req.request_id)
+            done.extend(batch)
+        return done
+
+    def new_request(self, request_id: str, conversation: List[Dict[str, str]]) -> SimRequest:
+        text = "".join(f"{turn['role'].capitalize()}: {turn['content']}\n" for turn in conversation) + "Assistant:"
+        return SimRequest(request_id, self.tokenizer.encode(text, add_special_tokens=True), conversation)
+
+    def prefill(self, req: SimRequest):
+        event = self.types.Prefilled(request_id=req.request_id, context_info=sdk.ContextInfo(list(req.prompt_ids), len(req.prompt_ids)))
+        self._dispatch(req, event)
+
+    def step(self, active: List[SimRequest]):
+        """
+        One decode step for every active request, and for the branches of the paused ones.
+        """
+        decoding = [req for req in active if req.fork is None]
+        forking = [req for req in active if req.fork is not None]
+        contexts = [req.sequence for req in decoding]
+        for req in forking:
+            contexts.extend(req.fork.contexts())
+        all_logits = self.model.batch_next_logits(contexts)
+        if self.ignore_eos:
+            all_logits[:, self.tokenizer.eos_token_id] = -np.inf
+        logits = all_logits[: len(decoding)]
+        for fn in self.mods:
+            if not decoding:
+                break
+            batched = getattr(fn, "batched_forward_pass", None) if self.use_batched else None
+            if batched is not None:
+                event = BatchedForwardPass([req.request_id for req in decoding], logits)
+                result: BatchedAction = self._call(batched, event, self.batched_builder)
+                if result.logits is not None:
+                    logits = _as_numpy(result.logits)
+                deferred = set(result.defer)
+                rows = [i for i, req in enumerate(decoding) if req.request_id in deferred]
+            else:
+                rows = range(len(decoding))
+            for i in rows:
+                req = decoding[i]
+                if req.pending:
+                    continue
+                event = self.types.ForwardPass(request_id=req.request_id, logits=self.types.Tensor.from_numpy(logits[i]))
+                action = self._call(fn, event, self.builder)
+                if action is None or action.kind == "noop":
+                    continue
+                if action.kind == "adjust_logits":
+                    logits[i] = _as_numpy(action.args[0])
+                else:
+                    req.pending.append((fn, action))
+
+        for i, req in enumerate(decoding):
+            req.steps += 1
+            req.chain = 0
+            if req.pending:
+                fn, action = req.pending.pop(0)
+                self._apply(req, fn, action)
+            else:
+                tok = self._sample(logits[i])
+                req.generated.append(tok)
+                self._dispatch(req, self.types.Added(request_id=req.request_id, added_tokens=[tok], forced=False))
+            self._check_finished(req)
+
+        row = len(decoding)
+        for req in forking:
+            req.steps += 1
+            req.chain = 0
+            fork = req.fork
+            n = fork.width
+            fork.advance(all_logits[row: row + n], self.rng)
+            row += n
+            if fork.finished:
+                req.fork = None
+                self._dispatch(req, fork.event(), only=fork.fn)
+            self._check_finished(req)
+
+    def _check_finished(self, req: SimRequest):
+        if req.finished is not None:
+            return
+        paused = req.fork is not None
+        # A mod may have backtracked over a sampled EOS, or put one in place with a replacement
+        if not paused and req.generated and req.generated[-1] == self.tokenizer.eos_token_id:
+            req.finished = "eos"
+        elif not paused and len(req.generated) >= self.max_new_tokens:
+            req.finished = "length"
+        elif req.steps >= self.max_steps:
+            req.finished = "steps"
+
+    def _sample(self, row: np.ndarray) -> int:
+        x = row.astype(np.float64) / self.temperature
+        x -= x.max()
+        p = np.exp(x)
+        p /= p.sum()
+        return int(self.rng.choice(len(p), p=p))
+
+    def _call(self, fn: Callable, event: Any, builder: Any) -> Any:
+        if self.recorder is None:
+            return fn(event, builder, self.tokenizer)
+        return self.recorder.call(fn, event, builder, self.tokenizer)
+
+    def _dispatch(self, req: SimRequest, event: Any, only: Optional[Callable] = None):
+        """
+        Send a non-ForwardPass event to every mod (or just `only`) and apply the first action returned.
+        """
+        sdk.set_conversation(req.conversation)
+        req.chain += 1
+        if req.chain > MAX_CHAINED_ACTIONS:
+            raise RuntimeError(f"{req.request_id}: mods keep chaining actions")
+        chosen = None
+        for fn in ([only] if only is not None else self.mods):
+            action = self._call(fn, event, self.builder)
+            if chosen is None and action is not None and action.kind != "noop":
+                chosen = (fn, action)
+        if chosen is not None:
+            self._apply(req, *chosen)
+
+    def _apply(self, req: SimRequest, fn: Callable, action: Any):
+        kind, args = action.kind, action.args
+        if kind == "adjust_prefill":
+            req.prompt_ids = list(args[0])
+        elif kind == "force_tokens":
+            req.generated.extend(args[0])
+            self._dispatch(req, self.types.Added(request_id=req.request_id, added_tokens=list(args[0]), forced=True))
+        elif kind == "backtrack":
+            n, replacement = args
+            if n:
+                del req.generated[max(0, len(req.generated) - n):]
+            if replacement:
+                req.generated.extend(replacement)
+                self._dispatch(req, self.types.Added(request_id=req.request_id, added_tokens=list(replacement), forced=True))
+        elif kind == "score_sequence":
+            request: ScoreSequence = args[0]
+            self._dispatch(req, self.scorer.score(req.request_id, req.sequence, request), only=fn)
+        elif kind == "fork_branches":
+            fork = BranchSet(req.request_id, fn, req.sequence, args[0], self.tokenizer.eos_token_id)
+            if fork.finished:
+                self._dispatch(req, fork.event(), only=fn)
+            else:
+                req.fork = fork
+        elif kind == "force_output":
+            req.output = list(args[0])
+            req.finished = "force_output"
+        elif kind == "tool_calls":
+            req.tool_calls = args[0]
+            req.finished = "tool_calls"
+
+
+def _as_numpy(logits: Any) -> np.ndarray:
+    if isinstance(logits, np.ndarray):
+        return logits
+    if hasattr(logits, "to_numpy"):
+        return logits.to_numpy()
+    return np.asarray(logits)
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+class SyntheticModel:
+    """
+    Deterministic stand-in for a language model.
+
+    The logits for the next token are a fixed random projection of the embeddings of the last two tokens,
+    so they depend on the context. `prefill_logits` computes every position in one vectorized pass, and
+    `next_logits` computes the last one; both give identical numbers for the same context.
+    """
+
+    def __init__(self, vocab_size: int = 32000, dim: int = 64, seed: int = 0, scale: float = 4.0, dtype=np.float32):
+        rng = np.random.default_rng(seed)
+        self.vocab_size = vocab_size
+        self.dtype = dtype
+        self.embed = rng.standard_normal((vocab_size, dim)).astype(dtype)
+        self.proj = (rng.standard_normal((dim, vocab_size)) * (scale / np.sqrt(dim))).astype(dtype)
+        self.bos = rng.standard_normal(dim).astype(dtype)
+
+    def _hidden(self, prev: np.ndarray, prev2: np.ndarray) -> np.ndarray:
+        h1 = np.where((prev >= 0)[:, None], self.embed[np.maximum(prev, 0)], self.bos)
+        h2 = np.where((prev2 >= 0)[:, None], self.embed[np.maximum(prev2, 0)], self.bos)
+        return h1 + np.asarray(0.5, dtype=self.dtype) * h2
+
+    def prefill_logits(self, token_ids) -> np.ndarray:
+        """
+        [n + 1, vocab] logits: row i predicts the token after token_ids[:i].
+        """
+        ids = np.asarray(token_ids, dtype=np.int64)
+        prev = np.concatenate([[-1], ids])
+        prev2 = np.concatenate([[-1, -1], ids])[: len(prev)]
+        return self._hidden(prev, prev2) @ self.proj
+
+    def next_logits(self, token_ids) -> np.ndarray:
+        """
+        [vocab] logits for the token after token_ids.
+        """
+        ids = list(token_ids)
+        prev = np.asarray([ids[-1] if ids else -1], dtype=np.int64)
+        prev2 = np.asarray([ids[-2] if len(ids) > 1 else -1], dtype=np.int64)
+        return (self._hidden(prev, prev2) @ self.proj)[0]
+
+    def batch_next_logits(self, sequences) -> np.ndarray:
+        """
+        [batch, vocab] logits for the token after each sequence, in one matrix product.
+        """
+        prev = np.asarray([s[-1] if len(s) else -1 for s in sequences], dtype=np.int64)
+        prev2 = np.asarray([s[-2] if len(s) > 1 else -1 for s in sequences], dtype=np.int64)
+        return self._hidden(prev, prev2) @ self.proj
@@ -0,0 +1,179 @@
+"""
+Record mod event traces on the simulated host, and replay traces into mods.
+
+    python -m sim.replay record out.trace mods/scaffolding/valid_json.py --logits topk --requests 32
+    python -m sim.replay run out.trace mods/scaffolding/valid_json.py               # replay speed, actions vs recorded
+    python -m sim.replay diff out.trace old/valid_json.py mods/scaffolding/valid_json.py
+
+Traces captured in production with `mods.utils.traced` replay the same way. Replay is open loop: every mod
+sees the recorded events in recorded order, whatever actions it returns, so an action that differs from the
+recording (or from the other mod) is reported, not applied.
+"""
+import argparse
+import json
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from mods.utils.request_state import complete_request
+from mods.utils.trace import FORWARD_PASS, LOGIT_MODES, PREFILLED, TOPK, ActionTap, TraceEvent, TraceReader, TraceWriter, action_digest, traced
+from sim import sdk
+from sim.loop import SimHost, load_mod_file
+from sim.tokenizer import FakeTokenizer
+
+
+@dataclass
+class ActionDiff:
+    index: int
+    request_id: str
+    event: str
+    expected: str       # "kind/size"
+    actual: str
+
+
+@dataclass
+class ReplayResult:
+    events: int = 0
+    seconds: float = 0.0
+    mod_seconds: float = 0.0
+    actions: Dict[str, int] = field(default_factory=dict)
+    diffs: List[ActionDiff] = field(default_factory=list)
+
+    @property
+    def events_per_s(self) -> float:
+        return self.events / self.seconds if self.seconds else float("inf")
+
+
+def build_event(ev: TraceEvent, types: Any, logits: Any = None) -> Any:
+    if ev.kind == PREFILLED:
+        tokens = ev.tokens.tolist()
+        return types.Prefilled(request_id=ev.request_id, context_info=sdk.ContextInfo(tokens, ev.prompt_len))
+    if ev.kind == FORWARD_PASS:
+        return types.ForwardPass(request_id=ev.request_id, logits=types.Tensor.from_numpy(ev.logits() if logits is None else logits))
+    return types.Added(request_id=ev.request_id, added_tokens=ev.tokens.tolist(), forced=ev.forced)
+
+
+def _call(fn: Callable, event: Any, logits: Any, builder: Any, tokenizer: Any, masks: bool = True):
+    """
+    Run one mod on one event; returns (kind, size, digest, seconds).
+    """
+    tap = ActionTap(builder)
+    start = time.perf_counter()
+    result = fn(event, tap, tokenizer)
+    elapsed = time.perf_counter() - start
+    recorded = tap.last
+    if recorded is None and getattr(result, "kind", None) is not None:
+        recorded = (result.kind, tuple(result.args))
+    if recorded is None:
+        return "opaque", 0, 0, elapsed
+    size, digest = action_digest(recorded[0], recorded[1], logits, masks=masks)
+    return recorded[0], size, digest, elapsed
+
+
+def replay(path: str, mod: Callable, tokenizer: Any = None, against: Optional[Callable] = None, limit_diffs: int = 100) -> ReplayResult:
+    """
+    Feed every event of a trace to `mod`. Its actions are compared with `against`'s (another version of the
+    mod) if given, else with the recorded ones.
+    """
+    sdk.install()
+    types = sdk.event_types()
+    builder = sdk.ActionBuilder()
+    tokenizer = tokenizer or FakeTokenizer()
+    result = ReplayResult()
+    requests = set()
+    with TraceReader(path) as trace:
+        masks = trace.header.get("masks", True)
+        start = time.perf_counter()
+        for i, ev in enumerate(trace):
+            requests.add(ev.request_id)
+            if ev.conversation is not None:
+                sdk.set_conversation(ev.conversation)
+            logits = ev.logits() if ev.kind == FORWARD_PASS else None
+            kind, size, digest, seconds = _call(mod, build_event(ev, types, logits), logits, builder, tokenizer, masks)
+            result.mod_seconds += seconds
+            result.actions[kind] = result.actions.get(kind, 0) + 1
+            if against is not None:
+                other_kind, other_size, other_digest, _ = _call(against, build_event(ev, types, logits), logits, builder, tokenizer, masks)
+            else:
+                other_kind, other_size, other_digest = ev.action_kind, ev.action_size, ev.action_digest
+            if (kind, digest) != (other_kind, other_digest) and other_kind != "opaque" and kind != "opaque":
+                if len(result.diffs) < limit_diffs:
+                    result.diffs.append(ActionDiff(i, ev.request_id, ev.kind_name, f"{other_kind}/{other_size}", f"{kind}/{size}"))
+                result.actions["diffs"] = result.actions.get("diffs", 0) + 1
+            result.events += 1
+        result.seconds = time.perf_counter() - start
+    for request_id in requests:
+        complete_request(request_id)
+    return result
+
+
+def record(
+    path: str, mod_file: str, logits: str = TOPK, k: int = 64, n_requests: int = 16, max_new_tokens: int = 128, masks: bool = True,
+) -> int:
+    """
+    Run a mod on the simulated host with tracing on. Returns the number of events written.
+    """
+    from sim.bench import CONVERSATIONS
+
+    tokenizer = FakeTokenizer()
+    mods = load_mod_file(mod_file)
+    with TraceWriter(path, logits=logits, k=k, tokenizer=tokenizer, masks=masks) as writer:
+        host = SimHost([traced(writer, fn) for fn in mods], tokenizer=tokenizer, max_new_tokens=max_new_tokens)
+        host.run([CONVERSATIONS[i % len(CONVERSATIONS)] for i in range(n_requests)], batch_size=8)
+    with TraceReader(path) as trace:
+        return len(trace)
+
+
+def _single_mod(path: str) -> Callable:
+    mods = load_mod_file(path)
+    if len(mods) != 1:
+        raise SystemExit(f"{path}: expected one mod, found {len(mods)}")
+    return mods[0]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Any:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="trace a mod on the simulated host")
+    rec.add_argument("trace")
+    rec.add_argument("mod")
+    rec.add_argument("--logits", choices=LOGIT_MODES, default=TOPK)
+    rec.add_argument("-k", type=int, default=64, help="logits kept per row in topk mode")
+    rec.add_argument("--requests", type=int, default=16)
+    rec.add_argument("--max-new-tokens", type=int, default=128)
+    rec.add_argument("--no-masks", dest="masks", action="store_false", help="digest adjust_logits by kind only, without comparing every logit")
+    run = sub.add_parser("run", help="replay a trace into a mod and compare with the recorded actions")
+    run.add_argument("trace")
+    run.add_argument("mod")
+    diff = sub.add_parser("diff", help="replay a trace into two versions of a mod and compare their actions")
+    diff.add_argument("trace")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    for p in (run, diff):
+        p.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        n = record(args.trace, args.mod, args.logits, args.k, args.requests, args.max_new_tokens, args.masks)
+        with TraceReader(args.trace) as trace:
+            print(f"{n} events, {trace.nbytes():,} bytes -> {args.trace}")
+        return n
+    if args.command == "run":
+        result = replay(args.trace, _single_mod(args.mod))
+    else:
+        result = replay(args.trace, _single_mod(args.new), against=_single_mod(args.old))
+    if args.json:
+        print(json.dumps({**result.__dict__, "diffs": [d.__dict__ for d in result.diffs]}, indent=2))
+    else:
+        print(
+            f"{result.events} events in {result.seconds:.3f}s ({result.events_per_s:,.0f} events/s, "
+            f"{result.mod_seconds:.3f}s in the mod)  actions {result.actions}"
+        )
+        for d in result.diffs:
+            print(f"  #{d.index:<7d} {d.request_id:24s} {d.event:12s} expected {d.expected:20s} got {d.actual}")
+    return result
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
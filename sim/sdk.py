@@ -0,0 +1,214 @@
+"""
+Stand-ins for the parts of `quote_mod_sdk` and `max.driver` the example mods import.
+
+`install()` registers them in `sys.modules` only for packages that are not installed, so the real SDK
+is always preferred. The simulated host builds its events from whichever `quote_mod_sdk` is importable
+and always hands mods its own recording `ActionBuilder`.
+"""
+import contextvars
+import enum
+import importlib.util
+import sys
+import types
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Conversation of the request whose event is being dispatched, read by get_conversation()
+_conversation: "contextvars.ContextVar[List[Dict[str, str]]]" = contextvars.ContextVar("conversation", default=[])
+
+
+def mod(fn):
+    fn.is_mod = True
+    return fn
+
+
+class ModEvent:
+    request_id: str
+
+
+@dataclass
+class ContextInfo:
+    tokens: List[int]
+    _prompt_len: int
+
+
+@dataclass
+class Prefilled(ModEvent):
+    request_id: str
+    context_info: Optional[ContextInfo] = None
+
+
+@dataclass
+class ForwardPass(ModEvent):
+    request_id: str
+    logits: Any = None
+
+
+@dataclass
+class Added(ModEvent):
+    request_id: str
+    added_tokens: List[int] = field(default_factory=list)
+    forced: bool = False
+
+
+def get_conversation() -> List[Dict[str, str]]:
+    return _conversation.get()
+
+
+def set_conversation(conversation: List[Dict[str, str]]):
+    _conversation.set(conversation)
+
+
+@dataclass
+class Action:
+    kind: str
+    args: tuple = ()
+
+
+NOOP = Action("noop")
+
+
+class ActionBuilder:
+    """
+    Records the action a mod returns; the simulated host applies it.
+    """
+
+    def noop(self) -> Action:
+        return NOOP
+
+    def adjust_prefill(self, token_ids) -> Action:
+        return Action("adjust_prefill", (list(token_ids),))
+
+    def adjust_logits(self, logits) -> Action:
+        return Action("adjust_logits", (logits,))
+
+    def force_tokens(self, token_ids) -> Action:
+        return Action("force_tokens", (list(token_ids),))
+
+    def backtrack(self, n_to_remove: int, replacement_token_ids=None) -> Action:
+        return Action("backtrack", (int(n_to_remove), list(replacement_token_ids or [])))
+
+    def force_output(self, token_ids) -> Action:
+        return Action("force_output", (list(token_ids),))
+
+    def tool_calls(self, payload) -> Action:
+        return Action("tool_calls", (payload,))
+
+    def score_sequence(self, request) -> Action:
+        return Action("score_sequence", (request,))
+
+    def fork_branches(self, request) -> Action:
+        return Action("fork_branches", (request,))
+
+
+class Tensor:
+    """
+    Host-side stand-in for max.driver.Tensor. `to_numpy` copies, like a device-to-host transfer.
+    """
+
+    def __init__(self, array: np.ndarray):
+        self._array = array
+
+    @classmethod
+    def from_numpy(cls, array: np.ndarray) -> "Tensor":
+        return cls(array)
+
+    def to_numpy(self) -> np.ndarray:
+        return np.array(self._array)
+
+
+class UntilEndType(enum.Enum):
+    TAG = "tag"
+
+
+@dataclass
+class UntilStrat:
+    start: str
+    end_type: UntilEndType
+    end: str
+
+
+class SelfPrompt:
+    """
+    Inert self prompt: it never produces an answer, so a mod that starts one keeps generating normally.
+    """
+
+    def __init__(self, prompt: Any = None, strategy: Any = None):
+        self.prompt = prompt
+        self.strategy = strategy
+
+    def answer_tokens(self, request_id: str) -> Optional[List[int]]:
+        return None
+
+    def handle_prefilled(self, event) -> Action:
+        return NOOP
+
+    def handle_forward_pass(self, event) -> Action:
+        return NOOP
+
+    def handle_added(self, event) -> Action:
+        return NOOP
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def _missing(name: str) -> bool:
+    if name in sys.modules:
+        return False
+    try:
+        return importlib.util.find_spec(name) is None
+    except (ImportError, ValueError):
+        return True
+
+
+def install() -> List[str]:
+    """
+    Register the stand-ins for missing packages. Returns the names of the packages that were shimmed.
+    """
+    installed = []
+    if _missing("quote_mod_sdk"):
+        events = dict(mod=mod, ModEvent=ModEvent, Prefilled=Prefilled, ForwardPass=ForwardPass, Added=Added)
+        sdk = _module("quote_mod_sdk", get_conversation=get_conversation, **events)
+        sdk.__path__ = []
+        strategies = _module("quote_mod_sdk.strategies")
+        strategies.__path__ = []
+        modules = {
+            "quote_mod_sdk": sdk,
+            "quote_mod_sdk.mod": _module("quote_mod_sdk.mod", ActionBuilder=ActionBuilder, mod=mod),
+            "quote_mod_sdk.self_prompt": _module("quote_mod_sdk.self_prompt", SelfPrompt=SelfPrompt),
+            "quote_mod_sdk.strategies": strategies,
+            "quote_mod_sdk.strategies.strategy_constructor": _module(
+                "quote_mod_sdk.strategies.strategy_constructor", UntilStrat=UntilStrat, UntilEndType=UntilEndType
+            ),
+        }
+        sys.modules.update(modules)
+        installed.append("quote_mod_sdk")
+    if _missing("max"):
+        pkg = _module("max")
+        pkg.__path__ = []
+        pkg.driver = _module("max.driver", Tensor=Tensor)
+        sys.modules.update({"max": pkg, "max.driver": pkg.driver})
+        installed.append("max")
+    return installed
+
+
+def event_types() -> types.SimpleNamespace:
+    """
+    The event classes mods will isinstance-check against: the real SDK's when installed, else the stand-ins.
+    """
+    install()
+    import quote_mod_sdk
+    from max.driver import Tensor as tensor_type
+
+    return types.SimpleNamespace(
+        Prefilled=quote_mod_sdk.Prefilled,
+        ForwardPass=quote_mod_sdk.ForwardPass,
+        Added=quote_mod_sdk.Added,
+        Tensor=tensor_type,
+    )
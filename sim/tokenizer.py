@@ -0,0 +1,92 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Frequent pieces that get their own token, with and without a leading space
+WORDS = (
+    "the be to of and a in that have I it for not on with he as you do at this but his by from they we say her "
+    "she or an will my one all would there their what so up out if about who get which go me when make can like "
+    "time no just him know take people into year your good some could them see other than then now look only "
+    "come its over think also back after use two how our work first well way even new want because any these "
+    "give day most us is are was were has had been said hello hi bye thanks thank welcome help sorry can't "
+    "Say User Assistant question answer search call tool json true false null Wait uncertain something "
+    "delve tapestry AI As"
+).split()
+PUNCTUATION = (
+    ".", ",", "!", "?", ":", ";", "'", '"', "(", ")", "-", "--", "\n", "\n\n", "  ", "{", "}", "[", "]",
+    '{"', '":', '",', '"}', '": "', "},", "],", "```", "```json", "<", ">", "</", "_", "—", "–",
+)
+
+
+class FakeTokenizer:
+    """
+    Deterministic byte-level tokenizer with a realistic vocabulary size.
+
+    IDs 0-255 are single bytes, so any text can be encoded. They are followed by the special tokens, then
+    common words and punctuation, then seeded random letter pieces up to `vocab_size`. `encode` is a greedy
+    longest match. `decode` joins the bytes and replaces partial UTF-8 with U+FFFD like a real BPE tokenizer.
+    """
+
+    def __init__(self, vocab_size: int = 32000, seed: int = 0):
+        self.vocab_size = vocab_size
+        self.specials = ["<|eos|>", "<|bos|>"]
+        self.eos_token_id = 256
+        self.bos_token_id = 257
+        pieces: List[bytes] = [bytes([i]) for i in range(256)] + [b"", b""]
+        seen = set(pieces[:256])
+
+        def add(text: str):
+            piece = text.encode("utf-8")
+            if piece not in seen and len(pieces) < vocab_size:
+                seen.add(piece)
+                pieces.append(piece)
+
+        for digit in range(100):
+            add(str(digit))
+        for text in PUNCTUATION:
+            add(text)
+        for word in WORDS:
+            for variant in (word, " " + word, word.capitalize(), " " + word.capitalize()):
+                add(variant)
+        rng = np.random.default_rng(seed)
+        letters = np.frombuffer(b"abcdefghijklmnopqrstuvwxyz", dtype=np.uint8)
+        while len(pieces) < vocab_size:
+            n = int(rng.integers(2, 7))
+            text = bytes(rng.choice(letters, size=n)).decode()
+            add(" " + text if rng.random() < 0.5 else text)
+
+        self.pieces = pieces
+        self._ids: Dict[bytes, int] = {piece: tid for tid, piece in enumerate(pieces) if piece}
+        self._max_len = max(len(p) for p in pieces)
+
+    def __len__(self) -> int:
+        return self.vocab_size
+
+    def get_vocab(self) -> Dict[str, int]:
+        vocab = {piece.decode("utf-8", "backslashreplace"): tid for tid, piece in enumerate(self.pieces) if piece}
+        vocab.update({name: 256 + i for i, name in enumerate(self.specials)})
+        return vocab
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[int]:
+        data = text.encode("utf-8")
+        ids = [self.bos_token_id] if add_special_tokens else []
+        i = 0
+        while i < len(data):
+            for n in range(min(self._max_len, len(data) - i), 0, -1):
+                tid = self._ids.get(data[i:i + n])
+                if tid is not None:
+                    ids.append(tid)
+                    i += n
+                    break
+        return ids
+
+    def decode(self, token_ids: Sequence[int], skip_special_tokens: bool = True) -> str:
+        parts = []
+        for tid in token_ids:
+            tid = int(tid)
+            if tid in (self.eos_token_id, self.bos_token_id):
+                if not skip_special_tokens:
+                    parts.append(self.specials[tid - 256].encode())
+                continue
+            parts.append(self.pieces[tid])
+        return b"".join(parts).decode("utf-8", errors="replace")
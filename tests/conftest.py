@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sim import sdk  # noqa: E402
+
+# The example mods import quote_mod_sdk and max.driver; use the sim stand-ins where they are not installed
+sdk.install()
+
+from sim.loop import load_mod_file  # noqa: E402
+from sim.tokenizer import FakeTokenizer  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tokenizer() -> FakeTokenizer:
+    return FakeTokenizer()
+
+
+@pytest.fixture
+def load_mod():
+    """
+    Load a mod file from the repo by relative path (a fresh module, so per-request stores start empty).
+    """
+    def load(path: str):
+        mods = load_mod_file(ROOT / path)
+        assert len(mods) == 1, f"{path}: expected one mod, found {len(mods)}"
+        return mods[0]
+    return load
+
+
+@pytest.fixture
+def scripted():
+    """
+    scripted(token_ids): a mod that makes the model say those tokens, by masking every other logit, then
+    lets it sample freely. Forced tokens do not advance the script.
+    """
+    def make(script):
+        said = {}
+
+        def say(event, action, tokenizer):
+            n = said.setdefault(event.request_id, 0)
+            if isinstance(event, sdk.ForwardPass) and n < len(script):
+                logits = np.full(event.logits.to_numpy().shape, -1e9, dtype=np.float32)
+                logits[script[n]] = 0.0
+                return action.adjust_logits(sdk.Tensor.from_numpy(logits))
+            if isinstance(event, sdk.Added) and not event.forced:
+                said[event.request_id] = n + len(event.added_tokens)
+            return action.noop()
+        return say
+    return make
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from mods.utils.async_guard import FAIL, PASS, AsyncGuard
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def gate():
+    """
+    A check that blocks until the test opens the gate, then returns `result`.
+    """
+    event = threading.Event()
+    yield lambda result: (event.wait(5), result)[1]
+    event.set()
+
+
+def settle(guard, request_id="r0"):
+    for check in guard.state.peek(request_id) or []:
+        try:
+            check.future.result(timeout=5)
+        except Exception:  # noqa: BLE001
+            pass
+
+
+def test_passing_checks_never_backtrack():
+    guard = AsyncGuard(max_workers=2)
+    guard.submit("r0", 0, 4, lambda: True)
+    guard.submit("r0", 4, 9, lambda: None)
+    settle(guard)
+    assert guard.poll("r0", 12) == 0
+    assert guard.pending("r0") == 0
+    assert guard.stats()["passed"] == 2
+
+
+def test_earliest_failure_wins_and_later_checks_are_cancelled(gate):
+    guard = AsyncGuard(max_workers=2)
+    done = [guard.submit("r0", 0, 4, lambda: True), guard.submit("r0", 4, 9, lambda: False)]
+    guard.submit("r0", 9, 12, gate, True)
+    for future in done:
+        future.result(timeout=5)
+    assert guard.poll("r0", 15) == 15 - 4
+    assert guard.pending("r0") == 0
+    assert guard.stats()["failed"] == 1
+
+
+def test_check_can_name_the_token_to_roll_back_to():
+    guard = AsyncGuard(max_workers=1)
+    guard.submit("r0", 2, 8, lambda: 6)
+    settle(guard)
+    assert guard.poll("r0", 10) == 4
+
+
+@pytest.mark.parametrize("on_timeout, expected", [(PASS, 0), (FAIL, 10 - 3)])
+def test_deadline_applies_on_timeout(gate, on_timeout, expected):
+    clock = Clock()
+    guard = AsyncGuard(max_workers=1, deadline=2.0, on_timeout=on_timeout, clock=clock)
+    guard.submit("r0", 3, 6, gate, True)
+    assert guard.poll("r0", 10) == 0 and guard.pending("r0") == 1
+    clock.now = 2.5
+    assert guard.poll("r0", 10) == expected
+    assert guard.stats()["timed_out"] == 1
+
+
+def test_rollback_and_release_cancel_checks_over_removed_tokens(gate):
+    guard = AsyncGuard(max_workers=1)
+    guard.submit("r0", 0, 4, gate, True)
+    queued = guard.submit("r0", 4, 8, gate, False)
+    guard.rollback("r0", 5)
+    assert queued.cancelled() and guard.pending("r0") == 1
+    guard.submit("r1", 0, 3, gate, False)
+    guard.release("r1")
+    assert guard.pending("r1") == 0
+    assert guard.stats()["cancelled"] == 2
+
+
+def test_finish_waits_briefly_and_releases(gate):
+    guard = AsyncGuard(max_workers=1, deadline=2.0)
+    guard.submit("r0", 0, 5, gate, False)
+    started = time.monotonic()
+    assert guard.finish("r0", 8, timeout=0.05) == 0
+    assert time.monotonic() - started < 1.0
+    assert "r0" not in guard.state and not guard.state.evicted("r0")
+    failing = AsyncGuard(max_workers=1)
+    failing.submit("r0", 2, 5, lambda: False)
+    assert failing.finish("r0", 8, timeout=1.0) == 6
+    assert failing.pending("r0") == 0
+
+
+def test_slow_guard_backtracks_flagged_sentence_and_releases(tokenizer, load_mod, scripted):
+    from sim.loop import SimHost
+
+    slow_guard = load_mod("mods/scaffolding/slow_guard.py")
+    script = tokenizer.encode("Sure. As an AI language model, I refuse.") + [tokenizer.eos_token_id]
+    host = SimHost([scripted(script), slow_guard], tokenizer=tokenizer, max_new_tokens=len(script) + 16)
+    [req] = host.run([[{"role": "user", "content": "hi"}]])
+    assert "as an ai language model" not in tokenizer.decode(req.generated).lower()
+    assert slow_guard.__globals__["guard"].stats()["failed"] >= 1
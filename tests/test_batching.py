@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from mods.utils.batching import BatchedForwardPass, logsumexp_rows
+from sim import sdk
+from sim.loop import SimHost
+
+CONVERSATIONS = [[{"role": "user", "content": f"Request {i}."}] for i in range(3)]
+
+
+def test_logsumexp_rows_is_stable_and_handles_masked_rows():
+    logits = np.array([[1000.0, 1000.0, -np.inf], [-np.inf, -np.inf, -np.inf], [0.0, np.log(3.0), -1e9]], dtype=np.float32)
+    out = logsumexp_rows(logits.copy())
+    assert out[0] == pytest.approx(1000.0 + np.log(2.0))
+    assert out[1] == -np.inf
+    assert out[2] == pytest.approx(np.log(4.0))
+
+
+def test_rows_and_host_array():
+    logits = sdk.Tensor.from_numpy(np.arange(6, dtype=np.float32).reshape(2, 3))
+    event = BatchedForwardPass(["a", "b"], logits)
+    assert event.row("b") == 1
+    assert event.to_numpy()[1].tolist() == [3.0, 4.0, 5.0]
+
+
+@pytest.mark.parametrize("path", ["mods/simple/2_logits.py", "mods/scaffolding/ban_strings.py", "mods/scaffolding/json_grammar.py"])
+def test_batched_handler_matches_per_request_path(tokenizer, load_mod, path):
+    outputs = []
+    for use_batched in (True, False):
+        host = SimHost([load_mod(path)], tokenizer=tokenizer, max_new_tokens=16, use_batched=use_batched)
+        outputs.append([req.generated for req in host.run(CONVERSATIONS, batch_size=3)])
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,123 @@
+import numpy as np
+
+from mods.utils.composition import compose, handled_events, on_dropped
+from sim import sdk
+from sim.sdk import Added, ForwardPass
+
+VOCAB = 8
+
+
+def forward_pass(logits):
+    return sdk.ForwardPass("r0", sdk.Tensor.from_numpy(np.asarray(logits, dtype=np.float32)))
+
+
+def returning(make):
+    """
+    A mod that returns make(action) on every event.
+    """
+    def fn(event, action, tokenizer):
+        return make(action)
+    return fn
+
+
+def test_adjust_logits_deltas_stack():
+    base = np.zeros(VOCAB, dtype=np.float32)
+
+    def bias(event, action, tokenizer):
+        logits = event.logits.to_numpy()
+        logits[1] += 2.0
+        return action.adjust_logits(sdk.Tensor.from_numpy(logits))
+
+    def ban(event, action, tokenizer):
+        logits = event.logits.to_numpy()
+        logits[3] = -np.inf
+        return action.adjust_logits(sdk.Tensor.from_numpy(logits))
+
+    pipeline = compose(bias, ban)
+    action = pipeline(forward_pass(base), sdk.ActionBuilder(), None)
+    merged = action.args[0].to_numpy()
+    assert merged[1] == 2.0 and merged[3] == -np.inf
+    assert np.count_nonzero(merged) == 2
+    assert pipeline.stats["merged_adjust_logits"] == 1
+
+
+def test_merge_keeps_host_masks_without_nan():
+    base = np.zeros(VOCAB, dtype=np.float32)
+    base[5] = -np.inf
+
+    def bias(event, action, tokenizer):
+        return action.adjust_logits(sdk.Tensor.from_numpy(event.logits.to_numpy() + 1.0))
+
+    def ban(event, action, tokenizer):
+        logits = event.logits.to_numpy()
+        logits[2] = -np.inf
+        return action.adjust_logits(sdk.Tensor.from_numpy(logits))
+
+    merged = compose(bias, ban)(forward_pass(base), sdk.ActionBuilder(), None).args[0].to_numpy()
+    assert not np.isnan(merged).any()
+    assert merged[5] == -np.inf and merged[2] == -np.inf
+    assert merged[0] == 1.0
+
+
+def test_force_tokens_concatenate_in_mod_order():
+    pipeline = compose(returning(lambda a: a.force_tokens([1, 2])), returning(lambda a: a.force_tokens([3])))
+    action = pipeline(sdk.Added("r0", [7]), sdk.ActionBuilder(), None)
+    assert (action.kind, action.args) == ("force_tokens", ([1, 2, 3],))
+
+
+def test_host_noop_does_not_outrank_real_action():
+    # A SelfPrompt handler answers with the host's own noop, which the composer cannot rank
+    pipeline = compose(returning(lambda a: sdk.NOOP), returning(lambda a: a.force_tokens([4])))
+    action = pipeline(sdk.Added("r0", [7]), sdk.ActionBuilder(), None)
+    assert action.kind == "force_tokens"
+    assert pipeline.stats["dropped"] == 0
+
+
+def test_conflict_drops_lower_priority_and_notifies():
+    dropped = []
+
+    @on_dropped(lambda ev, kind, args: dropped.append((ev.request_id, kind, args)))
+    def forcer(event, action, tokenizer):
+        return action.force_tokens([9])
+
+    pipeline = compose(forcer, returning(lambda a: a.backtrack(2)))
+    action = pipeline(sdk.Added("r0", [7]), sdk.ActionBuilder(), None)
+    assert action.kind == "backtrack"
+    assert dropped == [("r0", "force_tokens", ([9],))]
+    assert pipeline.stats["dropped_force_tokens"] == 1
+
+
+def test_dropped_backtrack_keeps_trigger_matcher_in_sync(tokenizer, load_mod):
+    # 4_backtrack rolls its matcher back before returning; when a tool call outranks that backtrack the host
+    # keeps the phrase, so the matcher must get the tokens back
+    backtrack = load_mod("mods/simple/4_backtrack.py")
+    tokens = tokenizer.encode("Well, I can't help with that")
+    pipeline = compose(backtrack, returning(lambda a: a.tool_calls({"name": "escalate"})))
+    action = pipeline(sdk.Added("r0", tokens), sdk.ActionBuilder(), tokenizer)
+    assert action.kind == "tool_calls"
+    assert pipeline.stats["dropped_backtrack"] == 1
+    matcher = backtrack.__globals__["state"].matchers.peek("r0")
+    assert matcher.detok.token_ids == tokens
+
+
+def test_dispatch_table_reads_isinstance_checks():
+    def added_or_pass(event, action, tokenizer):
+        if isinstance(event, (sdk.Added, sdk.ForwardPass)):
+            return action.noop()
+        return action.noop()
+
+    def checks_other_param(event, action, tokenizer):
+        if isinstance(action, sdk.ActionBuilder):
+            return action.noop()
+
+    assert handled_events(added_or_pass) is None  # sdk.Added is an attribute, not a plain name
+    assert handled_events(checks_other_param) is None
+    assert handled_events(returning(lambda a: a)) is None
+    assert handled_events(forward_only) == (ForwardPass,)
+    assert compose(forward_only).mods_for(Added) == []
+
+
+def forward_only(event, action, tokenizer):
+    if isinstance(event, ForwardPass):
+        return action.noop()
+    return action.noop()
@@ -0,0 +1,64 @@
+import math
+
+import numpy as np
+import pytest
+
+from mods.utils.confidence import ConfidenceTracker, logsumexp_f32
+
+LOGPROBS = [-0.1, -2.0, -0.5, -3.0, -0.05, -1.2]
+
+
+def test_logsumexp_f32_leaves_row_untouched():
+    row = np.array([1.0, 2.0, -np.inf, 3.0], dtype=np.float32)
+    before = row.copy()
+    assert logsumexp_f32(row) == pytest.approx(np.log(np.exp([1.0, 2.0, 3.0]).sum()), abs=1e-5)
+    np.testing.assert_array_equal(row, before)
+    assert logsumexp_f32(np.full(3, -np.inf, dtype=np.float32)) == -np.inf
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({}, sum(LOGPROBS) / len(LOGPROBS)),
+    ({"window": 3}, sum(LOGPROBS[-3:]) / 3),
+])
+def test_mean_over_sequence_and_window(kwargs, expected):
+    tracker = ConfidenceTracker(capacity=2, **kwargs)
+    assert tracker.confidence() is None
+    for lp in LOGPROBS:
+        tracker.push(lp)
+    assert tracker.mean_logprob() == pytest.approx(expected)
+    assert tracker.confidence() == pytest.approx(math.exp(expected))
+
+
+def test_ema_weights_newest_token():
+    tracker = ConfidenceTracker(ema=0.5)
+    ema = None
+    for lp in LOGPROBS:
+        tracker.push(lp)
+        ema = lp if ema is None else ema + 0.5 * (lp - ema)
+    assert tracker.mean_logprob() == pytest.approx(ema)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"window": 2}, {"ema": 0.3}])
+def test_rollback_matches_never_having_pushed(kwargs):
+    tracker = ConfidenceTracker(capacity=2, **kwargs)
+    reference = ConfidenceTracker(**kwargs)
+    for lp in LOGPROBS:
+        tracker.push(lp)
+    tracker.rollback(4)
+    for lp in LOGPROBS[:2]:
+        reference.push(lp)
+    assert len(tracker) == 2
+    assert tracker.mean_logprob() == pytest.approx(reference.mean_logprob())
+    # Tokens pushed after the rollback replace the removed ones
+    tracker.push(-0.7)
+    reference.push(-0.7)
+    assert tracker.mean_logprob() == pytest.approx(reference.mean_logprob())
+    tracker.rollback(10)
+    assert len(tracker) == 0 and tracker.confidence() is None
+
+
+def test_logprobs_are_clamped():
+    tracker = ConfidenceTracker(floor=1e-4)
+    tracker.push(0.5)
+    tracker.push_prob(0.0)
+    assert tracker.mean_logprob() == pytest.approx(math.log(1e-4) / 2)
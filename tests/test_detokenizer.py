@@ -0,0 +1,59 @@
+import pytest
+
+from mods.utils.detokenizer import IncrementalDetokenizer
+
+TEXT = "Hello there, café — naïve 日本 people say hi."
+
+
+def test_pieces_join_to_full_decode(tokenizer):
+    detok = IncrementalDetokenizer(tokenizer)
+    ids = tokenizer.encode(TEXT)
+    pieces = [detok.append(t) for t in ids]
+    assert "".join(pieces) == TEXT == detok.text
+    assert detok.text_length == len(TEXT)
+
+
+def test_split_utf8_character_is_held_back(tokenizer):
+    detok = IncrementalDetokenizer(tokenizer)
+    first, second = "é".encode()
+    assert detok.append(first) == ""
+    assert detok.append(second) == "é"
+    # Both bytes belong to the same character
+    assert detok.token_at(0) == 0
+
+
+@pytest.mark.parametrize("n", [1, 3, 7, 100])
+def test_rollback_matches_fresh_decode(tokenizer, n):
+    ids = tokenizer.encode(TEXT)
+    detok = IncrementalDetokenizer(tokenizer)
+    detok.extend(ids)
+    detok.rollback(n)
+    keep = max(len(ids) - n, 0)
+    assert detok.token_ids == ids[:keep]
+    fresh = IncrementalDetokenizer(tokenizer)
+    fresh.extend(ids[:keep])
+    assert detok.text == fresh.text
+    # Continuing after the rollback gives the same text as never having rolled back
+    assert detok.extend(ids[keep:]) == TEXT[len(fresh.text):]
+    assert detok.text == TEXT
+
+
+def test_rollback_inside_split_character(tokenizer):
+    detok = IncrementalDetokenizer(tokenizer)
+    ids = tokenizer.encode("ab") + list("é".encode())
+    detok.extend(ids)
+    detok.rollback(1)
+    assert detok.text == "ab"
+    assert detok.append(ids[-1]) == "é"
+
+
+def test_tail_offsets_and_token_lookup(tokenizer):
+    detok = IncrementalDetokenizer(tokenizer)
+    detok.extend(tokenizer.encode(TEXT))
+    assert detok.endswith("say hi.") and not detok.endswith("say bye.")
+    assert detok.tail(3) == "hi."
+    start = TEXT.index("people")
+    token = detok.token_at(start)
+    assert detok.char_offsets[token] <= start
+    assert detok.text_from(detok.char_offsets[token]).endswith("people say hi.")
+    assert detok.token_at(len(TEXT)) is None
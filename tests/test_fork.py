@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+
+from mods.utils.branching import BranchesSampled, fork_branches
+from mods.utils.scoring import ScoreSequence
+from sim import sdk
+from sim.loop import SimHost
+
+CONVERSATION = [{"role": "user", "content": "Write a JSON object describing a cat."}]
+
+
+def test_fork_branches_returns_none_without_host_support():
+    assert fork_branches(object(), 2, 4) is None
+
+
+def test_branches_match_teacher_forced_scores(tokenizer):
+    seen = []
+
+    def forker(event, action, tokenizer):
+        if isinstance(event, BranchesSampled):
+            seen.append((event, list(host_req.sequence)))
+            return action.noop()
+        if isinstance(event, sdk.Added) and len(host_req.generated) == 6 and not seen:
+            return fork_branches(action, 3, 5, rewind=2, prefix=[tokenizer.encode(" the")[0]], tau=0.5, tag="t")
+        return action.noop()
+
+    host = SimHost([forker], tokenizer=tokenizer, max_new_tokens=12, ignore_eos=True)
+    host_req = host.new_request("r0", CONVERSATION)
+    host.prefill(host_req)
+    while host_req.finished is None:
+        host.step([host_req])
+
+    [(event, sequence)] = seen
+    assert event.tag == "t" and len(event.branches) == 3
+    # The request was paused, not changed, while its branches decoded
+    assert len(sequence) == len(host_req.prompt_ids) + 6
+    prefix = tokenizer.encode(" the")[:1]
+    for branch in event.branches:
+        assert 0 < len(branch.token_ids) <= 5
+        if len(branch.token_ids) < 5:
+            assert branch.token_ids[-1] == tokenizer.eos_token_id
+        reference = host.scorer.score_stepwise("r0", sequence, ScoreSequence(prefix + branch.token_ids, rewind=2, tau=0.5))
+        np.testing.assert_allclose(branch.logprobs(), reference.logprobs()[1:], rtol=1e-4, atol=1e-4)
+        np.testing.assert_allclose(branch.logprobs_tau(), reference.logprobs_tau()[1:], rtol=1e-4, atol=1e-4)
+
+
+def run_reasoning_with_sampling(tokenizer, load_mod, tries, block_size=16, nmcmc=3):
+    mod = load_mod("mods/scaffolding/reasoning_with_sampling.py")
+    module = mod.__globals__
+    store = module["RWS"]
+    store.factory = lambda: module["ReasoningWithSamplingState"](block_size=block_size, nmcmc=nmcmc, tries=tries)
+    finished = {}
+    store.on_evict = lambda request_id, state, reason: finished.setdefault(request_id, state)
+    branches = []
+
+    def count_forks(event, action, tokenizer):
+        if isinstance(event, BranchesSampled):
+            branches.append(len(event.branches))
+        return mod(event, action, tokenizer)
+
+    random.seed(0)
+    np.random.seed(0)
+    host = SimHost([count_forks], tokenizer=tokenizer, max_new_tokens=block_size + 4, ignore_eos=True)
+    [req] = host.run([CONVERSATION])
+    return req, finished[req.request_id], branches
+
+
+def test_multiple_try_iterations_apply_the_final_block(tokenizer, load_mod):
+    req, state, branches = run_reasoning_with_sampling(tokenizer, load_mod, tries=4)
+    assert state.phase.name == "DONE"
+    assert branches and all(n == 4 for n in branches)
+    assert state.iter_idx == len(branches)
+    # The last iteration's single backtrack leaves exactly the chain's block on the host
+    assert req.generated[:len(state.old_tokens)] == state.old_tokens
+    assert not state._echo
+
+
+def test_single_proposal_path_without_tries(tokenizer, load_mod):
+    req, state, branches = run_reasoning_with_sampling(tokenizer, load_mod, tries=1)
+    assert state.phase.name == "DONE" and not branches
+    assert state.iter_idx == state.nmcmc
+    assert req.generated[:state.block_size] == state.old_tokens
@@ -0,0 +1,72 @@
+import gc
+import threading
+
+from mods.utils.interning import ENV_CACHE_DIR, ByTokenizer, TokenConstants, tokenizer_hash
+from mods.utils.registry import ModRegistry
+from sim.tokenizer import FakeTokenizer
+
+
+class Unhashable:
+    __hash__ = None
+
+
+def test_by_tokenizer_drops_entries_of_collected_tokenizers():
+    values = ByTokenizer()
+    tok = FakeTokenizer(vocab_size=300)
+    values.set(tok, "old")
+    assert values.get(tok) == "old"
+    del tok
+    gc.collect()
+    # A new tokenizer, possibly at the same address, does not see the old entry
+    assert values.get(FakeTokenizer(vocab_size=300)) is None
+    assert values.items() == []
+
+
+def test_by_tokenizer_holds_unweakrefable_tokenizers_strongly():
+    values = ByTokenizer()
+    tok = Unhashable()
+    assert values.setdefault(tok, []) is values.setdefault(tok, [1])
+    assert values.items() == [(tok, [])]
+
+
+def test_constants_encode_once_per_tokenizer(tokenizer):
+    constants = TokenConstants(" - Wait...", name="test")
+    ids = constants.ids(tokenizer, " - Wait...")
+    assert ids == tokenizer.encode(" - Wait...")
+    assert constants.ids(tokenizer, " - Wait...") is ids
+    other = FakeTokenizer(vocab_size=300)
+    assert constants.ids(other, " - Wait...") == other.encode(" - Wait...")
+
+
+def test_disk_cache_is_opt_in(tmp_path, monkeypatch, tokenizer):
+    monkeypatch.delenv(ENV_CACHE_DIR, raising=False)
+    TokenConstants("hello", name="optin").save()
+    assert not any(tmp_path.iterdir())
+    monkeypatch.setenv(ENV_CACHE_DIR, str(tmp_path))
+    constants = TokenConstants("hello", name="optin")
+    constants.warm(tokenizer)
+    # warm() writes new entries from a background thread
+    for thread in threading.enumerate():
+        if thread.name == "save-optin":
+            thread.join()
+    assert (tmp_path / tokenizer_hash(tokenizer) / "optin.json").exists()
+    # A second table for the same vocabulary loads instead of encoding
+    warm = TokenConstants(name="optin").warm(tokenizer)
+    assert warm.ids["hello"] == tokenizer.encode("hello") and not warm.dirty
+
+
+def test_registry_scans_without_importing(tmp_path):
+    (tmp_path / "simple").mkdir()
+    (tmp_path / "simple" / "greet.py").write_text(
+        "from quote_mod_sdk import mod, Added\n"
+        "@mod\n"
+        "def greet(event, action, tokenizer):\n"
+        '    """Say hello."""\n'
+        "    if isinstance(event, Added):\n"
+        "        return action.noop()\n"
+        "    return action.noop()\n"
+        "raise RuntimeError('imported')\n"
+    )
+    registry = ModRegistry(root=tmp_path, dirs=("simple",), enabled=["greet"])
+    [info] = registry.infos()
+    assert (info.name, info.doc, info.events, info.imports) == ("greet", "Say hello.", ("Added",), ("quote_mod_sdk",))
@@ -0,0 +1,52 @@
+import numpy as np
+
+from mods.utils.composition import compose
+from mods.utils.json_grammar import JSONGrammar
+from mods.utils.json_stream import INITIAL, StreamingJSONValidator
+from sim import sdk
+from sim.loop import SimHost
+
+
+def test_mask_allows_only_tokens_that_continue_the_document(tokenizer):
+    grammar = JSONGrammar.from_tokenizer(tokenizer, len(tokenizer), root_types=("object",))
+    state = INITIAL
+    for tok in tokenizer.encode('{"a": [1'):
+        state = grammar.advance(state, tok)
+    allowed = np.flatnonzero(grammar.mask(state))
+    assert tokenizer.encode("]")[0] in allowed and tokenizer.encode(",")[0] in allowed
+    assert tokenizer.encode("}")[0] not in allowed
+    assert tokenizer.eos_token_id not in allowed
+    assert grammar.advance(state, tokenizer.encode("}")[0]) is None
+
+
+def test_grammar_is_built_at_prefilled(tokenizer, load_mod):
+    json_grammar = load_mod("mods/scaffolding/json_grammar.py")
+    json_grammar(sdk.Prefilled("r0", sdk.ContextInfo([1, 2], 2)), sdk.ActionBuilder(), tokenizer)
+    assert json_grammar.__globals__["grammars"].get(tokenizer) is not None
+
+
+def test_backtrack_by_another_mod_restores_parser(tokenizer, load_mod):
+    json_grammar = load_mod("mods/scaffolding/json_grammar.py")
+    state = json_grammar.__globals__["state"]
+    head = tokenizer.encode('{"a": ')
+    tail = tokenizer.encode('1, "b"')
+
+    def undo_tail(event, action, tokenizer):
+        return action.backtrack(len(tail)) if event.added_tokens == tail else action.noop()
+
+    pipeline = compose(json_grammar, undo_tail)
+    builder = sdk.ActionBuilder()
+    pipeline(sdk.Added("r0", head), builder, tokenizer)
+    before = state.peek("r0").parser
+    assert pipeline(sdk.Added("r0", tail), builder, tokenizer).kind == "backtrack"
+    assert state.peek("r0").parser == before
+    pipeline(sdk.Added("r0", tokenizer.encode("[2]}")), builder, tokenizer)
+    assert state.peek("r0").parser is not None
+
+
+def test_generates_valid_json_on_sim_host(tokenizer, load_mod):
+    host = SimHost([load_mod("mods/scaffolding/json_grammar.py")], tokenizer=tokenizer, max_new_tokens=48)
+    for req in host.run([[{"role": "user", "content": "Write JSON."}]] * 2, batch_size=2):
+        text = tokenizer.decode(req.generated)
+        assert text.lstrip()[:1] in ("{", "[")
+        assert StreamingJSONValidator().feed(text) is None
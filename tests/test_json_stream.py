@@ -0,0 +1,65 @@
+import pytest
+
+from mods.utils.json_stream import JSONBlockValidator, StreamingJSONValidator
+from sim import sdk
+
+
+@pytest.mark.parametrize("text", ['{"a": [1, -2.5e3, true, null]}', "[]", '"x\\u00e9"', "0", '{"k": {"n": "v"}}'])
+def test_streaming_validator_accepts(text):
+    validator = StreamingJSONValidator()
+    assert validator.feed(text) is None
+    assert validator.complete
+
+
+@pytest.mark.parametrize("text, index", [('{"a" 1}', 5), ("[1,,2]", 3), ("01", 1), ('{"a": tru}', 9), ("[1] x", 4)])
+def test_streaming_validator_reports_first_bad_character(text, index):
+    assert StreamingJSONValidator().feed(text) == index
+
+
+def test_streaming_validator_in_pieces_matches_whole():
+    text = '{"name": "cat", "legs": 4, "tags": ["a", "b"]}'
+    validator = StreamingJSONValidator()
+    for i in range(0, len(text), 3):
+        assert validator.feed(text[i:i + 3]) is None
+    assert validator.complete
+
+
+def test_block_validator_valid_block(tokenizer):
+    validator = JSONBlockValidator(tokenizer)
+    assert validator.extend(tokenizer.encode('Here:\n```json\n{"a": [1, 2]}\n```\nDone.')) is None
+    assert not validator.in_block
+
+
+def test_block_validator_multi_token_event_records_every_token(tokenizer):
+    validator = JSONBlockValidator(tokenizer)
+    header = tokenizer.encode("```json\n")
+    good = tokenizer.encode('{"a": 1')
+    bad = tokenizer.encode('] "b": 2}\n```\nmore text after the block')
+    validator.extend(header)
+    err = validator.extend(good + bad)
+    assert err == len(header) + len(good)
+    # Tokens after the error are still recorded, so len() - err is the backtrack that removes the bad tail
+    assert len(validator) == len(header) + len(good) + len(bad)
+    assert validator.rollback(len(validator) - err) == bad
+    assert validator.extend(tokenizer.encode("}\n```")) is None
+
+
+def test_block_validator_rollback_restores_parser(tokenizer):
+    validator = JSONBlockValidator(tokenizer)
+    tokens = tokenizer.encode('```json\n{"a": [1, 2')
+    validator.extend(tokens)
+    validator.extend(tokenizer.encode("]]"))
+    validator.rollback(len(tokenizer.encode("]]")))
+    assert validator.extend(tokenizer.encode("]}\n```")) is None
+
+
+def test_valid_json_mod_backtracks_to_error_in_multi_token_event(tokenizer, load_mod):
+    valid_json = load_mod("mods/scaffolding/valid_json.py")
+    builder = sdk.ActionBuilder()
+    prefix = tokenizer.encode('Sure.\n```json\n{"name": "cat"')
+    bad = tokenizer.encode('"legs": 4}\n```')
+    action = valid_json(sdk.Added("r0", prefix + bad, forced=True), builder, tokenizer)
+    assert action.kind == "backtrack"
+    # A key straight after a value is the error; the whole tail from it is removed
+    assert action.args[0] == len(bad)
+    assert valid_json(sdk.Added("r0", tokenizer.encode(', "legs": 4}\n```')), builder, tokenizer).kind == "noop"
@@ -0,0 +1,95 @@
+import string
+from typing import List, Sequence
+
+import pytest
+
+from mods.utils.prefill import PrefillRewriter, encode_continuation
+from sim import sdk
+
+PROMPT = "System: be brief.\nUser: Please say hi. Say hi. Then stop.\nAssistant:"
+WORDS = ["Say", "say", "hi", "hi.", "Then", "stop", "bye", "Please", "User", "be", "brief", "System", "Assistant"]
+
+
+class SentencePieceStyle:
+    """
+    Minimal SentencePiece-like tokenizer: spaces become "▁", encode adds a dummy-prefix space, decode drops
+    the leading space of the text, and words are greedily matched with single-character fallback.
+    """
+
+    specials = ["<unk>", "<s>", "</s>"]
+
+    def __init__(self):
+        pieces = list(self.specials) + ["▁"] + list(string.ascii_letters + string.digits + string.punctuation + "\n")
+        pieces += [p for w in WORDS for p in ("▁" + w, w)]
+        self.pieces = list(dict.fromkeys(pieces))
+        self._ids = {p: i for i, p in enumerate(self.pieces) if p not in self.specials}
+        self._max_len = max(map(len, self.pieces))
+        self.eos_token_id = 2
+
+    def __len__(self) -> int:
+        return len(self.pieces)
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[int]:
+        s = "▁" + text.replace(" ", "▁")
+        ids, i = [], 0
+        while i < len(s):
+            for n in range(min(self._max_len, len(s) - i), 0, -1):
+                tid = self._ids.get(s[i:i + n])
+                if tid is not None:
+                    ids.append(tid)
+                    i += n
+                    break
+            else:
+                ids.append(0)
+                i += 1
+        return ids
+
+    def decode(self, token_ids: Sequence[int], skip_special_tokens: bool = True) -> str:
+        text = "".join(self.pieces[t] for t in token_ids if t >= len(self.specials)).replace("▁", " ")
+        return text[1:] if text.startswith(" ") else text
+
+
+@pytest.fixture(params=["byte-level", "sentencepiece"])
+def any_tokenizer(request, tokenizer):
+    return tokenizer if request.param == "byte-level" else SentencePieceStyle()
+
+
+@pytest.mark.parametrize("replacements", [
+    {"Say hi.": "Say bye."},
+    {"hi.": "bye."},                   # inside a word-start token
+    {"ay hi": "ay yo"},                # starts in the middle of a word
+    {"brief.\nUser": "brief.\n\nUser"},
+    {"System": "Rules"},               # at the start of the prompt
+])
+def test_rewrite_changes_only_the_phrase(any_tokenizer, replacements):
+    ids = any_tokenizer.encode(PROMPT)
+    out = PrefillRewriter(replacements).rewrite(ids, any_tokenizer)
+    expected = PROMPT
+    for phrase, replacement in replacements.items():
+        expected = expected.replace(phrase, replacement)
+    assert any_tokenizer.decode(out) == expected
+
+
+def test_tokens_before_the_first_edit_are_kept(any_tokenizer):
+    ids = any_tokenizer.encode(PROMPT)
+    out = PrefillRewriter({"Then": "Now"}).rewrite(ids, any_tokenizer)
+    before = any_tokenizer.encode(PROMPT[:PROMPT.index(" Then")])
+    assert out[:len(before) - 1] == ids[:len(before) - 1]
+
+
+def test_no_match_leaves_prefill_alone(any_tokenizer):
+    assert PrefillRewriter({"goodbye": "hello"}).rewrite(any_tokenizer.encode(PROMPT), any_tokenizer) is None
+
+
+def test_encode_continuation_has_no_dummy_prefix():
+    sp = SentencePieceStyle()
+    assert sp.decode(sp.encode("x") + encode_continuation(sp, "hi there")) == "xhi there"
+    assert sp.decode(sp.encode("x") + encode_continuation(sp, " hi")) == "x hi"
+
+
+def test_prefill_mod_adjusts_prompt(tokenizer, load_mod):
+    adjust_prefill = load_mod("mods/simple/1_prefill.py")
+    ids = tokenizer.encode("Say hi.")
+    action = adjust_prefill(sdk.Prefilled("r0", sdk.ContextInfo(ids, len(ids))), sdk.ActionBuilder(), tokenizer)
+    assert action.kind == "adjust_prefill"
+    assert tokenizer.decode(action.args[0]) == "Say bye."
@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+
+from mods.utils.composition import compose
+from mods.utils.profiling import Profiler, profiled
+from sim import sdk
+from sim.loop import SimHost
+
+VOCAB = 16
+
+
+def forward_pass():
+    return sdk.ForwardPass("r0", sdk.Tensor.from_numpy(np.zeros(VOCAB, dtype=np.float32)))
+
+
+def test_counts_calls_actions_backtracks_and_copies():
+    profiler = Profiler(enabled=True)
+
+    @profiled(profiler=profiler)
+    def mod(event, action, tokenizer):
+        if isinstance(event, sdk.ForwardPass):
+            return action.adjust_logits(sdk.Tensor.from_numpy(event.logits.to_numpy()))
+        return action.backtrack(3)
+
+    for _ in range(2):
+        mod(forward_pass(), sdk.ActionBuilder(), None)
+    mod(sdk.Added("r0", [1]), sdk.ActionBuilder(), None)
+    snapshot = profiler.snapshot()["mod"]
+    assert snapshot["ForwardPass"]["calls"] == 2
+    assert snapshot["ForwardPass"]["actions"] == {"adjust_logits": 2}
+    assert snapshot["ForwardPass"]["to_numpy_bytes"] == 2 * VOCAB * 4
+    assert snapshot["Added"]["backtrack_tokens"] == 3
+    assert json.loads(profiler.to_json())["mods"] == profiler.snapshot()
+    assert 'mod_backtrack_tokens_total{mod="mod",event="Added"} 3' in profiler.to_prometheus()
+
+
+def test_mod_sees_the_real_event_and_tensor():
+    profiler = Profiler(enabled=True)
+    event = forward_pass()
+    tensor = event.logits
+    seen = []
+
+    @profiled(profiler=profiler)
+    def mod(ev, action, tokenizer):
+        seen.append((ev, ev.logits, isinstance(ev.logits, sdk.Tensor)))
+        return action.adjust_logits(ev.logits)
+
+    mod(event, sdk.ActionBuilder(), None)
+    assert seen == [(event, tensor, True)]
+    # The shadowing to_numpy is gone after the call
+    assert "to_numpy" not in vars(tensor)
+
+
+def test_unchanged_logits_merge_in_a_composition():
+    profiler = Profiler(enabled=True)
+
+    def passthrough(event, action, tokenizer):
+        return action.adjust_logits(event.logits)
+
+    def ban(event, action, tokenizer):
+        logits = event.logits.to_numpy()
+        logits[2] = -np.inf
+        return action.adjust_logits(sdk.Tensor.from_numpy(logits))
+
+    pipeline = compose(profiled(passthrough, profiler=profiler), profiled(ban, profiler=profiler))
+    merged = pipeline(forward_pass(), sdk.ActionBuilder(), None).args[0]
+    assert isinstance(merged, sdk.Tensor)
+    assert merged.to_numpy()[2] == -np.inf
+
+
+def test_disabled_profiler_records_nothing(tokenizer, load_mod):
+    profiler = Profiler(enabled=False)
+    mod = profiled(load_mod("mods/simple/2_logits.py"), profiler=profiler)
+    SimHost([mod], tokenizer=tokenizer, max_new_tokens=4).run([[{"role": "user", "content": "hi"}]])
+    assert profiler.snapshot() == {}
+    profiler.enable()
+    SimHost([mod], tokenizer=tokenizer, max_new_tokens=4).run([[{"role": "user", "content": "hi"}]])
+    assert profiler.snapshot()[mod.name]["BatchedForwardPass"]["calls"] > 0
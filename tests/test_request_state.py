@@ -0,0 +1,82 @@
+import logging
+
+from mods.utils.request_state import LRU, MEMORY, RELEASED, TTL, RequestStore, complete_request
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Sized:
+    def __init__(self, n: int):
+        self.n = n
+
+    def nbytes(self) -> int:
+        return self.n
+
+
+def store(**kwargs) -> RequestStore:
+    evictions = []
+    kwargs.setdefault("clock", Clock())
+    s = RequestStore(list, on_evict=lambda rid, value, reason: evictions.append((rid, reason)), **kwargs)
+    s.evictions = evictions
+    return s
+
+
+def test_get_creates_once_and_release_forgets():
+    s = store()
+    s.get("a").append(1)
+    assert s.get("a") == [1]
+    assert s.release("a") == [1]
+    assert "a" not in s and not s.evicted("a")
+    assert s.evictions == [("a", RELEASED)]
+
+
+def test_ttl_sweep_evicts_idle_entries_and_remembers_them():
+    clock = Clock()
+    s = store(ttl=10.0, sweep_interval=1.0, clock=clock)
+    s.get("idle")
+    clock.now = 8.0
+    s.get("busy")
+    clock.now = 12.0
+    s.get("busy")
+    assert "idle" not in s and "busy" in s
+    assert s.evicted("idle") and s.evictions == [("idle", TTL)]
+    complete_request("idle")
+    assert not s.evicted("idle")
+
+
+def test_lru_bound_keeps_most_recently_used():
+    s = store(max_entries=2)
+    s.get("a")
+    s.get("b")
+    s.get("a")
+    s.get("c")
+    assert [rid for rid, _ in s.items()] == ["a", "c"]
+    assert s.evictions == [("b", LRU)]
+    assert s.stats()[LRU] == 1
+
+
+def test_memory_bound_evicts_oldest_but_never_the_request_in_use():
+    s = RequestStore(Sized, max_bytes=100, measure_every=1, clock=Clock())
+    s.get("a", 60)
+    s.get("b", 60)
+    assert "a" not in s and s.evicted("a")
+    s.get("c", 200)
+    assert "c" in s and "b" not in s
+    assert s.stats()[MEMORY] == 2
+
+
+def test_ttl_evictions_log_at_debug_and_recent_lru_evictions_warn(caplog):
+    clock = Clock()
+    s = store(ttl=10.0, sweep_interval=0.0, max_entries=1, recent=5.0, clock=clock)
+    with caplog.at_level(logging.DEBUG, logger="mods.utils.request_state"):
+        s.get("old")
+        clock.now = 20.0
+        s.get("new")
+        s.get("newer")
+    assert [(r.levelno, r.args[2]) for r in caplog.records] == [(logging.DEBUG, TTL), (logging.WARNING, LRU)]
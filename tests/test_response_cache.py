@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+
+from mods.utils.interning import tokenizer_hash
+from mods.utils.response_cache import FIRST, FOLLOWUP, CannedResponse, ResponseCache, normalize
+from sim import sdk
+from sim.tokenizer import FakeTokenizer
+
+
+def user(*turns):
+    return [{"role": "user", "content": t} for t in turns]
+
+
+def write_table(path, responses, mtime):
+    path.write_text(json.dumps({"responses": responses}))
+    os.utime(path, (mtime, mtime))
+
+
+def test_normalize_ignores_case_punctuation_and_spacing():
+    assert normalize("  Hello,   THERE!! ") == "hello there"
+
+
+def test_lookup_respects_turn_position(tokenizer):
+    cache = ResponseCache({"hi": CannedResponse("Hello!", when=FIRST), "thanks": CannedResponse("Welcome.", when=FOLLOWUP)})
+    assert tokenizer.decode(cache.lookup(user("Hi!"), tokenizer)) == "Hello!"
+    assert cache.lookup(user("Thanks"), tokenizer) is None
+    assert tokenizer.decode(cache.lookup(user("Hi!", "thanks."), tokenizer)) == "Welcome."
+    assert cache.lookup(user("hi there"), tokenizer) is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_fuzzy_lookup_accepts_near_misses(tokenizer):
+    cache = ResponseCache({"good morning": "Morning!"}, fuzzy=0.8)
+    assert tokenizer.decode(cache.lookup(user("good mornin"), tokenizer)) == "Morning!"
+    assert cache.lookup(user("good night"), tokenizer) is None
+    assert cache.stats()["fuzzy_hits"] == 1
+
+
+def test_file_table_reloads_when_it_changes(tmp_path, tokenizer):
+    path = tmp_path / "responses.json"
+    write_table(path, [{"match": ["hi"], "reply": "Hello!"}], 1000)
+    clock = [0.0]
+    cache = ResponseCache(path=str(path), reload_interval=1.0, clock=lambda: clock[0])
+    assert tokenizer.decode(cache.lookup(user("hi"), tokenizer)) == "Hello!"
+    write_table(path, [{"match": ["hi"], "reply": "Hey."}], 2000)
+    assert tokenizer.decode(cache.lookup(user("hi"), tokenizer)) == "Hello!"    # not checked yet
+    clock[0] = 5.0
+    assert tokenizer.decode(cache.lookup(user("hi"), tokenizer)) == "Hey."
+    assert cache.stats()["reloads"] == 1
+
+
+def test_file_token_ids_are_used_only_for_their_tokenizer(tmp_path, tokenizer):
+    other = FakeTokenizer(vocab_size=300, seed=1)
+    path = tmp_path / "responses.json"
+    marked = [7, 7, 7]
+    write_table(path, [
+        {"match": ["hi"], "reply": "Hello!", "token_ids": marked, "tokenizer": tokenizer_hash(tokenizer)},
+        {"match": ["bye"], "reply": "Bye!", "token_ids": marked},
+    ], 1000)
+    cache = ResponseCache(path=str(path))
+    assert cache.lookup(user("hi"), tokenizer) == marked
+    assert other.decode(cache.lookup(user("hi"), other)) == "Hello!"
+    assert tokenizer.decode(cache.lookup(user("bye"), tokenizer)) == "Bye!"
+
+
+def test_reload_during_lookups_never_fails(tmp_path, tokenizer):
+    path = tmp_path / "responses.json"
+    write_table(path, [{"match": ["hi"], "reply": "Hello!"}], 1000)
+    cache = ResponseCache({"thanks": "Welcome."}, path=str(path), reload_interval=0.0)
+    errors = []
+
+    def look():
+        try:
+            for _ in range(300):
+                assert cache.lookup(user("Hi", "thanks"), tokenizer) is not None
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=look) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for i in range(100):
+        write_table(path, [{"match": ["hi"], "reply": f"Hello {i}!"}], 2000 + i)
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_force_output_mod_answers_greeting(tokenizer, load_mod):
+    force_output = load_mod("mods/simple/5_force_output.py")
+    sdk.set_conversation(user("Hello there!"))
+    action = force_output(sdk.Prefilled("r0", sdk.ContextInfo([1], 1)), sdk.ActionBuilder(), tokenizer)
+    assert action.kind == "force_output"
+    assert tokenizer.decode(action.args[0]) == "Hi! How can I help you today?"
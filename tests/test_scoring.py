@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from mods.utils.scoring import ScoreSequence, score_sequence, scored_from_logits
+from sim import sdk
+from sim.host import LocalScoringHost
+from sim.model import SyntheticModel
+
+
+def log_softmax(x):
+    m = x.max(axis=-1, keepdims=True)
+    return x - m - np.log(np.exp(x - m).sum(axis=-1, keepdims=True))
+
+
+def test_scored_from_logits_matches_log_softmax():
+    rng = np.random.default_rng(0)
+    logits = rng.normal(scale=4.0, size=(3, 50)).astype(np.float32)
+    request = ScoreSequence([4, 17, 0], tau=0.5, tag="t")
+    scored = scored_from_logits("r0", request, logits)
+    x = logits.astype(np.float64)
+    np.testing.assert_allclose(scored.logprobs(), log_softmax(x)[np.arange(3), [4, 17, 0]], rtol=1e-6)
+    np.testing.assert_allclose(scored.logprobs_tau(), log_softmax(x / 0.5)[np.arange(3), [4, 17, 0]], rtol=1e-6)
+    assert scored.tag == "t"
+
+
+def test_one_pass_score_matches_token_by_token():
+    host = LocalScoringHost(SyntheticModel(vocab_size=300))
+    sequence = [5, 9, 200, 31, 7]
+    request = ScoreSequence([12, 40, 3], rewind=2, tau=0.7)
+    fast = host.score("r0", sequence, request)
+    slow = host.score_stepwise("r0", sequence, request)
+    np.testing.assert_allclose(fast.logprobs(), slow.logprobs(), atol=1e-5)
+    np.testing.assert_allclose(fast.logprobs_tau(), slow.logprobs_tau(), atol=1e-5)
+
+
+def test_score_sequence_needs_host_support():
+    class OldBuilder:
+        pass
+
+    assert score_sequence(OldBuilder(), [1, 2]) is None
+    action = score_sequence(sdk.ActionBuilder(), np.array([1, 2]), rewind=1, tag="x")
+    assert action.kind == "score_sequence"
+    assert action.args[0] == ScoreSequence([1, 2], 1, 1.0, "x")
+    assert all(type(t) is int for t in action.args[0].token_ids)
+
+
+@pytest.mark.parametrize("rewind", [0, 3])
+def test_rewind_scores_against_shorter_context(rewind):
+    model = SyntheticModel(vocab_size=300)
+    host = LocalScoringHost(model)
+    sequence = [5, 9, 200, 31, 7]
+    scored = host.score("r0", sequence, ScoreSequence([12], rewind=rewind))
+    expected = log_softmax(model.next_logits(sequence[:len(sequence) - rewind]).astype(np.float64))[12]
+    assert scored.logprobs()[0] == pytest.approx(expected, abs=1e-5)
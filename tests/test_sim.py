@@ -0,0 +1,48 @@
+from mods.utils.request_state import RequestStore
+from sim import sdk
+from sim.loop import SimHost
+
+CONVERSATION = [{"role": "user", "content": "Say hi."}]
+
+
+def test_requests_finish_and_release_state(tokenizer):
+    store = RequestStore(list, name="seen")
+
+    def remember(event, action, tokenizer):
+        store.get(event.request_id).append(type(event).__name__)
+        return action.noop()
+
+    host = SimHost([remember], tokenizer=tokenizer, max_new_tokens=6, ignore_eos=True)
+    done = host.run([CONVERSATION] * 3, batch_size=2)
+    assert [req.finished for req in done] == ["length"] * 3
+    assert all(len(req.generated) == 6 for req in done)
+    # complete_request ran for every request, as a serving host would
+    assert len(store) == 0 and store.stats()["released"] == 3
+
+
+def test_backtracked_eos_does_not_end_request(tokenizer, scripted):
+    eos = tokenizer.eos_token_id
+    said, more = tokenizer.encode("Hi"), tokenizer.encode(" more")
+    removed = []
+
+    def keep_going(event, action, tokenizer):
+        if isinstance(event, sdk.Added) and eos in event.added_tokens and not removed:
+            removed.append(event.added_tokens)
+            return action.backtrack(1, more)
+        return action.noop()
+
+    host = SimHost([scripted(said + [eos]), keep_going], tokenizer=tokenizer, max_new_tokens=12)
+    [req] = host.run([CONVERSATION])
+    assert removed == [[eos]]
+    assert req.generated[:len(said) + len(more)] == said + more
+    assert len(req.generated) > len(said) + len(more)
+
+
+def test_forced_eos_ends_request(tokenizer):
+    def stop(event, action, tokenizer):
+        if isinstance(event, sdk.Added) and not event.forced:
+            return action.force_tokens([tokenizer.eos_token_id])
+        return action.noop()
+
+    [req] = SimHost([stop], tokenizer=tokenizer, max_new_tokens=8, ignore_eos=True).run([CONVERSATION])
+    assert req.finished == "eos" and len(req.generated) == 2
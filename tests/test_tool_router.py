@@ -0,0 +1,58 @@
+import pytest
+
+from mods.utils.tool_router import ARGS_JSON, ToolRouter, ToolTrigger
+from sim import sdk
+
+TURN = "Weather in Paris please"
+TRIGGERS = {
+    "exact": dict(exact="weather in paris please"),
+    "prefix": dict(prefix="weather in"),
+    "token_ids": dict(token_ids="Paris"),
+    "regex": dict(regex=r"weather in (?P<city>\w+).*"),
+}
+
+
+def router(*kinds, **priorities):
+    return ToolRouter([ToolTrigger(kind, {"kind": kind}, priority=priorities.get(kind, 0), **TRIGGERS[kind]) for kind in kinds])
+
+
+@pytest.mark.parametrize("kinds, winner", [
+    (("regex", "token_ids", "prefix", "exact"), "exact"),
+    (("regex", "token_ids", "prefix"), "prefix"),
+    (("regex", "token_ids"), "token_ids"),
+    (("regex",), "regex"),
+])
+def test_anchored_kinds_outrank_substring_and_regex(tokenizer, kinds, winner):
+    assert router(*kinds).route(TURN, tokenizer).trigger.name == winner
+
+
+def test_priority_outranks_kind(tokenizer):
+    assert router("exact", "regex", regex=-1).route(TURN, tokenizer).trigger.name == "regex"
+
+
+def test_token_ids_fire_anywhere_in_the_turn(tokenizer):
+    r = router("token_ids", "exact")
+    assert r.route("Tell me about Paris.", tokenizer).trigger.name == "token_ids"
+    assert r.route("Paris", tokenizer).trigger.name == "token_ids"
+    assert r.route("Tell me about London.", tokenizer) is None
+    # Without a tokenizer or token IDs only the text triggers run
+    assert r.route("Tell me about Paris.") is None
+
+
+def test_prefix_and_regex_extract_arguments(tokenizer):
+    assert router("prefix").route("  WEATHER in   Rome ", tokenizer).args == {"rest": "rome"}
+    assert router("regex").route("weather in Oslo today", tokenizer).args == {"city": "Oslo"}
+
+
+def test_payload_template():
+    trigger = ToolTrigger("lookup", {"id": "{call_id}", "args": ARGS_JSON, "city": "{city}", "raw": "{x}"}, regex=r"in (?P<city>\w+)")
+    payload = ToolRouter([trigger]).route("in Rome").payload("abc-123")
+    assert payload == {"id": "call_abc", "args": '{"city": "Rome"}', "city": "Rome", "raw": "{x}"}
+
+
+def test_tool_calls_mod_routes_exact_turn(tokenizer, load_mod):
+    tool_calls = load_mod("mods/simple/6_tool_calls.py")
+    sdk.set_conversation([{"role": "user", "content": "<tool_call>call_search()</tool_call>"}])
+    action = tool_calls(sdk.Prefilled("r0-1", sdk.ContextInfo([1], 1)), sdk.ActionBuilder(), tokenizer)
+    assert action.kind == "tool_calls"
+    assert action.args[0]["function"]["name"] == "call_search"
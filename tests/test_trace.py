@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from mods.utils.trace import F16, FORWARD_PASS, NONE, Q8, TOPK, TraceReader, TraceWriter, traced
+from sim import sdk
+from sim.loop import SimHost
+from sim.replay import replay
+
+CONVERSATIONS = [[{"role": "user", "content": "Say hi."}], [{"role": "user", "content": "Write a JSON object."}]]
+
+
+def record(path, tokenizer, mod, logits=TOPK, k=64, n=4, max_new_tokens=24, block_events=4096):
+    with TraceWriter(str(path), logits=logits, k=k, tokenizer=tokenizer, block_events=block_events) as writer:
+        host = SimHost([traced(writer, mod)], tokenizer=tokenizer, max_new_tokens=max_new_tokens)
+        return host.run([CONVERSATIONS[i % len(CONVERSATIONS)] for i in range(n)], batch_size=2)
+
+
+def test_events_round_trip(tmp_path, tokenizer, load_mod):
+    path = tmp_path / "run.trace"
+    done = record(path, tokenizer, load_mod("mods/simple/4_backtrack.py"), block_events=16)
+    with TraceReader(str(path)) as trace:
+        events = list(trace)
+    assert {ev.request_id for ev in events} == {req.request_id for req in done}
+    for req in done:
+        mine = [ev for ev in events if ev.request_id == req.request_id]
+        assert mine[0].kind_name == "Prefilled"
+        assert mine[0].tokens.tolist() == req.prompt_ids
+        assert mine[0].conversation == req.conversation
+        # Without backtracks the Added events spell out the response
+        added = [t for ev in mine if ev.kind_name == "Added" for t in ev.tokens.tolist()]
+        assert added == req.generated
+        assert sum(ev.kind == FORWARD_PASS for ev in mine) == req.steps
+
+
+@pytest.mark.parametrize("mode, atol", [(F16, 1e-2), (Q8, None)])
+def test_logits_round_trip(tmp_path, mode, atol):
+    rng = np.random.default_rng(0)
+    rows = rng.normal(scale=3.0, size=(5, 300)).astype(np.float32)
+    path = tmp_path / f"{mode}.trace"
+    with TraceWriter(str(path), logits=mode) as writer:
+        for row in rows:
+            writer.record(sdk.ForwardPass("r0"), None, row)
+    with TraceReader(str(path)) as trace:
+        restored = np.stack([ev.logits() for ev in trace])
+    if atol is None:
+        # uint8 with a per-row range: at most half a step off
+        atol = (rows.max(axis=1) - rows.min(axis=1))[:, None] / 255 / 2 + 1e-5
+    assert np.all(np.abs(restored - rows) <= atol)
+
+
+def test_topk_keeps_top_ids_and_log_sum_exp(tmp_path):
+    rng = np.random.default_rng(1)
+    row = rng.normal(scale=3.0, size=1000).astype(np.float32)
+    path = tmp_path / "topk.trace"
+    with TraceWriter(str(path), logits=TOPK, k=16) as writer:
+        writer.record(sdk.ForwardPass("r0"), None, row)
+    with TraceReader(str(path)) as trace:
+        [ev] = list(trace)
+        restored = ev.logits()
+    top = np.argsort(row)[-16:]
+    np.testing.assert_allclose(restored[top], row[top], atol=1e-2)
+    # Exact up to the float16 rounding of the stored top values
+    lse = lambda x: float(np.log(np.exp(x - x.max()).sum()) + x.max())
+    assert lse(restored) == pytest.approx(lse(row), abs=1e-2)
+
+
+def test_conversation_that_json_cannot_hold_is_kept_as_repr(tmp_path):
+    path = tmp_path / "conv.trace"
+    marker = object()
+    with TraceWriter(str(path), logits=NONE) as writer:
+        writer.record(sdk.Prefilled("r0", sdk.ContextInfo([1, 2], 2)), None, None, [{"role": "user", "content": marker}])
+    with TraceReader(str(path)) as trace:
+        [ev] = list(trace)
+    assert ev.conversation == [{"role": "user", "content": repr(marker)}]
+
+
+def test_replay_reproduces_recorded_actions(tmp_path, tokenizer, load_mod):
+    path = tmp_path / "replay.trace"
+    record(path, tokenizer, load_mod("mods/scaffolding/valid_json.py"), logits=F16)
+    result = replay(str(path), load_mod("mods/scaffolding/valid_json.py"), tokenizer=tokenizer)
+    assert result.events > 0
+    assert result.diffs == []
+
+
+def test_blocks_hold_reduced_rows_and_are_written_off_the_event_path(tmp_path):
+    rng = np.random.default_rng(2)
+    rows = rng.normal(size=(6, 500)).astype(np.float32)
+    path = tmp_path / "blocks.trace"
+    with TraceWriter(str(path), logits=TOPK, k=8, block_events=4) as writer:
+        for row in rows:
+            writer.record(sdk.ForwardPass("r0"), None, row)
+        # The first block went to the writer thread; the second holds only top-k entries
+        assert [a.size for a in writer._rows[0]] == [8, 8, 1]
+        writer.flush()
+        assert path.stat().st_size > 0 and writer._rows == []
+    with TraceReader(str(path)) as trace:
+        assert [block.n for block in trace.blocks] == [4, 2]
+        restored = np.stack([ev.logits() for ev in trace])
+    top = np.argsort(rows, axis=1)[:, -8:]
+    np.testing.assert_allclose(np.take_along_axis(restored, top, 1), np.take_along_axis(rows, top, 1), atol=1e-2)
+
+
+def test_without_masks_adjust_logits_digests_only_the_kind(tmp_path, tokenizer, load_mod):
+    path = tmp_path / "nomask.trace"
+    with TraceWriter(str(path), logits=NONE, masks=False) as writer:
+        host = SimHost([traced(writer, load_mod("mods/simple/2_logits.py"))], tokenizer=tokenizer, max_new_tokens=4)
+        host.run([CONVERSATIONS[0]])
+    with TraceReader(str(path)) as trace:
+        adjusted = [ev for ev in trace if ev.action_kind == "adjust_logits"]
+        assert adjusted and {ev.action_size for ev in adjusted} == {0}
+        assert adjusted[0].logits().size == tokenizer.vocab_size
+    assert replay(str(path), load_mod("mods/simple/2_logits.py"), tokenizer=tokenizer).diffs == []
@@ -0,0 +1,72 @@
+from mods.utils.triggers import BACKTRACK, FORCE, AhoCorasick, TriggerRule, TriggerSet
+from sim import sdk
+from sim.loop import SimHost
+
+PHRASE = " I can't help with that"
+REPLACEMENT = "I can help you with that: "
+
+
+def test_aho_corasick_reports_overlapping_patterns():
+    automaton = AhoCorasick(["he", "she", "hers"])
+    node, found = 0, []
+    for i, ch in enumerate("ushers"):
+        node = automaton.step(node, ch)
+        found.extend((i, p) for p in automaton.outputs[node])
+    assert sorted(found) == [(3, 0), (3, 1), (5, 2)]
+
+
+def test_backtrack_covers_phrase_split_across_tokens_and_events(tokenizer):
+    matcher = TriggerSet([TriggerRule(PHRASE, kind=BACKTRACK, replacement=REPLACEMENT)]).matcher(tokenizer)
+    before = tokenizer.encode("Well,")
+    phrase = tokenizer.encode(PHRASE)
+    after = tokenizer.encode(" today.")
+    assert matcher.extend(before + phrase[:2]) is None
+    match = matcher.extend(phrase[2:] + after)
+    # Tokens after the phrase in the same event are removed too
+    assert match.start_token == len(before)
+    assert match.n_tokens == len(phrase) + len(after)
+    action = matcher.apply(match, sdk.ActionBuilder())
+    assert action.kind == "backtrack"
+    assert action.args == (len(phrase) + len(after), tokenizer.encode(REPLACEMENT))
+    assert matcher.detok.token_ids == before
+
+
+def test_phrase_starting_inside_a_token_keeps_the_text_before_it(tokenizer):
+    matcher = TriggerSet([TriggerRule("tually", kind=BACKTRACK, replacement="!")]).matcher(tokenizer)
+    tokens = tokenizer.encode("Sure.Actually")
+    match = matcher.extend(tokens)
+    assert matcher.detok.char_offsets[match.start_token] < len("Sure.Ac")
+    n, replacement = matcher.apply(match, sdk.ActionBuilder()).args
+    kept = tokens[:len(tokens) - n] + replacement
+    assert tokenizer.decode(kept) == "Sure.Ac!"
+    matcher.extend(replacement, report=False)
+    assert matcher.detok.text == "Sure.Ac!"
+
+
+def test_forced_tokens_do_not_retrigger(tokenizer):
+    matcher = TriggerSet([TriggerRule("hello", kind=FORCE, replacement="hello and goodbye.")]).matcher(tokenizer)
+    match = matcher.extend(tokenizer.encode("hello"))
+    assert match is not None and match.rule.kind == FORCE
+    assert matcher.extend(match.replacement_ids, report=False) is None
+
+
+def test_undo_rollback_restores_matcher(tokenizer):
+    matcher = TriggerSet([TriggerRule(PHRASE)]).matcher(tokenizer)
+    tokens = tokenizer.encode("Sorry," + PHRASE)
+    match = matcher.extend(tokens)
+    matcher.apply(match, sdk.ActionBuilder())
+    assert len(matcher) < len(tokens)
+    matcher.undo_rollback()
+    assert matcher.detok.token_ids == tokens
+    # The restored state continues the stream without reporting the phrase again
+    assert matcher.extend(tokenizer.encode(" now.")) is None
+
+
+def test_backtrack_mod_replaces_phrase_on_sim_host(tokenizer, load_mod, scripted):
+    backtrack = load_mod("mods/simple/4_backtrack.py")
+    script = tokenizer.encode("Sorry," + PHRASE)
+    host = SimHost([scripted(script), backtrack], tokenizer=tokenizer, max_new_tokens=len(script) + 12, ignore_eos=True)
+    [req] = host.run([[{"role": "user", "content": "hi"}]])
+    text = tokenizer.decode(req.generated)
+    assert text.startswith("Sorry," + REPLACEMENT)
+    assert PHRASE not in text
@@ -0,0 +1,40 @@
+import numpy as np
+
+from mods.utils.vocab_index import BannedStrings, VocabIndex, get_vocab_index
+from sim import sdk
+
+TOKENS = ["", "a", "ab", "bab", "cab", "xyz", "b"]
+
+
+def test_containing_matches_a_linear_scan():
+    index = VocabIndex(TOKENS)
+    for substring in ("a", "ab", "ba", "b", "z", "q"):
+        expected = [tid for tid, text in enumerate(TOKENS) if substring in text]
+        assert index.containing(substring).tolist() == expected
+    assert index.containing("ab") is index.containing("ab")
+
+
+def test_ban_ids_is_a_sorted_union():
+    index = VocabIndex(TOKENS)
+    assert index.ban_ids(["xyz", "ab", "ca"]).tolist() == [2, 3, 4, 5]
+    assert index.ban_ids([]).tolist() == []
+
+
+def test_banned_strings_mask_batched_rows(tokenizer):
+    banned = BannedStrings(["the"])
+    logits = np.zeros((2, len(tokenizer)), dtype=np.float32)
+    banned.apply(logits, tokenizer)
+    ids = get_vocab_index(tokenizer, len(tokenizer)).containing("the")
+    assert len(ids) > 0
+    assert np.all(logits[:, ids] == banned.value)
+    assert np.count_nonzero(logits) == 2 * len(ids)
+
+
+def test_ban_strings_resolves_at_prefilled(tokenizer, load_mod):
+    ban_strings = load_mod("mods/scaffolding/ban_strings.py")
+    banned = ban_strings.__globals__["BANNED"]
+    ban_strings(sdk.Prefilled("r0", sdk.ContextInfo([1], 1)), sdk.ActionBuilder(), tokenizer)
+    warm = banned._ids.get(tokenizer)[len(tokenizer)]
+    logits = sdk.Tensor.from_numpy(np.zeros(len(tokenizer), dtype=np.float32))
+    ban_strings(sdk.ForwardPass("r0", logits), sdk.ActionBuilder(), tokenizer)
+    assert banned.ids(tokenizer, len(tokenizer)) is warm